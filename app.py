@@ -1,26 +1,11 @@
 import dash
 from dash import ClientsideFunction, Input, Output, State, dcc, html
 
-PHRASES = [
-    {
-        "native": "שלום, שמי ח'אלד, אני אכלתי היום עגבניות",
-        "arabic_transliteration": "מַרְחַבַּא, אִסְמִי חַ'אלֵד, אַנַא אַכַּלֵת אֵלְיוֹם בַּנְדוֹרַה",
-        "hint": "",
-    },
-    {
-        "native": "-ועליכם השלום, שמי דאוּד, הכבוד הוא לי יַא חַ'אלֵד",
-        "arabic_transliteration": "וּעַלֵיכֹּם אֵ(ל)סַّלַאם! אִסמִ-י דַאוּד, אֵ(ל)שַّרַף אִלִי יַא חַ'אלֵד!",
-        "hint": "",
-    },
-    # {
-    #     "native": "שם משפחתי יוּסף, אני גר בשכונה גדולה",
-    #     "hint": "",
-    # },
-    # {
-    #     "native": "אני ישבתי על כיסא גדול",
-    #     "hint": "",
-    # },
-]
+from phrases import catalog
+
+# First page of the catalog; the browser fetches later pages from /api/phrases as the learner advances.
+_first_page, _next_cursor = catalog.page()
+PHRASES = [phrase.to_dict() for phrase in _first_page]
 
 app = dash.Dash(
     __name__,
@@ -33,11 +18,13 @@ server = app.server
 app.layout = html.Div(
     className="page",
     children=[
+        dcc.Store(id="phrase-list-store", data={"items": PHRASES, "next": _next_cursor}),
         dcc.Store(id="current-phrase-store", data=PHRASES[0]),
         dcc.Store(id="api-response-store"),
         html.Div(id="speech-trigger", style={"display": "none"}),
         html.Div(id="play-trigger", style={"display": "none"}),
         html.Div(id="download-trigger", style={"display": "none"}),
+        html.Div(id="reference-trigger", style={"display": "none"}),
         html.Header(
             className="hero",
             children=[
@@ -63,6 +50,7 @@ app.layout = html.Div(
                             children=PHRASES[0]["hint"],
                         ),
                         html.Button("משפט הבא", id="next-phrase-btn", className="ghost"),
+                        html.Button("השמע הגייה", id="play-reference-btn", className="ghost"),
                         html.P("לחיצה ארוכה להקלטה, ואז שחרור לניתוח."),
                         html.Button("לחצו והחזיקו להקלטה", id="record-button", className="primary"),
                         html.Div(id="output-status", className="status"),
@@ -116,24 +104,29 @@ app.clientside_callback(
     State("api-response-store", "data"),
 )
 
+app.clientside_callback(
+    ClientsideFunction(namespace="audio", function_name="playReference"),
+    Output("reference-trigger", "children"),
+    Input("play-reference-btn", "n_clicks"),
+    State("current-phrase-store", "data"),
+)
+
 
-@app.callback(
+# Phrase switching and result rendering run in the browser; the server only answers /api calls.
+app.clientside_callback(
+    ClientsideFunction(namespace="audio", function_name="setPhrase"),
     [
         Output("current-phrase-store", "data"),
         Output("phrase-text", "children"),
         Output("phrase-hint", "children"),
+        Output("phrase-list-store", "data"),
     ],
     Input("next-phrase-btn", "n_clicks"),
+    State("phrase-list-store", "data"),
 )
-def set_phrase(n_clicks):
-    idx = (n_clicks or 0) % len(PHRASES)
-    phrase = PHRASES[idx]
-    native = phrase["native"]
-    hint = phrase["hint"]
-    return phrase, f"משפט: {native}", hint
 
-
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction(namespace="audio", function_name="updateOutput"),
     [
         Output("transcription-output", "children"),
         Output("compare-output", "children"),
@@ -144,73 +137,11 @@ def set_phrase(n_clicks):
     Input("api-response-store", "data"),
     State("current-phrase-store", "data"),
 )
-def update_output(data, phrase_data):
-    if data is None:
-        return "", "", "", "", "לחצו והחזיקו להקלטה כדי להתחיל."
-
-    if "error" in data:
-        return "", "", "", "", f"שגיאה: {data['error']}"
-
-    transcription = data.get("transcription") or ""
-    feedback = data.get("feedback") or ""
-    translation_score = data.get("translation_score") or data.get("score") or 0
-    pronunciation_score = data.get("pronunciation_score") or data.get("score") or 0
-    target_translit = (phrase_data or {}).get("arabic_transliteration") or ""
-
-    def score_pill(label, icon, score_val):
-        pct = max(0, min(int(score_val), 100))
-        return html.Div(
-            className="score-pill",
-            children=[
-                html.Div(f"{icon} {label}", className="pill-label"),
-                html.Div(
-                    className="pill-bar",
-                    children=[
-                        html.Div(
-                            className="pill-fill",
-                            style={"width": f"{pct}%"},
-                        ),
-                        html.Div(f"{pct}%", className="pill-text"),
-                    ],
-                ),
-            ],
-        )
-
-    score_block = html.Div(
-        className="score-stack",
-        children=[
-            score_pill("דיוק תרגום", "💬", translation_score),
-            score_pill("הגייה", "🎙", pronunciation_score),
-        ],
-    )
-
-    compare_block = html.Div(
-        className="compare-block",
-        children=[
-            html.Div(
-                className="compare-row",
-                children=[
-                    html.Span("תעתיק יעד", className="compare-label"),
-                    html.Span(target_translit or "—", className="compare-text"),
-                ],
-            ),
-            html.Div(
-                className="compare-row",
-                children=[
-                    html.Span("תעתיק משתמש", className="compare-label"),
-                    html.Span(transcription or "—", className="compare-text"),
-                ],
-            ),
-        ],
-    )
-
-    # We rely on client-side TTS for audio; still show text for clarity.
-    return f"תמלול: {transcription}", compare_block, score_block, f"משוב: {feedback}", "מוכן לניגון קולי."
-
 
 
 if __name__ == "__main__":
-    # Run the combined FastAPI + Dash app to ensure /api/analyze is available.
+    # Run the combined FastAPI + Dash app to ensure /api/analyze is available (development,
+    # with auto-reload; production runs `gunicorn -c gunicorn.conf.py main:server`).
     import uvicorn
 
     uvicorn.run("main:server", host="0.0.0.0", port=10000, reload=True)
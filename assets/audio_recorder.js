@@ -10,6 +10,7 @@
     voicesReady: false,
     pendingSpeech: null,
     userActivatedAudio: false,
+    feedbackAudio: null,
   };
 
   const setStatus = (text) => {
@@ -64,6 +65,188 @@
     window.speechSynthesis.speak(utterance);
   };
 
+  const newRequestId = () =>
+    window.crypto && window.crypto.randomUUID
+      ? window.crypto.randomUUID()
+      : `${Date.now()}-${Math.random().toString(16).slice(2)}`;
+
+  // Anonymous id kept in this browser, so attempts add up in the learner's history.
+  const learnerId = () => {
+    try {
+      let id = window.localStorage.getItem("coach_learner_id");
+      if (!id) {
+        id = newRequestId();
+        window.localStorage.setItem("coach_learner_id", id);
+      }
+      return id;
+    } catch (err) {
+      // Storage blocked (e.g. private mode): attempts are simply not recorded.
+      return null;
+    }
+  };
+
+  const fetchWithRetry = async (url, options, retries = 2) => {
+    for (let attempt = 0; ; attempt += 1) {
+      try {
+        return await fetch(url, options);
+      } catch (err) {
+        // Network failure (flaky mobile link); HTTP errors are returned, not retried.
+        if (attempt >= retries) throw err;
+        await new Promise((r) => setTimeout(r, 500 * (attempt + 1)));
+      }
+    }
+  };
+
+  const readError = async (response) => {
+    // FastAPI errors are {"detail": "..."} or, for rejected recordings, {"detail": {code, message}}.
+    const text = await response.text();
+    const status = response.status;
+    try {
+      const detail = JSON.parse(text).detail;
+      if (detail && typeof detail === "object") {
+        return { error: detail.message || "הניתוח נכשל.", code: detail.code, status };
+      }
+      if (detail) return { error: String(detail), status };
+    } catch (e) {
+      /* not JSON */
+    }
+    return { error: text || "הניתוח נכשל.", status };
+  };
+
+  // Recorder timeslice: each slice is uploaded while the learner is still speaking.
+  const CHUNK_MS = 1000;
+
+  const openUpload = async () => {
+    try {
+      const response = await fetch("/api/uploads", { method: "POST" });
+      return response.ok ? (await response.json()).upload_id : null;
+    } catch (err) {
+      return null;
+    }
+  };
+
+  const pushChunks = async (upload, chunks) => {
+    // Sends whatever the server has not acknowledged yet, in order. A resent chunk is
+    // acknowledged without being stored twice; a 409 names the chunk to resume from.
+    while (upload.sent < chunks.length) {
+      const seq = upload.sent;
+      const response = await fetchWithRetry(`/api/uploads/${upload.id}/chunks/${seq}`, {
+        method: "PUT",
+        body: chunks[seq],
+      });
+      if (response.status === 409) {
+        const detail = (await response.json()).detail || {};
+        if (typeof detail.next_seq !== "number" || detail.next_seq > chunks.length) {
+          throw new Error("Upload out of sync.");
+        }
+        upload.sent = detail.next_seq;
+      } else if (!response.ok) {
+        throw new Error(`Chunk upload failed (${response.status}).`);
+      } else {
+        upload.sent = seq + 1;
+      }
+    }
+  };
+
+  const showPartial = (id, text) => {
+    // Interim text while the stream is open; update_output renders the final result.
+    if (window.dash_clientside && window.dash_clientside.set_props) {
+      window.dash_clientside.set_props(id, { children: text });
+    } else {
+      const el = document.getElementById(id);
+      if (el) el.textContent = text;
+    }
+  };
+
+  const readEvents = async function* (response) {
+    // Minimal text/event-stream parser over the fetch body.
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    for (;;) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      let end;
+      while ((end = buffer.indexOf("\n\n")) >= 0) {
+        const frame = buffer.slice(0, end);
+        buffer = buffer.slice(end + 2);
+        let event = "message";
+        const data = [];
+        frame.split("\n").forEach((line) => {
+          if (line.startsWith("event:")) event = line.slice(6).trim();
+          else if (line.startsWith("data:")) data.push(line.slice(5).trimStart());
+        });
+        if (data.length) yield { event, data: JSON.parse(data.join("\n")) };
+      }
+    }
+  };
+
+  const analyzeStreaming = async (formData) => {
+    const response = await fetchWithRetry("/api/analyze/stream", {
+      method: "POST",
+      body: formData,
+    });
+    if (!response.ok) return readError(response);
+    if (!response.body || !window.TextDecoder) return response.json();
+
+    let feedback = "";
+    for await (const { event, data } of readEvents(response)) {
+      if (event === "transcription") {
+        showPartial("transcription-output", `תמלול: ${data.transcription}`);
+        setStatus("מעריך...");
+      } else if (event === "feedback_delta") {
+        feedback += data.text;
+        showPartial("feedback-output", `משוב: ${feedback}`);
+      } else if (event === "scores") {
+        showPartial("score-output", `ציון: ${data.score}%`);
+      } else if (event === "result") {
+        return data;
+      } else if (event === "error") {
+        const detail = data.detail;
+        return detail && typeof detail === "object"
+          ? { error: detail.message || "הניתוח נכשל.", code: detail.code }
+          : { error: String(detail || "הניתוח נכשל.") };
+      }
+    }
+    return { error: "החיבור נותק לפני סיום הניתוח." };
+  };
+
+  // Dash component JSON, so clientside callbacks can return the same markup app.py used to build.
+  const h = (type, props) => ({ type, namespace: "dash_html_components", props });
+
+  const scorePill = (label, icon, scoreVal) => {
+    const pct = Math.max(0, Math.min(Math.trunc(Number(scoreVal)) || 0, 100));
+    return h("Div", {
+      className: "score-pill",
+      children: [
+        h("Div", { children: `${icon} ${label}`, className: "pill-label" }),
+        h("Div", {
+          className: "pill-bar",
+          children: [
+            h("Div", { className: "pill-fill", style: { width: `${pct}%` } }),
+            h("Div", { children: `${pct}%`, className: "pill-text" }),
+          ],
+        }),
+      ],
+    });
+  };
+
+  const compareRow = (label, text) =>
+    h("Div", {
+      className: "compare-row",
+      children: [
+        h("Span", { children: label, className: "compare-label" }),
+        h("Span", { children: text || "—", className: "compare-text" }),
+      ],
+    });
+
+  const pickTtsFormat = () => {
+    // Opus is far smaller than MP3; fall back where the browser cannot play it.
+    const probe = document.createElement("audio");
+    return probe.canPlayType && probe.canPlayType('audio/ogg; codecs="opus"') ? "opus" : "mp3";
+  };
+
   const startRecording = async () => {
     if (state.recorder) return;
 
@@ -72,6 +255,12 @@
       state.stream = await navigator.mediaDevices.getUserMedia({ audio: true });
       const recorder = new MediaRecorder(state.stream);
       const chunks = [];
+      // Chunked upload session; on any failure the whole recording is sent on release instead.
+      const upload = { id: null, sent: 0, failed: false, pending: null };
+      upload.pending = openUpload().then((id) => {
+        upload.id = id;
+        upload.failed = !id;
+      });
 
       state.recordPromise = new Promise((resolve, reject) => {
         state.resolve = resolve;
@@ -80,9 +269,17 @@
 
       recorder.ondataavailable = (event) => {
         if (event.data.size > 0) chunks.push(event.data);
+        upload.pending = upload.pending
+          .then(() => upload.failed || pushChunks(upload, chunks))
+          .catch(() => {
+            upload.failed = true;
+          });
       };
 
       recorder.onerror = (event) => {
+        upload.pending.then(() => {
+          if (upload.id) fetch(`/api/uploads/${upload.id}`, { method: "DELETE" }).catch(() => {});
+        });
         state.reject?.(event.error || new Error("Recording failed."));
         cleanup();
       };
@@ -91,35 +288,61 @@
         try {
           const blob = new Blob(chunks, { type: "audio/wav" });
           const file = new File([blob], "recording.wav", { type: "audio/wav" });
+          // Same key on every retry, so the server answers a repeat from its cache.
+          const idempotencyKey = newRequestId();
+
+          const buildForm = (uploaded) => {
+            const formData = new FormData();
+            if (uploaded) {
+              // The audio is already on the server; this only finalizes the session.
+              formData.append("upload_id", upload.id);
+              formData.append("chunks", String(chunks.length));
+            } else {
+              formData.append("file", file);
+            }
+            if (state.phraseData && state.phraseData.id) {
+              // The server looks the target up in its catalog.
+              formData.append("phrase_id", state.phraseData.id);
+            } else if (state.phraseData) {
+              if (state.phraseData.native) {
+                formData.append("phrase", state.phraseData.native);
+              }
+              if (state.phraseData.hint) {
+                formData.append("hint", state.phraseData.hint);
+              }
+              if (state.phraseData.arabic_transliteration) {
+                formData.append("arabic_transliteration", state.phraseData.arabic_transliteration);
+              }
+            }
+            formData.append("idempotency_key", idempotencyKey);
+            const learner = learnerId();
+            if (learner) {
+              formData.append("learner_id", learner);
+            }
+            return formData;
+          };
+
+          const submit = async (formData) => {
+            if (window.ReadableStream) {
+              // Transcription and feedback appear as they are produced.
+              return analyzeStreaming(formData);
+            }
+            const response = await fetchWithRetry("/api/analyze", {
+              method: "POST",
+              body: formData,
+            });
+            return response.ok ? response.json() : readError(response);
+          };
 
           setStatus("Analyzing...");
-          const formData = new FormData();
-          formData.append("file", file);
-          if (state.phraseData && state.phraseData.native) {
-            formData.append("phrase", state.phraseData.native);
-          }
-          if (state.phraseData && state.phraseData.hint) {
-            formData.append("hint", state.phraseData.hint);
-          }
-          if (state.phraseData && state.phraseData.arabic_transliteration) {
-            formData.append(
-              "arabic_transliteration",
-              state.phraseData.arabic_transliteration
-            );
-          }
-
-          const response = await fetch("/api/analyze", {
-            method: "POST",
-            body: formData,
-          });
-
-          if (!response.ok) {
-            const message = (await response.text()) || "הניתוח נכשל.";
-            state.resolve?.({ error: message });
-          } else {
-            const data = await response.json();
-            state.resolve?.(data);
+          await upload.pending;
+          const uploaded = !upload.failed && upload.id && upload.sent === chunks.length;
+          let result = await submit(buildForm(uploaded));
+          if (uploaded && result && (result.status === 404 || result.status === 409)) {
+            // The session expired or lost chunks (e.g. a server restart); send the whole recording.
+            result = await submit(buildForm(false));
           }
+          state.resolve?.(result);
         } catch (err) {
           state.reject?.(err);
         } finally {
@@ -129,7 +352,7 @@
       };
 
       state.recorder = recorder;
-      recorder.start();
+      recorder.start(CHUNK_MS);
     } catch (err) {
       cleanup();
       state.recordPromise = null;
@@ -211,6 +434,61 @@
 
         return { error: "לחצו והחזיקו את כפתור ההקלטה כדי להתחיל." };
       },
+      updateOutput: function (data, phraseData) {
+        if (!data) {
+          return ["", "", "", "", "לחצו והחזיקו להקלטה כדי להתחיל."];
+        }
+
+        if ("error" in data) {
+          if (data.code) {
+            // Recording rejected before analysis (too short, silent, clipped...); the message says what to fix.
+            return ["", "", "", "", `⚠️ ${data.error}`];
+          }
+          return ["", "", "", "", `שגיאה: ${data.error}`];
+        }
+
+        const transcription = data.transcription || "";
+        const feedback = data.feedback || "";
+        const translationScore = data.translation_score || data.score || 0;
+        const pronunciationScore = data.pronunciation_score || data.score || 0;
+        const targetTranslit = (phraseData || {}).arabic_transliteration || "";
+
+        const scoreBlock = h("Div", {
+          className: "score-stack",
+          children: [
+            scorePill("דיוק תרגום", "💬", translationScore),
+            scorePill("הגייה", "🎙", pronunciationScore),
+          ],
+        });
+
+        const compareBlock = h("Div", {
+          className: "compare-block",
+          children: [compareRow("תעתיק יעד", targetTranslit), compareRow("תעתיק משתמש", transcription)],
+        });
+
+        // We rely on client-side TTS for audio; still show text for clarity.
+        return [`תמלול: ${transcription}`, compareBlock, scoreBlock, `משוב: ${feedback}`, "מוכן לניגון קולי."];
+      },
+      setPhrase: async function (nClicks, phraseList) {
+        let list = phraseList;
+        let listUpdate = window.dash_clientside.no_update;
+        const wanted = nClicks || 0;
+        if (wanted >= list.items.length && list.next) {
+          // Only the next page is fetched, and only when the learner reaches it.
+          try {
+            const response = await fetch(`/api/phrases?cursor=${encodeURIComponent(list.next)}`);
+            if (response.ok) {
+              const page = await response.json();
+              list = { items: list.items.concat(page.items), next: page.next_cursor };
+              listUpdate = list;
+            }
+          } catch (err) {
+            /* offline: keep cycling through the phrases already loaded */
+          }
+        }
+        const phrase = list.items[wanted % list.items.length];
+        return [phrase, `משפט: ${phrase.native}`, phrase.hint, listUpdate];
+      },
       speakFeedback: function (data) {
         if (!data || !data.feedback || !window.speechSynthesis) {
           return window.dash_clientside.no_update;
@@ -249,33 +527,46 @@
         }
         return Date.now().toString();
       },
-      downloadFeedback: async function (nClicks, data) {
+      playReference: function (nClicks, phraseData) {
+        if (!nClicks || !phraseData || !phraseData.id) {
+          return window.dash_clientside.no_update;
+        }
+        // Pre-synthesized on the server; the browser fetches it with range requests as it plays.
+        if (state.feedbackAudio) state.feedbackAudio.pause();
+        const audio = new Audio(`/api/phrases/${encodeURIComponent(phraseData.id)}/audio`);
+        state.feedbackAudio = audio;
+        audio.onerror = () => setStatus("לא ניתן להשמיע את ההגייה.");
+        audio.play().catch(() => setStatus("לא ניתן להשמיע את ההגייה."));
+        return Date.now().toString();
+      },
+      downloadFeedback: function (nClicks, data) {
         if (!nClicks || !data || !data.feedback) {
           return window.dash_clientside.no_update;
         }
 
         try {
-          const response = await fetch("/api/tts", {
-            method: "POST",
-            headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({ text: data.feedback }),
+          const format = pickTtsFormat();
+          const query = new URLSearchParams({ text: data.feedback, format });
+
+          // Streamed URL: the browser starts playing as soon as the first chunks arrive.
+          query.set("stream", "1");
+          if (state.feedbackAudio) state.feedbackAudio.pause();
+          const audio = new Audio(`/api/tts?${query.toString()}`);
+          state.feedbackAudio = audio;
+          audio.onerror = () => setStatus("לא ניתן להוריד את המשוב הקולי.");
+          audio.play().catch(() => {
+            /* autoplay may be blocked; the download below still works */
           });
 
-          if (!response.ok) {
-            setStatus("לא ניתן להוריד את המשוב הקולי.");
-            return window.dash_clientside.no_update;
-          }
-
-          const blob = await response.blob();
-          const url = URL.createObjectURL(blob);
+          // The server coalesces this with the stream above and then serves it from cache.
+          query.delete("stream");
           const a = document.createElement("a");
-          a.href = url;
-          a.download = "feedback-hebrew.mp3";
+          a.href = `/api/tts?${query.toString()}`;
+          a.download = `feedback-hebrew.${format}`;
           document.body.appendChild(a);
           a.click();
           document.body.removeChild(a);
-          URL.revokeObjectURL(url);
-          setStatus("המשוב הקולי ירד בהצלחה.");
+          setStatus("המשוב הקולי מתנגן ויורד.");
         } catch (err) {
           console.error("Download failed", err); // eslint-disable-line no-console
           setStatus("לא ניתן להוריד את המשוב הקולי.");
@@ -0,0 +1,371 @@
+from __future__ import annotations
+
+import io
+import logging
+import os
+import shutil
+import subprocess
+import time
+import wave
+from dataclasses import dataclass, field
+from typing import Any, BinaryIO, Dict, Tuple, Union
+
+import numpy as np
+
+AUDIO_PREP = os.environ.get("AUDIO_PREP", "1") != "0"
+TARGET_RATE = 16000
+# Frames quieter than this (relative to full scale) count as silence when trimming.
+SILENCE_DBFS = float(os.environ.get("AUDIO_SILENCE_DBFS", "-45"))
+# Silence kept around the speech so Whisper does not clip word onsets.
+TRIM_PAD_SECONDS = 0.15
+OPUS_BITRATE = os.environ.get("AUDIO_OPUS_BITRATE", "24k")
+# ffmpeg is optional: without it only WAV input is decoded and output stays 16-bit WAV.
+FFMPEG_BINARY = os.environ.get("FFMPEG_BINARY") or shutil.which("ffmpeg")
+FFMPEG_TIMEOUT = float(os.environ.get("FFMPEG_TIMEOUT", "20"))
+
+# Pre-flight quality gate: reject recordings that are not worth an upstream call.
+AUDIO_GATE = os.environ.get("AUDIO_GATE", "1") != "0"
+MIN_DURATION_SECONDS = float(os.environ.get("AUDIO_MIN_DURATION", "0.5"))
+MIN_RMS_DBFS = float(os.environ.get("AUDIO_MIN_RMS_DBFS", "-55"))
+MIN_SPEECH_RATIO = float(os.environ.get("AUDIO_MIN_SPEECH_RATIO", "0.1"))
+MAX_CLIPPING_RATIO = float(os.environ.get("AUDIO_MAX_CLIPPING_RATIO", "0.02"))
+# Hard cap, enforced even with the gate off: longer recordings are refused before decoding.
+MAX_DURATION_SECONDS = float(os.environ.get("AUDIO_MAX_DURATION", "60"))
+# WAV sample rates accepted; anything outside is a forged or broken header.
+WAV_MIN_RATE = 8000
+WAV_MAX_RATE = 192000
+# Frames decoded per block, so only one block of raw multichannel PCM is held at a time.
+_DECODE_BLOCK_FRAMES = 1 << 16
+
+_FRAME_SECONDS = 0.02
+
+
+QUALITY_MESSAGES = {
+    "too_short": "ההקלטה קצרה מדי. לחצו והחזיקו את הכפתור לאורך כל המשפט.",
+    "silent": "לא נשמע קול בהקלטה. בדקו את המיקרופון ונסו שוב.",
+    "no_speech": "לא זוהה דיבור בהקלטה. דברו קרוב יותר למיקרופון ונסו שוב.",
+    "clipped": "ההקלטה מעוותת (חזקה מדי). דברו מעט רחוק יותר מהמיקרופון.",
+    "too_long": "ההקלטה ארוכה מדי. הקליטו משפט אחד בכל פעם.",
+    "unsupported_rate": "קצב הדגימה של ההקלטה אינו נתמך. נסו להקליט שוב.",
+}
+
+# An upload as bytes or as a seekable binary file (e.g. the spooled upload itself).
+AudioSource = Union[bytes, BinaryIO]
+
+
+class AudioQualityError(Exception):
+    """Recording rejected by the pre-flight gate; carries a code, a user-facing message and the metrics."""
+
+    def __init__(self, code: str, metrics: Dict[str, float]) -> None:
+        super().__init__(QUALITY_MESSAGES[code])
+        self.code = code
+        self.message = QUALITY_MESSAGES[code]
+        self.metrics = metrics
+
+
+@dataclass
+class PreparedAudio:
+    data: bytes
+    filename: str
+    # Mono float32 PCM at TARGET_RATE before trimming, or None when the input could not be decoded.
+    samples: np.ndarray | None = None
+    stats: Dict[str, Any] = field(default_factory=dict)
+
+
+def as_file(source: AudioSource) -> BinaryIO:
+    """A file view of the source, rewound; wrapping bytes in BytesIO does not copy them."""
+    audio = io.BytesIO(source) if isinstance(source, bytes) else source
+    audio.seek(0)
+    return audio
+
+
+def source_size(audio: BinaryIO) -> int:
+    size = audio.seek(0, io.SEEK_END)
+    audio.seek(0)
+    return size
+
+
+def sniff_container(data: bytes) -> str:
+    """Identify the container from magic bytes; the browser's content type is not trustworthy."""
+    head = data[:16]
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return "wav"
+    if head[:4] == b"\x1a\x45\xdf\xa3":
+        return "webm"
+    if head[:4] == b"OggS":
+        return "ogg"
+    if head[4:8] == b"ftyp":
+        return "mp4"
+    if head[:4] == b"fLaC":
+        return "flac"
+    if head[:3] == b"ID3" or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+        return "mp3"
+    return "unknown"
+
+
+def _pcm_block(frames: bytes, width: int) -> np.ndarray:
+    if width == 1:
+        return (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128) / 128
+    if width == 2:
+        return np.frombuffer(frames, dtype="<i2").astype(np.float32) / 32768
+    if width == 3:
+        raw = np.frombuffer(frames, dtype=np.uint8).reshape(-1, 3)
+        ints = (raw[:, 0].astype(np.int32) | raw[:, 1].astype(np.int32) << 8 | raw[:, 2].astype(np.int32) << 16)
+        ints = np.where(ints & 0x800000, ints - 0x1000000, ints)
+        return ints.astype(np.float32) / 8388608
+    if width == 4:
+        return np.frombuffer(frames, dtype="<i4").astype(np.float32) / 2147483648
+    raise ValueError(f"Unsupported WAV sample width: {width}")
+
+
+def _too_long(duration: float) -> AudioQualityError:
+    return AudioQualityError("too_long", {"duration": round(duration, 3)})
+
+
+def _decode_wav(audio: BinaryIO) -> Tuple[np.ndarray, int, float]:
+    """
+    Decode block by block straight into one mono float32 array, checking the length in
+    the header first. Returns (samples, rate, clipping ratio measured on the raw channels).
+    The header is not trusted further than the bytes that follow it: the frame count is
+    capped by the payload actually present and the rate must be a plausible one.
+    """
+    with wave.open(audio, "rb") as wav:
+        channels = wav.getnchannels()
+        width = wav.getsampwidth()
+        rate = wav.getframerate()
+        if not WAV_MIN_RATE <= rate <= WAV_MAX_RATE:
+            raise AudioQualityError("unsupported_rate", {"rate": rate})
+        # wave.open leaves the file at the start of the sample data.
+        start = audio.tell()
+        payload = audio.seek(0, io.SEEK_END) - start
+        audio.seek(start)
+        total = min(wav.getnframes(), payload // (channels * width))
+        if total / rate > MAX_DURATION_SECONDS:
+            raise _too_long(total / rate)
+        samples = np.empty(total, dtype=np.float32)
+        filled = clipped = 0
+        while filled < total:
+            frames = wav.readframes(min(_DECODE_BLOCK_FRAMES, total - filled))
+            if not frames:
+                break
+            pcm = _pcm_block(frames, width).reshape(-1, channels)
+            # Measured before resampling, whose band-limiting would smear the flat tops.
+            clipped += int(np.count_nonzero(np.abs(pcm) >= 0.999))
+            samples[filled : filled + len(pcm)] = to_mono(pcm)
+            filled += len(pcm)
+    return samples[:filled], rate, clipped / (filled * channels) if filled else 0.0
+
+
+def _ffmpeg_stdin(audio: BinaryIO) -> Dict[str, Any]:
+    """subprocess.run arguments that feed ffmpeg the rest of `audio`."""
+    # Only a file the OS knows has a name (a path, or a descriptor number). Uploads are
+    # SpooledTemporaryFiles (Starlette's UploadFile.file, upload sessions, batch items),
+    # whose name is None while they are still in memory, as is BytesIO's; calling
+    # fileno() on such a spool would move it to disk just to hand ffmpeg a descriptor.
+    if getattr(audio, "name", None) is None:
+        return {"input": audio.read()}
+    try:
+        # A file on disk is handed to ffmpeg as its stdin without reading it here.
+        # The buffered position can differ from the descriptor's, so sync the latter explicitly.
+        os.lseek(audio.fileno(), audio.tell(), os.SEEK_SET)
+        return {"stdin": audio}
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return {"input": audio.read()}
+
+
+def _decode_ffmpeg(audio: BinaryIO) -> Tuple[np.ndarray, int, float]:
+    """Decode any container ffmpeg understands straight to mono float PCM at TARGET_RATE."""
+    if not FFMPEG_BINARY:
+        raise ValueError("ffmpeg is required to decode this container")
+    proc = subprocess.run(
+        [
+            FFMPEG_BINARY, "-v", "error", "-i", "pipe:0",
+            # Decode slightly past the cap: enough to tell that it was exceeded, no more.
+            "-t", str(MAX_DURATION_SECONDS + 1),
+            "-f", "f32le", "-ac", "1", "-ar", str(TARGET_RATE), "pipe:1",
+        ],
+        capture_output=True,
+        timeout=FFMPEG_TIMEOUT,
+        check=True,
+        **_ffmpeg_stdin(audio),
+    )
+    samples = np.frombuffer(proc.stdout, dtype="<f4")
+    if samples.size / TARGET_RATE > MAX_DURATION_SECONDS:
+        raise _too_long(samples.size / TARGET_RATE)
+    clipping_ratio = float(np.mean(np.abs(samples) >= 0.999)) if samples.size else 0.0
+    return samples, TARGET_RATE, clipping_ratio
+
+
+def to_mono(pcm: np.ndarray) -> np.ndarray:
+    return pcm[:, 0] if pcm.shape[1] == 1 else pcm.mean(axis=1)
+
+
+def resample(samples: np.ndarray, rate: int, target: int = TARGET_RATE) -> np.ndarray:
+    """Band-limited resampling in the frequency domain (also acts as the anti-alias filter)."""
+    if rate == target or samples.size == 0:
+        return samples.astype(np.float32, copy=False)
+    out_len = int(round(samples.size * target / rate))
+    spectrum = np.fft.rfft(samples)
+    keep = out_len // 2 + 1
+    if keep <= spectrum.size:
+        spectrum = spectrum[:keep]
+    else:
+        spectrum = np.concatenate([spectrum, np.zeros(keep - spectrum.size, dtype=spectrum.dtype)])
+    return (np.fft.irfft(spectrum, n=out_len) * (out_len / samples.size)).astype(np.float32)
+
+
+def frame_rms_dbfs(samples: np.ndarray, rate: int) -> np.ndarray:
+    """Per-frame RMS level in dBFS over fixed 20 ms frames."""
+    frame = max(1, int(rate * _FRAME_SECONDS))
+    count = samples.size // frame
+    if count == 0:
+        return np.full(1, -np.inf if samples.size == 0 else 20 * np.log10(np.sqrt(np.mean(samples**2)) + 1e-12))
+    frames = samples[: count * frame].reshape(count, frame)
+    rms = np.sqrt(np.mean(frames.astype(np.float64) ** 2, axis=1))
+    return 20 * np.log10(rms + 1e-12)
+
+
+def trim_silence(samples: np.ndarray, rate: int, threshold_dbfs: float = SILENCE_DBFS) -> np.ndarray:
+    levels = frame_rms_dbfs(samples, rate)
+    voiced = np.flatnonzero(levels > threshold_dbfs)
+    if voiced.size == 0:
+        return samples
+    frame = int(rate * _FRAME_SECONDS)
+    pad = int(rate * TRIM_PAD_SECONDS)
+    start = max(0, voiced[0] * frame - pad)
+    end = min(samples.size, (voiced[-1] + 1) * frame + pad)
+    return samples[start:end]
+
+
+def assess_quality(samples: np.ndarray, rate: int, clipping_ratio: float = 0.0) -> Dict[str, float]:
+    """
+    Duration, overall RMS level, clipping ratio and speech-activity fraction.
+    Speech activity is a simple energy VAD: frames above both the silence threshold
+    and the recording's own noise floor (10th percentile level) plus 6 dB.
+    """
+    levels = frame_rms_dbfs(samples, rate)
+    finite = levels[np.isfinite(levels)]
+    noise_floor = float(np.percentile(finite, 10)) if finite.size else -np.inf
+    voiced = levels > max(SILENCE_DBFS, noise_floor + 6)
+    rms = float(np.sqrt(np.mean(samples.astype(np.float64) ** 2))) if samples.size else 0.0
+    return {
+        "duration": round(samples.size / rate, 3),
+        "rms_dbfs": round(float(20 * np.log10(rms + 1e-12)), 1),
+        "clipping_ratio": round(clipping_ratio, 4),
+        "speech_ratio": round(float(voiced.mean()) if voiced.size else 0.0, 3),
+    }
+
+
+def check_quality(metrics: Dict[str, float]) -> None:
+    if metrics["duration"] < MIN_DURATION_SECONDS:
+        raise AudioQualityError("too_short", metrics)
+    if metrics["rms_dbfs"] < MIN_RMS_DBFS:
+        raise AudioQualityError("silent", metrics)
+    if metrics["clipping_ratio"] > MAX_CLIPPING_RATIO:
+        raise AudioQualityError("clipped", metrics)
+    if metrics["speech_ratio"] < MIN_SPEECH_RATIO:
+        raise AudioQualityError("no_speech", metrics)
+
+
+def _encode_wav(samples: np.ndarray, rate: int) -> bytes:
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2")
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(pcm.tobytes())
+    return buf.getvalue()
+
+
+def _encode_opus(samples: np.ndarray, rate: int) -> bytes:
+    proc = subprocess.run(
+        [
+            FFMPEG_BINARY or "ffmpeg", "-v", "error", "-f", "f32le", "-ar", str(rate), "-ac", "1", "-i", "pipe:0",
+            "-c:a", "libopus", "-b:a", OPUS_BITRATE, "-application", "voip", "-f", "ogg", "pipe:1",
+        ],
+        input=samples.astype("<f4").tobytes(),
+        capture_output=True,
+        timeout=FFMPEG_TIMEOUT,
+        check=True,
+    )
+    return proc.stdout
+
+
+def prepare_audio(source: AudioSource, encode: bool = True, wav: bool = False) -> PreparedAudio:
+    """
+    Sniff, decode, downmix, resample to 16 kHz, trim silence and re-encode compactly
+    (Ogg/Opus when ffmpeg is available, 16-bit WAV otherwise). Falls back to the
+    original bytes when the input cannot be decoded or re-encoding would not shrink it.
+    Accepts a file so a spooled upload is decoded in place; the original is only
+    read into memory when it has to be sent as-is. With `encode=False` (a local
+    engine that takes the samples) a decoded recording comes back with empty data;
+    with `wav=True` (models that only accept WAV or MP3) it is always 16-bit WAV.
+    Raises AudioQualityError for recordings that fail the pre-flight gate or exceed
+    MAX_DURATION_SECONDS. Blocking; call it from a worker thread.
+    """
+    audio = as_file(source)
+    size = source_size(audio)
+    timings: Dict[str, float] = {}
+    stats: Dict[str, Any] = {"bytes_in": size, "timings_ms": timings}
+
+    def _lap(stage: str, started: float) -> float:
+        now = time.perf_counter()
+        timings[stage] = round((now - started) * 1000, 2)
+        return now
+
+    def _original(samples: np.ndarray | None) -> PreparedAudio:
+        stats["bytes_out"] = size
+        audio.seek(0)
+        return PreparedAudio(audio.read(), f"recording.{'wav' if container == 'unknown' else container}", samples, stats)
+
+    t = time.perf_counter()
+    container = sniff_container(audio.read(16))
+    audio.seek(0)
+    stats["container"] = container
+    t = _lap("sniff", t)
+    if not AUDIO_PREP:
+        return _original(None)
+
+    try:
+        if container == "wav":
+            try:
+                samples, rate, clipping_ratio = _decode_wav(audio)
+            except (wave.Error, ValueError, EOFError):
+                # e.g. float WAV, which the stdlib reader does not handle.
+                audio.seek(0)
+                samples, rate, clipping_ratio = _decode_ffmpeg(audio)
+        else:
+            samples, rate, clipping_ratio = _decode_ffmpeg(audio)
+        t = _lap("decode", t)
+
+        samples = resample(samples, rate)
+        t = _lap("resample", t)
+        stats["duration_in"] = round(samples.size / TARGET_RATE, 3)
+
+        if AUDIO_GATE:
+            stats["quality"] = assess_quality(samples, TARGET_RATE, clipping_ratio)
+            t = _lap("gate", t)
+            check_quality(stats["quality"])
+
+        trimmed = trim_silence(samples, TARGET_RATE)
+        t = _lap("trim", t)
+        stats["duration_out"] = round(trimmed.size / TARGET_RATE, 3)
+
+        if not encode:
+            stats["bytes_out"] = 0
+            return PreparedAudio(b"", "", samples, stats)
+        if FFMPEG_BINARY and not wav:
+            encoded, filename = _encode_opus(trimmed, TARGET_RATE), "recording.ogg"
+        else:
+            encoded, filename = _encode_wav(trimmed, TARGET_RATE), "recording.wav"
+        _lap("encode", t)
+    except (ValueError, OSError, subprocess.SubprocessError) as exc:
+        logging.warning("Audio preprocessing skipped (%s): %s", container, exc)
+        stats["skipped"] = str(exc)
+        return _original(None)
+
+    if len(encoded) >= size and not (wav and container != "wav"):
+        return _original(samples)
+    stats["bytes_out"] = len(encoded)
+    return PreparedAudio(encoded, filename, samples, stats)
@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import json
+import os
+import posixpath
+import shutil
+import zipfile
+from dataclasses import dataclass, field
+from tempfile import SpooledTemporaryFile
+from typing import BinaryIO, Dict, List, Tuple
+
+from fastapi import HTTPException, UploadFile
+
+from uploads import TOO_LARGE, UPLOAD_MAX_BYTES, UPLOAD_SPOOL_BYTES
+
+# Recordings per /api/analyze/batch request, and the cap on its body (or on a zip's contents).
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "50"))
+BATCH_MAX_BYTES = int(os.environ.get("BATCH_MAX_BYTES", str(256 * 1024 * 1024)))
+# Optional file inside a zip with the same content as the `manifest` form field.
+MANIFEST_NAME = "manifest.json"
+PHRASE_FIELDS = ("phrase_id", "phrase", "hint", "arabic_transliteration")
+# Per-recording fields a manifest may set; the form's fields are the defaults.
+MANIFEST_FIELDS = PHRASE_FIELDS + ("learner_id",)
+
+WAV_TYPES = {"audio/wav", "audio/x-wav", "audio/wave"}
+
+
+@dataclass
+class BatchItem:
+    """One recording of a batch, in a file owned by the batch (the request's uploads close with the handler)."""
+
+    name: str
+    audio: BinaryIO
+    fields: Dict[str, str] = field(default_factory=dict)
+
+
+def parse_manifest(text: str | bytes | None) -> Dict[str, Dict[str, str]]:
+    """
+    {"file name": {"phrase_id": ...}, ...}: the phrase fields and learner_id of each
+    recording by its file name (in a zip, its path inside the archive). Raises a 400
+    for anything else.
+    """
+    if not text:
+        return {}
+    try:
+        manifest = json.loads(text)
+    except (json.JSONDecodeError, UnicodeDecodeError) as exc:
+        raise HTTPException(status_code=400, detail="manifest must be a JSON object.") from exc
+    if not isinstance(manifest, dict):
+        raise HTTPException(status_code=400, detail="manifest must be a JSON object.")
+    for name, fields in manifest.items():
+        if not isinstance(fields, dict) or not all(
+            key in MANIFEST_FIELDS and (value is None or isinstance(value, str)) for key, value in fields.items()
+        ):
+            raise HTTPException(
+                status_code=400,
+                detail=f"manifest entry {name!r} may only set strings for: {', '.join(MANIFEST_FIELDS)}.",
+            )
+    return {name: {key: value for key, value in fields.items() if value} for name, fields in manifest.items()}
+
+
+def _spooled() -> BinaryIO:
+    return SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES)
+
+
+def close_items(items: List[BatchItem]) -> None:
+    for item in items:
+        item.audio.close()
+
+
+def from_files(files: List[UploadFile]) -> List[BatchItem]:
+    """
+    Copies of the uploaded recordings, each spooled like an upload. Blocking (it copies
+    up to BATCH_MAX_BYTES); run it in a thread.
+    """
+    if len(files) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_ITEMS} recordings per batch.")
+    items: List[BatchItem] = []
+    try:
+        for index, upload in enumerate(files):
+            name = upload.filename or f"recording-{index}.wav"
+            if upload.content_type not in WAV_TYPES:
+                raise HTTPException(status_code=400, detail=f"{name}: file must be a WAV audio.")
+            size = upload.file.seek(0, os.SEEK_END)
+            if not size:
+                raise HTTPException(status_code=400, detail=f"{name}: empty audio file received.")
+            if size > UPLOAD_MAX_BYTES:
+                raise HTTPException(status_code=413, detail=f"{name}: {TOO_LARGE}")
+            upload.file.seek(0)
+            audio = _spooled()
+            items.append(BatchItem(name, audio))
+            shutil.copyfileobj(upload.file, audio)
+            audio.seek(0)
+    except BaseException:
+        close_items(items)
+        raise
+    return items
+
+
+def from_archive(archive: UploadFile) -> Tuple[List[BatchItem], Dict[str, Dict[str, str]]]:
+    """
+    The WAV recordings in a zip, extracted to spooled files, and its manifest.json if
+    there is one. Entry sizes are checked against the caps before anything is inflated
+    (and zipfile never inflates past an entry's declared size). Blocking; run it in a thread.
+    """
+    try:
+        bundle = zipfile.ZipFile(archive.file)
+    except zipfile.BadZipFile as exc:
+        raise HTTPException(status_code=400, detail="archive must be a zip file.") from exc
+    with bundle:
+        entries = [
+            info
+            for info in bundle.infolist()
+            if not info.is_dir()
+            and not info.filename.startswith("__MACOSX/")
+            and not posixpath.basename(info.filename).startswith(".")
+        ]
+        manifest_entry = next((info for info in entries if info.filename == MANIFEST_NAME), None)
+        recordings = [info for info in entries if info is not manifest_entry]
+        if len(recordings) > BATCH_MAX_ITEMS:
+            raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_ITEMS} recordings per batch.")
+        if sum(info.file_size for info in entries) > BATCH_MAX_BYTES:
+            raise HTTPException(status_code=413, detail=TOO_LARGE)
+        for info in recordings:
+            if not info.filename.lower().endswith(".wav"):
+                raise HTTPException(status_code=400, detail=f"{info.filename}: file must be a WAV audio.")
+            if not info.file_size:
+                raise HTTPException(status_code=400, detail=f"{info.filename}: empty audio file received.")
+            if info.file_size > UPLOAD_MAX_BYTES:
+                raise HTTPException(status_code=413, detail=f"{info.filename}: {TOO_LARGE}")
+
+        items: List[BatchItem] = []
+        try:
+            manifest = parse_manifest(bundle.read(manifest_entry)) if manifest_entry is not None else {}
+            for info in recordings:
+                audio = _spooled()
+                items.append(BatchItem(info.filename, audio))
+                with bundle.open(info) as source:
+                    shutil.copyfileobj(source, audio)
+                audio.seek(0)
+        except (zipfile.BadZipFile, RuntimeError, NotImplementedError) as exc:
+            # Corrupt data (CRC mismatch), or an encrypted or unsupported entry.
+            close_items(items)
+            raise HTTPException(status_code=400, detail=f"Could not read the archive: {exc}") from exc
+        except BaseException:
+            close_items(items)
+            raise
+    return items, manifest
@@ -0,0 +1,265 @@
+"""
+Offline stand-in for the OpenAI endpoints the app calls: transcriptions, chat
+completions (plain and streamed, with or without audio input), speech (streamed) and
+model lookups (the app's connection warm-up). Latency is lognormal around a
+configurable median, and a configurable share of calls fail.
+
+    python -m bench.fake_openai --port 9100 --transcribe-ms 400 --chat-ms 700 --error-rate 0.02
+
+Then run the app with OPENAI_BASE_URL=http://127.0.0.1:9100/v1 and any OPENAI_API_KEY.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import re
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.requests import ClientDisconnect
+
+TRANSCRIPT = "مرحبا اسمي خالد انا اكلت اليوم بندورة"
+EVALUATION = {
+    "transcription": "מַרְחַבַּא אִסְמִי חַ'אלֵד אַנַא אַכַּלֵת אֵלְיוֹם בַּנְדוֹרַה",
+    "feedback": "טוב מאוד. שימו לב ל-ח׳ ב'ח׳אלד' ולהדגשת ה-ד.",
+    "score": 82,
+    "translation_score": 85,
+    "pronunciation_score": 78,
+}
+# Short keys requested by the compact prompt's JSON schema.
+SHORT_KEYS = {"t": "transcription", "f": "feedback", "s": "score", "ts": "translation_score", "ps": "pronunciation_score"}
+
+
+def evaluation(response_format: Dict[str, Any] | None, prompt: str = "") -> Dict[str, Any]:
+    """
+    The canned answer, shaped by a json_schema response format when one is given, or by
+    the keys the prompt spells out (audio requests carry no response_format). A packed
+    request ("Item 0:", "Item 1:"...) gets {"items": [...]} with one numbered entry each.
+    """
+    items = [int(number) for number in re.findall(r"^Item (\d+):$", prompt, re.MULTILINE)]
+    if items:
+        keys = ["t", "f", "ts", "ps"]
+        if response_format and response_format.get("type") == "json_schema":
+            entry = response_format["json_schema"]["schema"]["properties"]["items"]["items"]
+            keys = [key for key in entry["properties"] if key != "i"]
+        elif match := re.search(r"holding its number as i and the keys ([\w, ]+)\.", prompt):
+            keys = [key.strip() for key in match.group(1).split(",")]
+        return {"items": [{"i": i, **{key: EVALUATION[SHORT_KEYS.get(key, key)] for key in keys}} for i in items]}
+    if response_format and response_format.get("type") == "json_schema":
+        keys = list(response_format["json_schema"]["schema"]["properties"])
+    elif match := re.search(r"JSON object with the keys ([\w, ]+)\.", prompt):
+        keys = [key.strip() for key in match.group(1).split(",")]
+    else:
+        return EVALUATION
+    return {key: EVALUATION[SHORT_KEYS.get(key, key)] for key in keys}
+
+
+def _text(content: Any) -> str:
+    """Message content as text; audio parts count for nothing."""
+    if isinstance(content, list):
+        return "\n".join(part.get("text", "") for part in content if part.get("type") == "text")
+    return content or ""
+
+
+def _has_audio(messages: list) -> bool:
+    return any(
+        isinstance(m.get("content"), list) and any(p.get("type") == "input_audio" for p in m["content"])
+        for m in messages
+    )
+
+
+@dataclass
+class FakeConfig:
+    transcribe_ms: float = 400.0
+    chat_ms: float = 700.0
+    # Chat calls with audio input (the single-call engine): listening and answering at once.
+    audio_ms: float = 900.0
+    tts_ms: float = 300.0
+    # Spread of the lognormal latency around its median; 0 makes every call take the median.
+    jitter: float = 0.3
+    error_rate: float = 0.0
+    # Share of calls answered 429, as OpenAI does when throttling.
+    throttle_rate: float = 0.0
+    chat_chunks: int = 20
+    tts_bytes: int = 24_000
+    seed: int | None = None
+    calls: Dict[str, int] = field(default_factory=lambda: {"transcriptions": 0, "chat": 0, "speech": 0, "errors": 0})
+
+    @classmethod
+    def from_env(cls) -> "FakeConfig":
+        def number(name: str, default: float) -> float:
+            return float(os.environ.get(f"FAKE_OPENAI_{name}", default))
+
+        seed = os.environ.get("FAKE_OPENAI_SEED")
+        return cls(
+            transcribe_ms=number("TRANSCRIBE_MS", 400),
+            chat_ms=number("CHAT_MS", 700),
+            audio_ms=number("AUDIO_MS", 900),
+            tts_ms=number("TTS_MS", 300),
+            jitter=number("JITTER", 0.3),
+            error_rate=number("ERROR_RATE", 0),
+            throttle_rate=number("THROTTLE_RATE", 0),
+            seed=int(seed) if seed else None,
+        )
+
+
+def create_app(config: FakeConfig) -> FastAPI:
+    app = FastAPI(title="Fake OpenAI")
+    rng = random.Random(config.seed)
+
+    def latency(median_ms: float) -> float:
+        if median_ms <= 0:
+            return 0.0
+        return median_ms / 1000 * math.exp(rng.gauss(0, config.jitter)) if config.jitter else median_ms / 1000
+
+    def failure() -> Response | None:
+        roll = rng.random()
+        if roll < config.throttle_rate:
+            config.calls["errors"] += 1
+            body = {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}}
+            return JSONResponse(body, status_code=429, headers={"retry-after": "1"})
+        if roll < config.throttle_rate + config.error_rate:
+            config.calls["errors"] += 1
+            return JSONResponse({"error": {"message": "Injected failure", "type": "server_error"}}, status_code=500)
+        return None
+
+    @app.post("/v1/audio/transcriptions")
+    async def transcriptions(request: Request) -> Response:
+        config.calls["transcriptions"] += 1
+        try:
+            form = await request.form()
+        except ClientDisconnect:
+            # The app gave up on this attempt mid-upload (a timeout or a losing hedge).
+            return Response(status_code=499)
+        await form["file"].read()
+        await asyncio.sleep(latency(config.transcribe_ms))
+        return failure() or PlainTextResponse(TRANSCRIPT)
+
+    @app.post("/v1/chat/completions")
+    async def chat(request: Request) -> Response:
+        config.calls["chat"] += 1
+        body = await request.json()
+        messages = body.get("messages", [])
+        delay = latency(config.audio_ms if _has_audio(messages) else config.chat_ms)
+        error = failure()
+        if error is not None:
+            await asyncio.sleep(delay)
+            return error
+        prompt = "\n".join(_text(m.get("content")) for m in messages)
+        content = json.dumps(evaluation(body.get("response_format"), prompt), ensure_ascii=False)
+        # Rough token counts (about three characters per token) so usage metrics move.
+        prompt_tokens = len(prompt) // 3
+        completion_tokens = len(content) // 3
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        if not body.get("stream"):
+            await asyncio.sleep(delay)
+            message = {"role": "assistant", "content": content}
+            return JSONResponse(
+                {
+                    "id": "fake",
+                    "object": "chat.completion",
+                    "created": 0,
+                    "model": body["model"],
+                    "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+                    "usage": usage,
+                }
+            )
+
+        def chunk(choices: list, **extra: Any) -> str:
+            data = {"id": "fake", "object": "chat.completion.chunk", "created": 0, "model": body["model"]}
+            return f"data: {json.dumps({**data, 'choices': choices, **extra})}\n\n"
+
+        async def events() -> AsyncIterator[str]:
+            # Time to first token is a third of the call; the rest is spread over the chunks.
+            await asyncio.sleep(delay / 3)
+            step = max(1, math.ceil(len(content) / config.chat_chunks))
+            for start in range(0, len(content), step):
+                delta = {"content": content[start : start + step]}
+                yield chunk([{"index": 0, "delta": delta, "finish_reason": None}])
+                await asyncio.sleep(delay * 2 / 3 / config.chat_chunks)
+            if (body.get("stream_options") or {}).get("include_usage"):
+                yield chunk([], usage=usage)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/v1/audio/speech")
+    async def speech(request: Request) -> Response:
+        config.calls["speech"] += 1
+        body = await request.json()
+        delay = latency(config.tts_ms)
+        error = failure()
+        if error is not None:
+            await asyncio.sleep(delay)
+            return error
+        # Deterministic per input, so caches behave as they would against the real API.
+        seed = sum(body.get("input", "").encode("utf-8")) % 251
+        chunk = bytes((seed + i) % 256 for i in range(4096))
+
+        async def audio() -> AsyncIterator[bytes]:
+            sent = 0
+            pieces = math.ceil(config.tts_bytes / len(chunk))
+            for _ in range(pieces):
+                await asyncio.sleep(delay / pieces)
+                size = min(len(chunk), config.tts_bytes - sent)
+                sent += size
+                yield chunk[:size]
+
+        return StreamingResponse(audio(), media_type="audio/mpeg")
+
+    @app.get("/v1/models/{model}")
+    async def model(model: str) -> Dict[str, Any]:
+        # What the app's connection warm-up asks for; not counted as a call.
+        return {"id": model, "object": "model", "created": 0, "owned_by": "fake"}
+
+    @app.get("/calls")
+    async def calls() -> Dict[str, Any]:
+        return config.calls
+
+    return app
+
+
+app = create_app(FakeConfig.from_env())
+
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--transcribe-ms", type=float, default=400)
+    parser.add_argument("--chat-ms", type=float, default=700)
+    parser.add_argument("--audio-ms", type=float, default=900)
+    parser.add_argument("--tts-ms", type=float, default=300)
+    parser.add_argument("--jitter", type=float, default=0.3)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    config = FakeConfig(
+        transcribe_ms=args.transcribe_ms,
+        chat_ms=args.chat_ms,
+        audio_ms=args.audio_ms,
+        tts_ms=args.tts_ms,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        seed=args.seed,
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
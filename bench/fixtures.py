@@ -0,0 +1,70 @@
+"""
+Deterministic WAV fixtures for the load generator: voiced, syllable-shaped signals
+that pass the recording quality gate, in the shapes browsers actually upload.
+
+    python -m bench.fixtures            # writes bench/fixtures/*.wav
+
+Real recordings can be used instead by pointing the load generator's --fixtures at
+a directory of .wav files.
+"""
+
+from __future__ import annotations
+
+import io
+import wave
+from pathlib import Path
+from typing import Dict
+
+import numpy as np
+
+FIXTURES_DIR = Path(__file__).resolve().parent / "fixtures"
+
+# name -> (seconds, sample rate, channels)
+SHAPES = {
+    "short_16k_mono": (1.5, 16000, 1),
+    "phrase_44k_mono": (3.0, 44100, 1),
+    "phrase_48k_stereo": (4.0, 48000, 2),
+    "long_48k_mono": (12.0, 48000, 1),
+    # About 7 MB: spooled to disk on upload; for memory runs (--match 'lecture*').
+    "lecture_48k_stereo": (40.0, 48000, 2),
+}
+
+
+def speech_like(seconds: float, rate: int, channels: int, seed: int = 0) -> bytes:
+    """Syllables of a harmonic tone with a moving pitch, separated by short pauses, as 16-bit PCM WAV."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * rate)) / rate
+    pitch = 140 + 30 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / rate
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 6))
+    syllables = np.clip(np.sin(2 * np.pi * 3.5 * t), 0, None) ** 0.5
+    # Quiet lead-in and tail, like a push-to-talk recording.
+    edges = (t > 0.25) & (t < seconds - 0.25)
+    signal = 0.3 * voiced * syllables * edges + 0.003 * rng.standard_normal(t.size)
+    pcm = (np.clip(signal, -1, 1) * 32767).astype("<i2")
+    if channels > 1:
+        pcm = np.repeat(pcm[:, None], channels, axis=1)
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as out:
+        out.setnchannels(channels)
+        out.setsampwidth(2)
+        out.setframerate(rate)
+        out.writeframes(pcm.tobytes())
+    return buffer.getvalue()
+
+
+def ensure_fixtures(directory: Path = FIXTURES_DIR) -> Dict[str, Path]:
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = {}
+    for index, (name, (seconds, rate, channels)) in enumerate(SHAPES.items()):
+        path = directory / f"{name}.wav"
+        if not path.exists():
+            path.write_bytes(speech_like(seconds, rate, channels, seed=index))
+        paths[name] = path
+    return paths
+
+
+if __name__ == "__main__":
+    for name, path in ensure_fixtures().items():
+        print(f"{name:<20} {path.stat().st_size:>9} bytes  {path}")
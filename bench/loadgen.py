@@ -0,0 +1,412 @@
+"""
+Load generator for /api/analyze, /api/analyze/stream and /api/tts.
+The "chunked" target sends each recording through /api/uploads first and times
+only the finalizing /api/analyze/stream call, i.e. the wait after the button is released.
+
+    python -m bench.loadgen --spawn --target analyze --concurrency 16 --requests 200
+    python -m bench.loadgen --url http://127.0.0.1:8000 --pid 1234 --target tts --duration 30
+
+With --spawn it starts bench.fake_openai and the app (uvicorn main:server) on free
+ports, so runs need no network and no API key. It reports latency percentiles,
+throughput, errors and the server's resident memory, including the busiest growth
+over the idle server divided by the concurrency (memory per in-flight request).
+Save a run with --json and pass it to --compare on a later run to see the difference.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+import httpx
+
+from bench.fixtures import FIXTURES_DIR, ensure_fixtures
+
+ROOT = Path(__file__).resolve().parent.parent
+TARGETS = ("analyze", "stream", "chunked", "tts")
+# Chunk size for the "chunked" target: about a second of 16 kHz 16-bit audio.
+CHUNK_BYTES = 32 * 1024
+
+
+@dataclass
+class Run:
+    latencies: List[float] = field(default_factory=list)
+    first_byte: List[float] = field(default_factory=list)
+    statuses: Dict[str, int] = field(default_factory=dict)
+    rss_samples: List[int] = field(default_factory=list)
+    rss_idle: int = 0
+    elapsed: float = 0.0
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def memory_kb(pid: int) -> Dict[str, int]:
+    """Current (VmRSS) and peak (VmHWM) resident memory of a process; empty off Linux."""
+    try:
+        lines = Path(f"/proc/{pid}/status").read_text().splitlines()
+    except OSError:
+        return {}
+    fields = {}
+    for line in lines:
+        key, _, value = line.partition(":")
+        if key in ("VmRSS", "VmHWM"):
+            fields[key] = int(value.split()[0])
+    return fields
+
+
+def _unique(wav: bytes, counter: int) -> bytes:
+    # Overwrite the final sample so every upload hashes differently and misses the caches.
+    return wav[:-4] + counter.to_bytes(4, "little", signed=False)
+
+
+async def _one(
+    client: httpx.AsyncClient, target: str, wav: bytes, counter: int, run: Run, unique: bool, form: Dict[str, str]
+) -> None:
+    started = time.perf_counter()
+    status = "error"
+    try:
+        if target == "tts":
+            text = f"משוב לדוגמה מספר {counter}" if unique else "משוב לדוגמה"
+            async with client.stream("GET", "/api/tts", params={"text": text, "format": "mp3"}) as response:
+                first = None
+                async for chunk in response.aiter_bytes():
+                    if first is None and chunk:
+                        first = time.perf_counter() - started
+                if first is not None:
+                    run.first_byte.append(first)
+                status = str(response.status_code)
+        else:
+            body = _unique(wav, counter) if unique else wav
+            files: Dict[str, Any] | None = {"file": ("recording.wav", body, "audio/wav")}
+            data = form
+            streamed = target in ("stream", "chunked")
+            if target == "chunked":
+                upload_id = (await client.post("/api/uploads")).raise_for_status().json()["upload_id"]
+                pieces = [body[start : start + CHUNK_BYTES] for start in range(0, len(body), CHUNK_BYTES)]
+                for seq, piece in enumerate(pieces):
+                    (await client.put(f"/api/uploads/{upload_id}/chunks/{seq}", content=piece)).raise_for_status()
+                files, data = None, {**form, "upload_id": upload_id, "chunks": str(len(pieces))}
+                # These chunks went up while the learner was still speaking; the wait starts now.
+                started = time.perf_counter()
+            path = "/api/analyze/stream" if streamed else "/api/analyze"
+            async with client.stream("POST", path, files=files, data=data) as response:
+                first = None
+                async for chunk in response.aiter_bytes():
+                    if first is None and chunk:
+                        first = time.perf_counter() - started
+                    if streamed and b"event: error" in chunk:
+                        status = "stream_error"
+                if first is not None and streamed:
+                    run.first_byte.append(first)
+                if status != "stream_error":
+                    status = str(response.status_code)
+    except httpx.HTTPError as exc:
+        status = type(exc).__name__
+    run.statuses[status] = run.statuses.get(status, 0) + 1
+    if status == "200":
+        run.latencies.append(time.perf_counter() - started)
+
+
+async def drive(
+    url: str,
+    target: str,
+    concurrency: int,
+    requests: int | None,
+    duration: float | None,
+    fixtures: List[bytes],
+    unique: bool,
+    pid: int | None,
+    warmup: int,
+    form: Dict[str, str],
+) -> Run:
+    run = Run()
+    counter = itertools.count(int(time.time()))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=120, limits=limits) as client:
+        for index in range(warmup):
+            await _one(client, target, fixtures[index % len(fixtures)], next(counter), Run(), unique, form)
+
+        issued = itertools.count()
+        deadline = time.perf_counter() + duration if duration else None
+
+        async def worker() -> None:
+            while True:
+                index = next(issued)
+                if requests is not None and index >= requests:
+                    return
+                if deadline is not None and time.perf_counter() >= deadline:
+                    return
+                await _one(client, target, fixtures[index % len(fixtures)], next(counter), run, unique, form)
+
+        async def sample_memory() -> None:
+            while pid is not None:
+                rss = memory_kb(pid).get("VmRSS")
+                if rss:
+                    run.rss_samples.append(rss)
+                await asyncio.sleep(0.05)
+
+        if pid is not None:
+            # Peak (VmHWM) only rises, so the idle level is the current RSS after warmup.
+            run.rss_idle = memory_kb(pid).get("VmRSS", 0)
+        sampler = asyncio.create_task(sample_memory())
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        run.elapsed = time.perf_counter() - started
+        sampler.cancel()
+    return run
+
+
+def summarize(run: Run, target: str, concurrency: int, pid: int | None) -> Dict[str, Any]:
+    ms = [value * 1000 for value in run.latencies]
+    total = sum(run.statuses.values())
+    summary: Dict[str, Any] = {
+        "target": target,
+        "concurrency": concurrency,
+        "requests": total,
+        "ok": len(ms),
+        "statuses": run.statuses,
+        "rps": round(len(ms) / run.elapsed, 2) if run.elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(ms, 50), 1),
+            "p95": round(percentile(ms, 95), 1),
+            "p99": round(percentile(ms, 99), 1),
+            "mean": round(statistics.fmean(ms), 1) if ms else 0.0,
+            "max": round(max(ms), 1) if ms else 0.0,
+        },
+    }
+    if run.first_byte:
+        first = [value * 1000 for value in run.first_byte]
+        summary["first_event_ms"] = {"p50": round(percentile(first, 50), 1), "p95": round(percentile(first, 95), 1)}
+    if pid is not None:
+        memory = memory_kb(pid)
+        busiest = max(run.rss_samples, default=run.rss_idle)
+        summary["rss_mb"] = {
+            "idle": round(run.rss_idle / 1024, 1),
+            "end": round(memory.get("VmRSS", 0) / 1024, 1),
+            "max_sampled": round(busiest / 1024, 1),
+            "peak": round(memory.get("VmHWM", 0) / 1024, 1),
+            "per_request": round(max(0, busiest - run.rss_idle) / 1024 / concurrency, 2),
+        }
+    return summary
+
+
+def report(summary: Dict[str, Any], baseline: Dict[str, Any] | None = None) -> str:
+    def delta(path: List[str]) -> str:
+        if baseline is None:
+            return ""
+        old: Any = baseline
+        new: Any = summary
+        for key in path:
+            old, new = (old or {}).get(key), (new or {}).get(key)
+        if not old or new is None:
+            return ""
+        return f"  ({(new - old) / old * 100:+.1f}%)"
+
+    latency = summary["latency_ms"]
+    lines = [
+        f"target       {summary['target']}  concurrency={summary['concurrency']}",
+        f"requests     {summary['requests']}  ok={summary['ok']}  statuses={summary['statuses']}",
+        f"throughput   {summary['rps']} req/s{delta(['rps'])}",
+    ]
+    for key in ("p50", "p95", "p99", "mean", "max"):
+        lines.append(f"latency {key:<4} {latency[key]} ms{delta(['latency_ms', key])}")
+    if "first_event_ms" in summary:
+        first = summary["first_event_ms"]
+        lines.append(f"first byte   p50={first['p50']} ms  p95={first['p95']} ms{delta(['first_event_ms', 'p50'])}")
+    if "transcription" in summary:
+        usage = summary["transcription"]
+        audio = ", ".join(f"{name}={value:.0f}s" for name, value in usage["audio_seconds"].items()) or "none"
+        lines.append(
+            f"transcribed  {audio}  API cost ${usage['api_cost_usd']}  local busy {usage['local_worker_seconds']}s"
+            + delta(["transcription", "api_cost_usd"])
+        )
+    if summary.get("evaluation", {}).get("calls"):
+        usage = summary["evaluation"]
+        per_call = usage["per_call"]
+        lines.append(
+            f"eval tokens  {'/'.join(usage['versions'])}: {per_call['prompt']} prompt "
+            f"({per_call['cached_prompt']} cached){delta(['evaluation', 'per_call', 'prompt'])}  "
+            f"{per_call['completion']} completion per call{delta(['evaluation', 'per_call', 'completion'])}"
+        )
+    if "rss_mb" in summary:
+        rss = summary["rss_mb"]
+        lines.append(f"server RSS   idle={rss['idle']} MB  busiest={rss['max_sampled']} MB  peak={rss['peak']} MB")
+        lines.append(f"per request  {rss['per_request']} MB over idle{delta(['rss_mb', 'per_request'])}")
+    return "\n".join(lines)
+
+
+def transcription_usage(url: str, price_per_minute: float) -> Dict[str, Any]:
+    """Audio seconds per transcription backend from the app's /metrics, with the API's cost."""
+    seconds: Dict[str, float] = {}
+    local_busy = 0.0
+    for line in httpx.get(f"{url}/metrics", timeout=10).text.splitlines():
+        if line.startswith("coach_transcribed_audio_seconds_total{"):
+            backend = line.split('backend="', 1)[1].split('"', 1)[0]
+            seconds[backend] = float(line.rsplit(" ", 1)[1])
+        elif line.startswith('coach_stage_seconds_sum{stage="transcribe_local"}'):
+            local_busy = float(line.rsplit(" ", 1)[1])
+    return {
+        "audio_seconds": seconds,
+        "api_cost_usd": round(seconds.get("openai", 0.0) / 60 * price_per_minute, 4),
+        "local_worker_seconds": round(local_busy, 1),
+    }
+
+
+def evaluation_usage(url: str) -> Dict[str, Any]:
+    """Evaluation tokens per call from the app's /metrics, and the prompt versions that produced them."""
+    totals = {"prompt": 0.0, "completion": 0.0, "cached_prompt": 0.0}
+    calls = 0.0
+    versions = set()
+    for line in httpx.get(f"{url}/metrics", timeout=10).text.splitlines():
+        if not line.startswith(("coach_openai_tokens_total{", "coach_openai_tokens_per_call_count{")):
+            continue
+        labels = dict(re.findall(r'(\w+)="([^"]*)"', line.split("}", 1)[0]))
+        value = float(line.rsplit(" ", 1)[1])
+        versions.add(labels.get("prompt", "unversioned"))
+        if line.startswith("coach_openai_tokens_total{"):
+            totals[labels["kind"]] = totals.get(labels["kind"], 0.0) + value
+        else:
+            calls += value
+    per_call = {kind: round(total / calls, 1) if calls else 0.0 for kind, total in totals.items()}
+    return {"versions": sorted(versions), "calls": int(calls), "per_call": per_call}
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_ready(url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f"Server at {url} did not become ready.")
+
+
+@contextmanager
+def spawned(fake_args: List[str], app_env: Dict[str, str]) -> Iterator[tuple[str, int]]:
+    """Start the fake upstream and the app; yield the app URL and its pid."""
+    fake_port, app_port = _free_port(), _free_port()
+    env = {
+        **os.environ,
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{fake_port}/v1",
+        # Start every run cold and free of state from earlier runs.
+        "EVAL_MEMO_DB": "",
+        "TTS_CACHE_DIR": "",
+        "REFERENCE_AUDIO_WARM": "0",
+        **app_env,
+    }
+    fake = subprocess.Popen(
+        [sys.executable, "-m", "bench.fake_openai", "--port", str(fake_port), *fake_args], cwd=ROOT, env=env
+    )
+    app = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:server", "--port", str(app_port), "--log-level", "warning"],
+        cwd=ROOT,
+        env=env,
+    )
+    try:
+        _wait_ready(f"http://127.0.0.1:{fake_port}/calls")
+        _wait_ready(f"http://127.0.0.1:{app_port}/api/limits")
+        yield f"http://127.0.0.1:{app_port}", app.pid
+    finally:
+        for process in (app, fake):
+            process.terminate()
+        for process in (app, fake):
+            process.wait(timeout=10)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", choices=TARGETS, default="analyze")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=None, help="total requests (default 100 unless --duration)")
+    parser.add_argument("--duration", type=float, default=None, help="seconds to run instead of a request count")
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--repeat", action="store_true", help="resend identical payloads (measures the cached path)")
+    parser.add_argument("--fixtures", type=Path, default=FIXTURES_DIR, help="directory of .wav recordings")
+    parser.add_argument("--match", default="*.wav", help="glob selecting fixtures, e.g. 'lecture*'")
+    parser.add_argument("--transcriber", help="transcription backend for analyze targets (openai or local)")
+    parser.add_argument("--scoring", help="scoring mode for analyze targets (local, llm or fast)")
+    parser.add_argument("--engine", help="analysis engine for analyze targets (pipeline or audio)")
+    parser.add_argument("--whisper-price", type=float, default=0.006, help="Whisper API price per audio minute, USD")
+    parser.add_argument("--url", help="existing server to load instead of --spawn")
+    parser.add_argument("--pid", type=int, help="server pid for RSS reporting with --url")
+    parser.add_argument("--spawn", action="store_true", help="start the fake upstream and the app locally")
+    parser.add_argument("--fake-arg", action="append", default=[], help="extra bench.fake_openai flag, repeatable")
+    parser.add_argument("--env", action="append", default=[], help="NAME=VALUE for the spawned app, repeatable")
+    parser.add_argument("--json", type=Path, help="write the summary here")
+    parser.add_argument("--compare", type=Path, help="summary JSON from an earlier run")
+    args = parser.parse_args()
+
+    if args.fixtures == FIXTURES_DIR:
+        ensure_fixtures()
+    fixtures = [path.read_bytes() for path in sorted(args.fixtures.glob(args.match))]
+    if not fixtures:
+        raise SystemExit(f"No files matching {args.match} in {args.fixtures}.")
+    requests = args.requests if args.requests is not None or args.duration else 100
+
+    form = {"phrase_id": "p0001"}
+    for name in ("transcriber", "scoring", "engine"):
+        if getattr(args, name):
+            form[name] = getattr(args, name)
+
+    def execute(url: str, pid: int | None) -> Dict[str, Any]:
+        run = asyncio.run(
+            drive(
+                url, args.target, args.concurrency, requests, args.duration, fixtures, not args.repeat, pid,
+                args.warmup, form,
+            )
+        )
+        summary = summarize(run, args.target, args.concurrency, pid)
+        if args.target != "tts":
+            # Includes the warmup requests; against a long-running --url server, everything since it started.
+            summary["transcription"] = transcription_usage(url, args.whisper_price)
+            summary["evaluation"] = evaluation_usage(url)
+        return summary
+
+    if args.spawn:
+        fake_args = [arg for flag in args.fake_arg for arg in flag.split()]
+        app_env = dict(item.split("=", 1) for item in args.env)
+        with spawned(fake_args, app_env) as (url, pid):
+            summary = execute(url, pid)
+    elif args.url:
+        summary = execute(args.url, args.pid)
+    else:
+        raise SystemExit("Pass --spawn or --url.")
+
+    baseline = json.loads(args.compare.read_text()) if args.compare else None
+    print(report(summary, baseline))
+    if args.json:
+        args.json.write_text(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
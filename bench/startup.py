@@ -0,0 +1,206 @@
+"""
+Cold-start benchmark: how long `import main` takes, and how long a freshly started
+server takes to answer its first requests.
+
+    python -m bench.startup --runs 5
+    python -m bench.startup --launcher gunicorn --workers 2 --compare bench/startup_baseline.json
+
+Each run starts the app in a new process (against bench.fake_openai, so no network
+or API key is needed) and times, from the moment the process is launched, the first
+successful answer from the API (/api/limits), the page (/, which needs Dash) and an
+analysis (/api/analyze, which needs the OpenAI client). The best of the runs is
+reported, since noise on a shared machine only ever adds time, together with the
+modules that dominate the import. Save a run with --json; with --compare, the run
+fails (exit status 1) when a time is more than --tolerance slower than the saved one.
+bench/startup_baseline.json is the tracked baseline; refresh it with --json after an
+intended change.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import httpx
+
+from bench.fixtures import FIXTURES_DIR, ensure_fixtures
+from bench.loadgen import ROOT, _free_port, _wait_ready
+
+LAUNCHERS = ("uvicorn", "gunicorn")
+# Requests timed on every cold start, in the order a visitor's browser would make them.
+PROBES = ("api", "page", "analyze")
+_IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def import_seconds() -> float:
+    """Wall time of `import main` in a fresh interpreter."""
+    code = "import time; start = time.perf_counter(); import main; print(time.perf_counter() - start)"
+    output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def heaviest_imports(count: int = 8) -> List[Dict[str, Any]]:
+    """The modules `main` imports itself, by cumulative import time (from -X importtime)."""
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"], cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    modules: List[Dict[str, Any]] = []
+    for line in output.stderr.splitlines():
+        match = _IMPORT_LINE.match(line)
+        if match is None:
+            continue
+        # Children are listed before their parent, indented two spaces per level.
+        depth = (len(match.group(3)) - 1) // 2
+        if depth == 1:
+            modules.append({"module": match.group(4), "ms": round(int(match.group(2)) / 1000, 1)})
+        elif depth == 0:
+            if match.group(4) == "main":
+                break
+            modules = []  # the interpreter's own startup imports
+    modules.sort(key=lambda module: module["ms"], reverse=True)
+    return modules[:count]
+
+
+def _command(launcher: str, port: int) -> List[str]:
+    if launcher == "gunicorn":
+        return [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "main:server"]
+    return [sys.executable, "-m", "uvicorn", "main:server", "--port", str(port), "--log-level", "warning"]
+
+
+def cold_start(launcher: str, workers: int, env: Dict[str, str], wav: bytes) -> Dict[str, float]:
+    """Seconds from launching the server to the first successful answer of each probe."""
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}"
+    # Only for the server: uvicorn (the fake upstream's too) also reads WEB_CONCURRENCY.
+    env = {**env, "PORT": str(port), "WEB_CONCURRENCY": str(workers if launcher == "gunicorn" else 1)}
+    started = time.monotonic()
+    server = subprocess.Popen(_command(launcher, port), cwd=ROOT, env=env)
+    timings: Dict[str, float] = {}
+    try:
+        with httpx.Client(base_url=url, timeout=30) as client:
+            for probe in PROBES:
+                while True:
+                    if server.poll() is not None:
+                        raise SystemExit(f"The server exited with status {server.returncode}.")
+                    try:
+                        if probe == "api":
+                            response = client.get("/api/limits")
+                        elif probe == "page":
+                            response = client.get("/")
+                        else:
+                            files = {"file": ("probe.wav", wav, "audio/wav")}
+                            response = client.post("/api/analyze", files=files, data={"phrase_id": "p0001"})
+                        if response.status_code == 200:
+                            break
+                    except httpx.TransportError:
+                        pass
+                    time.sleep(0.01)
+                timings[probe] = round(time.monotonic() - started, 3)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    return timings
+
+
+def summarize(imports: List[float], starts: List[Dict[str, float]], launcher: str, workers: int) -> Dict[str, Any]:
+    return {
+        "launcher": launcher,
+        "workers": workers if launcher == "gunicorn" else 1,
+        "runs": len(starts),
+        "import_s": round(min(imports), 3),
+        "first_request_s": {probe: round(min(run[probe] for run in starts), 3) for probe in PROBES},
+        "heaviest_imports": heaviest_imports(),
+    }
+
+
+def regressions(summary: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    pairs = [("import", summary["import_s"], baseline["import_s"])]
+    pairs += [
+        (f"first {probe}", summary["first_request_s"][probe], baseline["first_request_s"][probe])
+        for probe in PROBES
+        if probe in baseline["first_request_s"]
+    ]
+    return [
+        f"{name}: {value:.3f}s vs {before:.3f}s"
+        for name, value, before in pairs
+        if before and value > before * (1 + tolerance)
+    ]
+
+
+def report(summary: Dict[str, Any], baseline: Dict[str, Any] | None) -> str:
+    def delta(value: float, before: float | None) -> str:
+        if not before:
+            return ""
+        return f"  ({(value - before) / before * 100:+.0f}% vs baseline)"
+
+    first = summary["first_request_s"]
+    before = baseline["first_request_s"] if baseline else {}
+    lines = [
+        f"{summary['launcher']} x{summary['workers']}, best of {summary['runs']} cold starts",
+        f"import main   {summary['import_s']:.3f}s{delta(summary['import_s'], baseline and baseline['import_s'])}",
+    ]
+    for probe in PROBES:
+        lines.append(f"first {probe:<8}{first[probe]:.3f}s{delta(first[probe], before.get(probe))}")
+    lines.append("heaviest imports  " + ", ".join(f"{m['module']} {m['ms']:.0f}ms" for m in summary["heaviest_imports"]))
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--launcher", choices=LAUNCHERS, default="uvicorn")
+    parser.add_argument("--workers", type=int, default=2, help="WEB_CONCURRENCY for --launcher gunicorn")
+    parser.add_argument("--env", action="append", default=[], help="NAME=VALUE for the app, repeatable")
+    parser.add_argument("--json", type=Path, help="write the summary here")
+    parser.add_argument("--compare", type=Path, help="summary JSON from an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="slowdown over --compare that fails the run")
+    args = parser.parse_args()
+
+    ensure_fixtures()
+    wav = (FIXTURES_DIR / "short_16k_mono.wav").read_bytes()
+    fake_port = _free_port()
+    env = {
+        **os.environ,
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{fake_port}/v1",
+        # Every start is cold: no state from earlier runs, and no background synthesis.
+        "EVAL_MEMO_DB": "",
+        "TTS_CACHE_DIR": "",
+        "HISTORY_DB": "",
+        "REFERENCE_AUDIO_WARM": "0",
+        **dict(item.split("=", 1) for item in args.env),
+    }
+    fake = subprocess.Popen(
+        # No simulated latency: only the app's own startup is timed.
+        [sys.executable, "-m", "bench.fake_openai", "--port", str(fake_port), "--transcribe-ms", "0", "--chat-ms", "0"],
+        cwd=ROOT,
+        env=env,
+    )
+    try:
+        _wait_ready(f"http://127.0.0.1:{fake_port}/calls")
+        imports = [import_seconds() for _ in range(args.runs)]
+        starts = [cold_start(args.launcher, args.workers, env, wav) for _ in range(args.runs)]
+    finally:
+        fake.terminate()
+        fake.wait(timeout=10)
+
+    summary = summarize(imports, starts, args.launcher, args.workers)
+    baseline = json.loads(args.compare.read_text()) if args.compare else None
+    print(report(summary, baseline))
+    if args.json:
+        args.json.write_text(json.dumps(summary, indent=2) + "\n")
+    if baseline:
+        slower = regressions(summary, baseline, args.tolerance)
+        if slower:
+            raise SystemExit(f"Slower than the baseline by more than {args.tolerance:.0%}: {'; '.join(slower)}")
+
+
+if __name__ == "__main__":
+    main()
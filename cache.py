@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Generic, Hashable, Tuple, TypeVar
+
+V = TypeVar("V")
+
+
+class LRUCache(Generic[V]):
+    """
+    In-memory LRU bounded by total size. `sizeof` decides what a unit is:
+    the default counts entries, `len` bounds the cache by bytes.
+    Entries older than `ttl` seconds (when set) are treated as misses.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        sizeof: Callable[[V], int] = lambda _: 1,
+        ttl: float | None = None,
+    ) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self._sizeof = sizeof
+        self._data: OrderedDict[Hashable, Tuple[V, int, float]] = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> V | None:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, size, stored_at = entry
+        if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+            self._remove(key)
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: V) -> None:
+        size = self._sizeof(value)
+        if key in self._data:
+            self._remove(key)
+        if size > self.max_size:
+            return
+        self._data[key] = (value, size, time.monotonic())
+        self.size += size
+        while self.size > self.max_size:
+            oldest = next(iter(self._data))
+            self._remove(oldest)
+
+    def _remove(self, key: Hashable) -> None:
+        _, size, _ = self._data.pop(key)
+        self.size -= size
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._data),
+            "size": self.size,
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls for the same key into one running task.
+    The task is shielded so a disconnecting caller does not cancel it for the others.
+    """
+
+    def __init__(self) -> None:
+        self._calls: Dict[Hashable, asyncio.Future[Any]] = {}
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[V]]) -> V:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(functools.partial(self._done, key))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def pending(self, key: Hashable) -> asyncio.Future[Any] | None:
+        return self._calls.get(key)
+
+    def lead(self, key: Hashable) -> asyncio.Future[Any]:
+        """
+        Register a flight whose result the caller will set by hand, for work that
+        cannot be expressed as a single awaitable (e.g. a response being streamed).
+        """
+        future: asyncio.Future[Any] = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        future.add_done_callback(functools.partial(self._done, key))
+        return future
+
+    def _done(self, key: Hashable, task: asyncio.Future[Any]) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved; callers already saw it.
+            task.exception()
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+
+class SQLiteCache:
+    """
+    Persistent key/value store for JSON-serializable values, pruned to
+    `max_entries` by last use. Blocking; call it from a worker thread.
+
+    The file is opened on first use, in the process that uses it: a connection must
+    not cross a fork, and a preloading server master imports this module before forking.
+    """
+
+    def __init__(self, path: str, max_entries: int) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn: sqlite3.Connection | None = None
+
+    def _connection(self) -> sqlite3.Connection:
+        # Called with the lock held.
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_used ON cache (used)")
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str) -> Any | None:
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE cache SET used = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any) -> None:
+        data = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            conn = self._connection()
+            conn.execute("INSERT OR REPLACE INTO cache (key, value, used) VALUES (?, ?, ?)", (key, data, time.time()))
+            self._writes += 1
+            # Prune in batches rather than on every write.
+            if self._writes % 64 == 0:
+                conn.execute(
+                    "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,72 @@
+"""
+Count the Dash callback round-trips each UI interaction costs.
+
+    python callback_audit.py
+
+Reads the callback graph from /_dash-dependencies and follows each interaction
+through chained callbacks. Clientside callbacks run in the browser; every server
+callback reached is one POST to /_dash-update-component through the WSGI bridge.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Dict, List, Set
+
+from app import app
+
+# Interaction -> the property the user changes (None: the initial page render).
+INTERACTIONS = {
+    "page load": None,
+    "record": "record-button.n_clicks",
+    "next phrase": "next-phrase-btn.n_clicks",
+    "play reference": "play-reference-btn.n_clicks",
+    "play feedback": "play-feedback-btn.n_clicks",
+    "download feedback": "download-feedback-btn.n_clicks",
+}
+
+
+def _dependencies() -> List[Dict[str, Any]]:
+    with app.server.test_client() as client:
+        return client.get(f"{app.config.requests_pathname_prefix}_dash-dependencies").get_json()
+
+
+def _outputs(callback: Dict[str, Any]) -> Set[str]:
+    # Multi-output callbacks are serialized as "..a.children...b.children..".
+    return {part for part in callback["output"].strip(".").split("...") if part}
+
+
+def _inputs(callback: Dict[str, Any]) -> Set[str]:
+    return {f"{dep['id']}.{dep['property']}" for dep in callback["inputs"]}
+
+
+def server_round_trips(callbacks: List[Dict[str, Any]], trigger: str | None) -> int:
+    if trigger is None:
+        # Dash fires every callback without prevent_initial_call once on load.
+        return sum(1 for cb in callbacks if not cb["clientside_function"] and not cb["prevent_initial_call"])
+
+    changed = {trigger}
+    fired: Set[int] = set()
+    trips = 0
+    progress = True
+    while progress:
+        progress = False
+        for index, callback in enumerate(callbacks):
+            if index in fired or not (_inputs(callback) & changed):
+                continue
+            fired.add(index)
+            changed |= _outputs(callback)
+            trips += 0 if callback["clientside_function"] else 1
+            progress = True
+    return trips
+
+
+def main() -> None:
+    callbacks = _dependencies()
+    server = sum(1 for cb in callbacks if not cb["clientside_function"])
+    print(f"{len(callbacks)} callbacks, {server} server-side")
+    for name, trigger in INTERACTIONS.items():
+        print(f"{name:<20} {server_round_trips(callbacks, trigger)} server round-trip(s)")
+
+
+if __name__ == "__main__":
+    main()
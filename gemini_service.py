@@ -1,140 +1,629 @@
 from __future__ import annotations
 
 import asyncio
-import io
+import hashlib
 import json
+import logging
 import os
+import random
 import re
-from typing import Any, Dict
+import threading
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, AsyncIterator, Awaitable, Callable, Dict, List, Tuple
 
-from openai import OpenAI
+from audio_prep import AudioSource, as_file, prepare_audio
+from cache import LRUCache, SingleFlight, SQLiteCache
+from limits import Overloaded
+from metrics import prepared_bytes, record_usage, registry, run_in_thread, stage, watch_cache
+from prompts import EvalPrompt, eval_prompt
+from scoring import (
+    local_feedback,
+    normalize_transcript,
+    score_transliteration,
+    transliterate_arabic,
+)
+from transcription import (
+    TRANSCRIBE_BACKEND,
+    TRANSCRIBE_FALLBACK,
+    LocalBackend,
+    OpenAIBackend,
+    TranscriptionBackend,
+    transcribe_fallbacks,
+)
+from upstream import (
+    ANALYZE_DEADLINE,
+    Deadline,
+    DeadlineExceeded,
+    UpstreamPolicy,
+    audio_policy,
+    evaluate_pack_policy,
+    evaluate_policy,
+    rate_limited,
+)
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
 
 TRANSCRIBE_MODEL = os.environ.get("OPENAI_MODEL_TRANSCRIBE", "whisper-1")
 EVAL_MODEL = os.environ.get("OPENAI_MODEL_EVAL", "gpt-4o-mini")
+# "local": scores from scoring.py, LLM writes feedback only; "llm": the LLM also scores;
+# "fast": local scores and feedback, no evaluation call.
+SCORING_MODES = ("local", "llm", "fast")
+SCORING_MODE = os.environ.get("SCORING_MODE", "local")
+# "pipeline": Whisper, then the chat model on the transcript; "audio": one call to an
+# audio-capable chat model that hears the recording itself.
+ANALYZE_ENGINES = ("pipeline", "audio")
+ANALYZE_ENGINE = os.environ.get("ANALYZE_ENGINE", "pipeline")
+AUDIO_EVAL_MODEL = os.environ.get("OPENAI_MODEL_AUDIO", "gpt-4o-audio-preview")
+# Share of analyses also run through the other engine in the background, to compare scores.
+ENGINE_SHADOW_RATE = float(os.environ.get("ENGINE_SHADOW_RATE", "0"))
 
-SYSTEM_PROMPT_ENG = (
-    "You are a strict Levantine Arabic pronunciation and translation coach. "
-    "Use the transcript to judge translation accuracy and provide concise, "
-    "actionable pronunciation feedback (focus on Levantine phonemes like Qaf glottal stop, Haa, and 'Ayn). "
-    "Return STRICT JSON with keys transcription, score (0-100), and feedback. "
-    "Score reflects overall pronunciation quality and translation accuracy."
-)
+# Batch analysis: recordings of one batch transcribed at a time, and evaluations packed
+# into one chat call, sent when full or once the first of them has waited EVAL_PACK_WAIT seconds.
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "4"))
+EVAL_PACK_SIZE = int(os.environ.get("EVAL_PACK_SIZE", "5"))
+EVAL_PACK_WAIT = float(os.environ.get("EVAL_PACK_WAIT", "0.5"))
+
+# Point at a stand-in server (e.g. bench/fake_openai.py) instead of api.openai.com.
+OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL") or None
+
+# Connection pool shared by every upstream call (transcription, evaluation, TTS).
+OPENAI_MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE = int(os.environ.get("OPENAI_MAX_KEEPALIVE", "20"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.environ.get("OPENAI_KEEPALIVE_EXPIRY", "30"))
+# Connections opened at startup, so the first requests skip the openai import, DNS and TLS.
+OPENAI_WARM_CONNECTIONS = int(os.environ.get("OPENAI_WARM_CONNECTIONS", "2"))
+
+TRANSCRIPT_CACHE_SIZE = int(os.environ.get("TRANSCRIPT_CACHE_SIZE", "1024"))
+TRANSCRIPT_CACHE_TTL = float(os.environ.get("TRANSCRIPT_CACHE_TTL", "3600"))
+
+# (model, sha256 of uploaded bytes) -> (transcript, preprocessing stats)
+_transcripts: LRUCache[Tuple[str, Dict[str, Any]]] = LRUCache(TRANSCRIPT_CACHE_SIZE, ttl=TRANSCRIPT_CACHE_TTL)
+_transcript_flights = SingleFlight()
+
+EVAL_MEMO_SIZE = int(os.environ.get("EVAL_MEMO_SIZE", "4096"))
+# Optional SQLite file that keeps evaluations across restarts; unset keeps them in memory only.
+EVAL_MEMO_DB = os.environ.get("EVAL_MEMO_DB", "")
+
+_eval_memo: LRUCache[Dict[str, Any]] = LRUCache(EVAL_MEMO_SIZE)
+_eval_store: SQLiteCache | None = SQLiteCache(EVAL_MEMO_DB, EVAL_MEMO_SIZE * 16) if EVAL_MEMO_DB else None
+_eval_flights = SingleFlight()
+
+watch_cache("transcript", _transcripts)
+watch_cache("eval_memo", _eval_memo)
 
-SYSTEM_PROMPT = (
-    "אתה מורה לערבית לבנטינית לדוברי עברית. בצע שני שלבים:\n"
-    "1) המר את דיבור הלומד לתעתיק עברי בלבד (אין להשתמש באותיות ערביות). "
-    "   הקפד לבחור אותיות עבריות המייצגות היטב את ההגייה הלבנטינית (קוף חיכית/גלוטלית, אותיות מודגשות, ח'/ח, ר מגולגלת/גרונית, ע׳ין/עין וכו').\n"
-    "2) השווה רק בין התעתיק העברי של הלומד לבין תעתיק היעד (arabic_transliteration). "
-    "   תן שני ציונים (0-100):\n"
-    "   - translation_score: מבוסס על קרבת מחרוזות (לדוגמה, מרחק עריכה/דיוק לשוני) בין התעתיק של הלומד לתעתיק היעד.\n"
-    "   - pronunciation_score: מבוסס על בחירת האותיות העבריות שמייצגות הגייה נכונה (האם בחרו ק/כ/ק׳, ח/ח׳, ע/א, ר מגולגלת, אות מודגשת וכד').\n"
-    "score יכול להיות ממוצע בין שניהם. "
-    "שמור על תעתיק עברי בלבד; אל תשתמש באותיות ערביות. השתמש במפה הבאה כרמז תעתיק: "
-    "ا/أ/إ/آ→'א' או 'ע' רפויה; "
-    "ب→'בּ' סגורה; "
-    "ت→'ת' קלה; "
-    "ث→'ת׳' (לעיתים נשמעת 'ס'); "
-    "ج→'ג׳' (כמו ג'מייל), אפשר 'ג' קלה בדיאלקט; "
-    "ح→'ח' עמוקה גרונית; "
-    "خ→'ח׳' / 'כּ' חיכית, עם חיכוך עמוק; "
-    "د→'ד'; "
-    "ذ→'ד׳/ז׳' (th רפה); "
-    "ر→'ר' מגולגלת או גרונית; "
-    "ز→'ז'; "
-    "س→'ס'; "
-    "ش→'שׁ'; "
-    "ص→'צ' מודגשת (חיכוך מודגש); "
-    "ض→'ד׳' עמוקה/מצלצלת; "
-    "ط→'ט' מודגשת; "
-    "ظ→'ט׳/ז׳' מודגשת; "
-    "ع→'ע' עמוקה, לוחצת; "
-    "غ→'ע׳/ר׳' חיכית/וילונית; "
-    "ف→'פ' שפתית; "
-    "ق→'ק' אחורית/גלוטלית; "
-    "ك→'כ' קדמית (לעיתים 'ק' רפה); "
-    "ل→'ל'; "
-    "م→'מ'; "
-    "ن→'נ'; "
-    "ه→'ה'; "
-    "و→'ו' (חצי תנועה u/w); "
-    "ي→'י' (חצי תנועה i/y). "
-    "החזר JSON קפדני עם המפתחות transcription, score (0-100), feedback (באותיות עבריות). "
-    "אם ניתנת arabic_transliteration השתמש בה כמשפט היעד המדויק להשוואת תרגום/הגייה. "
-    "החזר גם translation_score (0-100) להערכת דיוק התרגום, ו-pronunciation_score (0-100) להערכת הגייה. "
-    "score יכול להיות הממוצע בין שניהם. "
-    "הציון משקף איכות הגייה ודיוק תרגום; המשוב ישים: אילו אותיות/הברות היו שגויות ואיזו אות עברית להשתמש כדי לתקן."
+analysis_seconds = registry.histogram("coach_analysis_seconds", "Time from upload to result, by engine.")
+engine_score_gap = registry.histogram(
+    "coach_engine_score_gap",
+    "Absolute difference between the two engines' scores for the same recording, by score.",
+    (0, 2, 5, 10, 15, 20, 30, 50, 100),
 )
+engine_transcript_agreement = registry.histogram(
+    "coach_engine_transcript_agreement",
+    "Similarity (0-100) of the two engines' Hebrew transliterations of the same recording.",
+    (50, 60, 70, 80, 90, 95, 100),
+)
+engine_shadow_failures = registry.counter(
+    "coach_engine_shadow_failures_total", "Shadow analyses that gave nothing to compare, by engine and reason."
+)
+eval_pack_items = registry.histogram(
+    "coach_eval_pack_items", "Evaluations sent in one chat call by batch analysis.", (1, 2, 3, 4, 5, 8, 10, 20)
+)
+# Shadow comparisons in flight; referenced so they are not garbage-collected mid-run.
+_shadows: set = set()
 
+_shared_client: AsyncOpenAI | None = None
+_client_lock = threading.Lock()
 
-def _client() -> OpenAI:
+
+def create_client() -> AsyncOpenAI:
+    """
+    Build an AsyncOpenAI client on top of a pooled keep-alive httpx client. openai and
+    httpx are imported here rather than at the top, keeping them off the import path.
+    """
     api_key = os.environ.get("OPENAI_API_KEY")
     if not api_key:
         raise ValueError("OPENAI_API_KEY is not set.")
-    return OpenAI(api_key=api_key)
+    import httpx
+    from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+    http_client = DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+            keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+        ),
+    )
+    # Retries, timeouts and hedging are handled per operation in upstream.py.
+    return AsyncOpenAI(api_key=api_key, base_url=OPENAI_BASE_URL, http_client=http_client, max_retries=0)
+
+
+def open_client() -> AsyncOpenAI | None:
+    """
+    Create the process-wide client if an API key is configured. Safe to call
+    repeatedly, and from a thread (warm_client creates it off the event loop).
+    """
+    global _shared_client
+    if _shared_client is None and os.environ.get("OPENAI_API_KEY"):
+        with _client_lock:
+            if _shared_client is None:
+                _shared_client = create_client()
+    return _shared_client
 
 
-def _transcribe(client: OpenAI, audio_bytes: bytes) -> str:
-    audio_file = io.BytesIO(audio_bytes)
-    audio_file.name = "recording.wav"
-    transcript = client.audio.transcriptions.create(
-        model=TRANSCRIBE_MODEL,
-        file=audio_file,
-        response_format="text",
+async def warm_client() -> int:
+    """
+    Create the client in a thread and open OPENAI_WARM_CONNECTIONS pooled connections,
+    each with a cheap authenticated call (retrieving the evaluation model). Called from
+    the FastAPI lifespan without blocking startup; returns the connections warmed.
+    """
+    client = await asyncio.to_thread(open_client)
+    if client is None or OPENAI_WARM_CONNECTIONS <= 0:
+        return 0
+    # Concurrent calls, so each one takes its own connection from the pool.
+    results = await asyncio.gather(
+        *(client.with_options(timeout=5).models.retrieve(EVAL_MODEL) for _ in range(OPENAI_WARM_CONNECTIONS)),
+        return_exceptions=True,
     )
-    text = transcript.strip()
-    if not text:
-        raise ValueError("Transcription is empty.")
-    return text
+    failures = [result for result in results if isinstance(result, BaseException)]
+    if failures:
+        logging.warning("Warming OpenAI connections failed: %r", failures[0])
+    return len(results) - len(failures)
+
+
+async def close_client() -> None:
+    global _shared_client
+    if _shared_client is not None:
+        await _shared_client.close()
+        _shared_client = None
+
+
+def get_client() -> AsyncOpenAI:
+    client = open_client()
+    if client is None:
+        raise ValueError("OPENAI_API_KEY is not set.")
+    return client
+
+
+local_transcriber = LocalBackend.from_env()
+TRANSCRIBE_BACKENDS: Dict[str, TranscriptionBackend] = {
+    "openai": OpenAIBackend(get_client, TRANSCRIBE_MODEL),
+    "local": local_transcriber,
+}
+
+
+def _digest(audio: AudioSource) -> str:
+    """SHA-256 of an upload, read in blocks so a spooled file is never loaded whole."""
+    audio = as_file(audio)
+    digest = hashlib.sha256()
+    while block := audio.read(1 << 16):
+        digest.update(block)
+    audio.seek(0)
+    return digest.hexdigest()
+
 
+def transcription_backend(name: str | None = None) -> TranscriptionBackend:
+    """The named backend, or TRANSCRIBE_BACKEND; raises ValueError for an unknown or unusable one."""
+    backend = TRANSCRIBE_BACKENDS.get(name or TRANSCRIBE_BACKEND)
+    if backend is None:
+        raise ValueError(f"Unknown transcription backend: {name}.")
+    if not backend.available():
+        raise ValueError(f"Transcription backend {backend.name} is not installed.")
+    return backend
 
-def _evaluate(
-    client: OpenAI,
+
+def _fallback_for(backend: TranscriptionBackend) -> TranscriptionBackend | None:
+    if not TRANSCRIBE_FALLBACK or backend is local_transcriber or not local_transcriber.available():
+        return None
+    return local_transcriber
+
+
+async def _transcribe_cached(
+    audio: AudioSource, backend: TranscriptionBackend, deadline: Deadline | None = None
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    Preprocess and transcribe, keyed by a hash of the uploaded bytes. Retried uploads
+    of the same recording reuse the transcript, and concurrent duplicates share one call.
+    When the API backend is throttled (rate limited upstream or refused by our own
+    limiter) and the local engine is installed, the recording is transcribed locally.
+    """
+    key = (backend.model, await run_in_thread("upload_hash", _digest, audio))
+    cached = _transcripts.get(key)
+    if cached is not None:
+        return cached[0], {**cached[1], "transcript_cache": "hit"}
+
+    async def run() -> Tuple[str, Dict[str, Any]]:
+        prepared = await run_in_thread("prepare", prepare_audio, audio, backend.encoded)
+        if prepared.data:
+            prepared_bytes.observe(len(prepared.data))
+        stats = {**prepared.stats, "transcriber": backend.name}
+        try:
+            text = await backend.transcribe(prepared, deadline)
+        except (Overloaded, rate_limited()) as exc:
+            fallback = _fallback_for(backend)
+            if fallback is None:
+                raise
+            transcribe_fallbacks.inc(reason=type(exc).__name__)
+            text = await fallback.transcribe(prepared, deadline)
+            # Cached as this backend's result too: the fallback only ran because it was unavailable.
+            stats["transcriber"] = fallback.name
+        text = text.strip()
+        if not text:
+            raise ValueError("Transcription is empty.")
+        _transcripts.set(key, (text, stats))
+        return text, stats
+
+    return await _transcript_flights.do(key, run)
+
+
+def _eval_key(
     transcription: str,
     phrase: str | None,
     hint: str | None,
     arabic_transliteration: str | None,
+    scoring: str,
+    model: str = EVAL_MODEL,
+) -> str:
+    """
+    Everything that determines an evaluation. The prompt enters as its fingerprint, so
+    editing it or switching PROMPT_VERSION invalidates old entries without any explicit flush.
+    """
+    prompt = eval_prompt(scoring == "local" and bool(arabic_transliteration))
+    parts = [
+        normalize_transcript(transcription),
+        phrase or "",
+        hint or "",
+        arabic_transliteration or "",
+        model,
+        prompt.fingerprint,
+        scoring,
+    ]
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+
+async def _memo_get(key: str) -> Dict[str, Any] | None:
+    cached = _eval_memo.get(key)
+    if cached is None and _eval_store is not None:
+        cached = await run_in_thread("eval_store", _eval_store.get, key)
+        if cached is not None:
+            _eval_memo.set(key, cached)
+    # Callers add per-request fields to the result; never hand out the cached dict itself.
+    return dict(cached) if cached is not None else None
+
+
+async def _memo_set(key: str, result: Dict[str, Any]) -> None:
+    _eval_memo.set(key, result)
+    if _eval_store is not None:
+        await asyncio.to_thread(_eval_store.set, key, result)
+
+
+async def _memoized(key: str, compute: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+    """An evaluation from the memo (and its SQLite store), or computed once for all concurrent callers."""
+    cached = await _memo_get(key)
+    if cached is not None:
+        return cached
+
+    async def run() -> Dict[str, Any]:
+        result = await compute()
+        await _memo_set(key, result)
+        return result
+
+    return dict(await _eval_flights.do(key, run))
+
+
+async def _evaluate_memoized(
+    client: AsyncOpenAI,
+    transcription: str,
+    phrase: str | None,
+    hint: str | None,
+    arabic_transliteration: str | None,
+    scoring: str,
+    on_feedback: Callable[[str], None] | None = None,
+    deadline: Deadline | None = None,
 ) -> Dict[str, Any]:
+    key = _eval_key(transcription, phrase, hint, arabic_transliteration, scoring)
+    return await _memoized(
+        key,
+        lambda: _evaluate(client, transcription, phrase, hint, arabic_transliteration, scoring, on_feedback, deadline),
+    )
+
+
+def _context(phrase: str | None, hint: str | None, arabic_transliteration: str | None) -> List[Tuple[str, str]]:
     context = []
     if phrase:
-        context.append(f"Target meaning (native phrase): {phrase}")
+        context.append(("Target meaning (native phrase)", phrase))
     if hint:
-        context.append(f"Prompt to user: {hint}")
+        context.append(("Prompt to user", hint))
     if arabic_transliteration:
-        context.append(f"Target Arabic transliteration (reference pronunciation): {arabic_transliteration}")
-    context_text = "\n".join(context) if context else "No target phrase provided."
+        context.append(("Target Arabic transliteration (reference pronunciation)", arabic_transliteration))
+    return context
+
+
+async def _complete(
+    client: AsyncOpenAI,
+    request: Dict[str, Any],
+    prompt: EvalPrompt,
+    policy: UpstreamPolicy,
+    on_feedback: Callable[[str], None] | None,
+    deadline: Deadline | None,
+) -> str:
+    """
+    Run one evaluation request under `policy`. With `on_feedback`, the completion is
+    streamed and feedback text is passed on as it arrives; a streamed attempt is
+    retried only if it failed before any feedback was passed on.
+    """
+    forwarded = [False]
+
+    def forward(piece: str) -> None:
+        forwarded[0] = True
+        if on_feedback is not None:
+            on_feedback(piece)
 
-    completion = client.chat.completions.create(
+    async def attempt() -> str:
+        with stage(policy.name):
+            if on_feedback is None:
+                completion = await client.chat.completions.create(**request)
+                record_usage(request["model"], completion.usage, prompt=prompt.version)
+                _check_finished(completion.choices[0].finish_reason)
+                return completion.choices[0].message.content or ""
+            return await _stream_completion(client, request, prompt, forward)
+
+    # A streamed answer cannot be hedged: two streams would interleave their deltas.
+    return await policy.call(attempt, deadline, hedge=on_feedback is None, retry_if=lambda: not forwarded[0])
+
+
+async def _evaluate(
+    client: AsyncOpenAI,
+    transcription: str,
+    phrase: str | None,
+    hint: str | None,
+    arabic_transliteration: str | None,
+    scoring: str = "local",
+    on_feedback: Callable[[str], None] | None = None,
+    deadline: Deadline | None = None,
+) -> Dict[str, Any]:
+    """Ask the chat model for a Hebrew transliteration and feedback (plus scores in "llm" mode)."""
+    # Local scoring needs a target to compare against; otherwise the model scores.
+    local = scoring == "local" and bool(arabic_transliteration)
+    prompt = eval_prompt(local)
+    request: Dict[str, Any] = dict(
         model=EVAL_MODEL,
         temperature=0.3,
-        response_format={"type": "json_object"},
-        messages=[
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {
-                "role": "user",
-                "content": (
-                    f"{context_text}\n"
-                    f"Learner transcription: {transcription}\n"
-                    "Return JSON with transcription, score, feedback."
-                ),
-            },
-        ],
+        response_format=prompt.response_format,
+        messages=prompt.messages(_context(phrase, hint, arabic_transliteration), transcription),
     )
-    text = completion.choices[0].message.content or ""
+    if prompt.max_tokens is not None:
+        request["max_tokens"] = prompt.max_tokens
+    text = await _complete(client, request, prompt, evaluate_policy, on_feedback, deadline)
+
+    with stage("evaluate_parse"):
+        return _evaluation_result(text, prompt, transcription, arabic_transliteration, local)
+
+
+async def _evaluate_audio(
+    client: AsyncOpenAI,
+    audio: AudioSource,
+    phrase: str | None,
+    hint: str | None,
+    arabic_transliteration: str | None,
+    scoring: str,
+    on_feedback: Callable[[str], None] | None = None,
+    deadline: Deadline | None = None,
+) -> Dict[str, Any]:
+    """
+    The "audio" engine: one call in which an audio-capable model hears the recording and
+    answers with the same fields _evaluate produces from a transcript. Memoized by the
+    hash of the upload; the result carries its preprocessing stats under "audio".
+    """
+    digest = await run_in_thread("upload_hash", _digest, audio)
+    key = _eval_key(f"audio:{digest}", phrase, hint, arabic_transliteration, scoring, AUDIO_EVAL_MODEL)
+    computed = [False]
+
+    async def compute() -> Dict[str, Any]:
+        computed[0] = True
+        prepared = await run_in_thread("prepare", prepare_audio, audio, True, True)
+        if not prepared.filename.endswith(".wav"):
+            # Undecodable here (e.g. WebM without ffmpeg); these models only take WAV or MP3.
+            raise ValueError("The audio engine could not convert this recording to WAV.")
+        prepared_bytes.observe(len(prepared.data))
+        local = scoring == "local" and bool(arabic_transliteration)
+        prompt = eval_prompt(local)
+        request: Dict[str, Any] = dict(
+            model=AUDIO_EVAL_MODEL,
+            temperature=0.3,
+            messages=prompt.audio_messages(_context(phrase, hint, arabic_transliteration), prepared.data),
+        )
+        if prompt.max_tokens is not None:
+            request["max_tokens"] = prompt.max_tokens
+        text = await _complete(client, request, prompt, audio_policy, on_feedback, deadline)
+        with stage("evaluate_parse"):
+            result = _evaluation_result(text, prompt, "", arabic_transliteration, local)
+        result["audio"] = prepared.stats
+        return result
+
+    result = await _memoized(key, compute)
+    if not computed[0]:
+        result["audio"] = {**result.get("audio", {}), "eval_cache": "hit"}
+    return result
+
+
+@dataclass
+class _PackItem:
+    """One evaluation waiting in an _EvalPacker group, answered through `future`."""
+
+    key: str
+    transcription: str
+    phrase: str | None
+    hint: str | None
+    arabic_transliteration: str | None
+    deadline: Deadline
+    future: asyncio.Future
+
 
+async def _evaluate_packed(
+    client: AsyncOpenAI, items: List[_PackItem], local: bool, deadline: Deadline
+) -> List[Dict[str, Any] | None]:
+    """
+    Evaluate several transcriptions in one chat call with the same prompt. Returns a
+    result per item, in order, or None for an item the answer left out or got wrong.
+    """
+    prompt = eval_prompt(local)
+    request: Dict[str, Any] = dict(
+        model=EVAL_MODEL,
+        temperature=0.3,
+        response_format=prompt.packed_format(),
+        messages=prompt.packed_messages(
+            [(_context(item.phrase, item.hint, item.arabic_transliteration), item.transcription) for item in items]
+        ),
+    )
+    if prompt.max_tokens is not None:
+        request["max_tokens"] = prompt.max_tokens * len(items)
+    text = await _complete(client, request, prompt, evaluate_pack_policy, None, deadline)
+
+    with stage("evaluate_parse"):
+        answer = _parse_json(text)
+        entries = answer.get("items") if isinstance(answer, dict) else None
+        by_index = {entry.get("i"): entry for entry in entries or [] if isinstance(entry, dict)}
+        results: List[Dict[str, Any] | None] = []
+        for index, item in enumerate(items):
+            try:
+                data = prompt.fields(by_index[index])
+                results.append(_evaluation_fields(data, item.transcription, item.arabic_transliteration, local))
+            except (KeyError, ValueError):
+                results.append(None)
+        return results
+
+
+def _check_finished(finish_reason: str | None) -> None:
+    if finish_reason == "length":
+        raise ValueError("Evaluation response was cut off by EVAL_MAX_TOKENS.")
+
+
+def _parse_json(text: str) -> Any:
+    # Models without a response_format sometimes wrap the object in a Markdown fence.
+    text = text.strip().removeprefix("```json").removeprefix("```").removesuffix("```")
     try:
-        data = json.loads(text)
+        return json.loads(text)
     except json.JSONDecodeError as exc:
         raise ValueError("Evaluation model returned non-JSON response.") from exc
 
-    transcription_out = data.get("transcription", transcription).strip()
+
+def _evaluation_result(
+    text: str, prompt: EvalPrompt, transcription: str, arabic_transliteration: str | None, local: bool
+) -> Dict[str, Any]:
+    return _evaluation_fields(prompt.fields(_parse_json(text)), transcription, arabic_transliteration, local)
+
+
+def _evaluation_fields(
+    data: Dict[str, Any], transcription: str, arabic_transliteration: str | None, local: bool
+) -> Dict[str, Any]:
+    """The result from the model's answer, already under the result field names."""
+    if not isinstance(data, dict):
+        raise ValueError("Evaluation response missing required fields.")
+    transcription_out = _strip_arabic(data.get("transcription", transcription)).strip()
     feedback = data.get("feedback", "").strip()
-    score = data.get("score")
-    translation_score = data.get("translation_score", data.get("translationScore"))
-    pronunciation_score = data.get("pronunciation_score", data.get("pronunciationScore"))
 
     if feedback == "":
         raise ValueError("Evaluation response missing required fields.")
 
+    if local:
+        result = score_transliteration(transcription_out, arabic_transliteration or "")
+        score_int = result.score
+        translation_int = result.translation_score
+        pronunciation_int = result.pronunciation_score
+    else:
+        score_int, translation_int, pronunciation_int = _parse_scores(data)
+
+    return {
+        "transcription": transcription_out or "תמלול לא זמין ללא תעתיק עברי.",
+        "feedback": _strip_arabic(feedback).strip() or "לא סופק משוב ללא תעתיק עברי.",
+        "score": max(0, min(score_int, 100)),
+        "translation_score": max(0, min(translation_int or 0, 100)),
+        "pronunciation_score": max(0, min(pronunciation_int or 0, 100)),
+    }
+
+
+class _JsonStringField:
+    """Incrementally decode one string field out of a JSON object while it is being streamed."""
+
+    _ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f"}
+
+    def __init__(self, name: str) -> None:
+        self._start = re.compile(r'"%s"\s*:\s*"' % re.escape(name))
+        self._buf = ""
+        self._pos: int | None = None
+        self._done = False
+
+    def feed(self, chunk: str) -> str:
+        """Add raw JSON text; return the newly decoded part of the field's value."""
+        self._buf += chunk
+        if self._done:
+            return ""
+        if self._pos is None:
+            match = self._start.search(self._buf)
+            if match is None:
+                return ""
+            self._pos = match.end()
+        buf, i, out = self._buf, self._pos, []
+        while i < len(buf):
+            ch = buf[i]
+            if ch == '"':
+                self._done = True
+                break
+            if ch == "\\":
+                if i + 1 >= len(buf):
+                    break
+                esc = buf[i + 1]
+                if esc == "u":
+                    if i + 6 > len(buf):
+                        break
+                    try:
+                        out.append(chr(int(buf[i + 2 : i + 6], 16)))
+                    except ValueError:
+                        out.append(buf[i : i + 6])
+                    i += 6
+                    continue
+                out.append(self._ESCAPES.get(esc, esc))
+                i += 2
+                continue
+            out.append(ch)
+            i += 1
+        self._pos = i
+        return "".join(out)
+
+
+async def _stream_completion(
+    client: AsyncOpenAI,
+    request: Dict[str, Any],
+    prompt: EvalPrompt,
+    on_feedback: Callable[[str], None],
+) -> str:
+    feedback = _JsonStringField(prompt.keys["feedback"])
+    parts = []
+    # The final chunk carries token usage (and no choices).
+    stream = await client.chat.completions.create(**request, stream=True, stream_options={"include_usage": True})
+    async for chunk in stream:
+        if chunk.usage is not None:
+            record_usage(request["model"], chunk.usage, prompt=prompt.version)
+        if not chunk.choices:
+            continue
+        _check_finished(chunk.choices[0].finish_reason)
+        delta = chunk.choices[0].delta.content
+        if delta:
+            parts.append(delta)
+            piece = _strip_arabic(feedback.feed(delta))
+            if piece:
+                on_feedback(piece)
+    return "".join(parts)
+
+
+def _parse_scores(data: Dict[str, Any]) -> Tuple[int, int | None, int | None]:
+    """Read model-computed scores, deriving missing ones sensibly."""
+    score = data.get("score")
+    translation_score = data.get("translation_score", data.get("translationScore"))
+    pronunciation_score = data.get("pronunciation_score", data.get("pronunciationScore"))
+
     def _to_int(val: Any) -> int | None:
         try:
             return int(val)
@@ -145,7 +634,6 @@ def _evaluate(
     translation_int = _to_int(translation_score)
     pronunciation_int = _to_int(pronunciation_score)
 
-    # Derive missing scores sensibly.
     if score_int is None and translation_int is not None and pronunciation_int is not None:
         score_int = round((translation_int + pronunciation_int) / 2)
     if translation_int is None:
@@ -154,13 +642,22 @@ def _evaluate(
         pronunciation_int = score_int
     if score_int is None:
         raise ValueError("Score must be an integer.")
+    return score_int, translation_int, pronunciation_int
+
 
+def _fast_score(transcription: str, arabic_transliteration: str | None) -> Dict[str, Any]:
+    """Score the Whisper transcript locally with no evaluation call at all."""
+    if not arabic_transliteration:
+        raise ValueError("Fast scoring requires arabic_transliteration.")
+    # Whisper writes Arabic speech in Arabic script; map it onto Hebrew letters first.
+    hebrew = transliterate_arabic(transcription).strip()
+    result = score_transliteration(hebrew, arabic_transliteration)
     return {
-        "transcription": _strip_arabic(transcription_out).strip() or "תמלול לא זמין ללא תעתיק עברי.",
-        "feedback": _strip_arabic(feedback).strip() or "לא סופק משוב ללא תעתיק עברי.",
-        "score": max(0, min(score_int, 100)),
-        "translation_score": max(0, min(translation_int or 0, 100)),
-        "pronunciation_score": max(0, min(pronunciation_int or 0, 100)),
+        "transcription": _strip_arabic(hebrew).strip() or "תמלול לא זמין ללא תעתיק עברי.",
+        "feedback": local_feedback(result),
+        "score": result.score,
+        "translation_score": result.translation_score,
+        "pronunciation_score": result.pronunciation_score,
     }
 
 
@@ -169,32 +666,350 @@ def _strip_arabic(text: str) -> str:
     return re.sub(r"[\u0600-\u06FF]+", "", text)
 
 
-def _run_model(
-    audio_bytes: bytes,
+_SCORE_KEYS = ("transcription", "score", "translation_score", "pronunciation_score")
+
+
+async def _evaluation_events(
+    evaluate: Callable[[Callable[[str], None] | None], Awaitable[Dict[str, Any]]], stream_feedback: bool
+) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """Run `evaluate(on_feedback)`, yielding "feedback_delta" events meanwhile, then ("evaluated", result)."""
+    if not stream_feedback:
+        yield "evaluated", await evaluate(None)
+        return
+    deltas: asyncio.Queue[str | None] = asyncio.Queue()
+    task = asyncio.ensure_future(evaluate(deltas.put_nowait))
+    task.add_done_callback(lambda _: deltas.put_nowait(None))
+    try:
+        while (delta := await deltas.get()) is not None:
+            yield "feedback_delta", {"text": delta}
+        yield "evaluated", await task
+    finally:
+        # The consumer went away mid-stream.
+        task.cancel()
+
+
+async def analyze_audio_events(
+    audio: AudioSource,
+    phrase: str | None = None,
+    hint: str | None = None,
+    arabic_transliteration: str | None = None,
+    scoring: str | None = None,
+    stream_feedback: bool = True,
+    transcriber: str | None = None,
+    engine: str | None = None,
+    compare: bool = True,
+) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Run the analysis and yield (event, data) pairs as each part becomes available:
+    "transcription" as soon as Whisper returns, "feedback_delta" while the feedback
+    is generated (when `stream_feedback`), then "scores", "feedback" and finally
+    "result" with the same payload /api/analyze returns. Both upstream calls share
+    one ANALYZE_DEADLINE; running out raises DeadlineExceeded. `transcriber` picks a
+    backend from TRANSCRIBE_BACKENDS (default TRANSCRIBE_BACKEND). `engine` "audio"
+    (default ANALYZE_ENGINE) replaces both calls with one to AUDIO_EVAL_MODEL; its
+    transcription arrives with the scores. "fast" scoring always uses the pipeline.
+    With `compare`, ENGINE_SHADOW_RATE of requests are also run through the other engine.
+    """
+    scoring = scoring or SCORING_MODE
+    if scoring not in SCORING_MODES:
+        raise ValueError(f"Unknown scoring mode: {scoring}.")
+    engine = engine or ANALYZE_ENGINE
+    if engine not in ANALYZE_ENGINES:
+        raise ValueError(f"Unknown analysis engine: {engine}.")
+    if scoring == "fast":
+        engine = "pipeline"
+    started = time.perf_counter()
+    deadline = Deadline(ANALYZE_DEADLINE)
+    # Kept as bytes only for sampled requests: the upload is closed once this request ends.
+    sampled = compare and scoring != "fast" and random.random() < ENGINE_SHADOW_RATE
+    shadow_audio = _shadow_copy(audio) if sampled else None
+
+    if engine == "audio":
+        client = get_client()
+        audio_stats: Dict[str, Any] = {}
+
+        def evaluate(on_feedback: Callable[[str], None] | None) -> Awaitable[Dict[str, Any]]:
+            return _evaluate_audio(client, audio, phrase, hint, arabic_transliteration, scoring, on_feedback, deadline)
+
+    else:
+        backend = transcription_backend(transcriber)
+        transcription, audio_stats = await _transcribe_cached(audio, backend, deadline)
+        # Whisper usually answers in Arabic script; preview it in Hebrew letters until the model's version arrives.
+        yield "transcription", {"transcription": _strip_arabic(transliterate_arabic(transcription)).strip()}
+        # Only the evaluation needs the API client; "fast" with local transcription runs offline.
+        client = get_client() if scoring != "fast" else None
+
+        def evaluate(on_feedback: Callable[[str], None] | None) -> Awaitable[Dict[str, Any]]:
+            return _evaluate_memoized(
+                client, transcription, phrase, hint, arabic_transliteration, scoring, on_feedback, deadline
+            )
+
+    if scoring == "fast":
+        result = _fast_score(transcription, arabic_transliteration)
+    else:
+        async for event, data in _evaluation_events(evaluate, stream_feedback):
+            if event == "evaluated":
+                result = data
+            else:
+                yield event, data
+    if engine == "audio":
+        audio_stats = result.pop("audio", {})
+        yield "transcription", {"transcription": result["transcription"]}
+
+    yield "scores", {key: result[key] for key in _SCORE_KEYS}
+    yield "feedback", {"feedback": result["feedback"]}
+    # Bytes in/out and per-stage preprocessing timings.
+    result["audio"] = audio_stats
+    result["engine"] = engine
+    analysis_seconds.observe(time.perf_counter() - started, engine=engine)
+    if shadow_audio is not None:
+        _start_shadow(engine, shadow_audio, phrase, hint, arabic_transliteration, scoring, transcriber, result)
+    yield "result", result
+
+
+def _shadow_copy(audio: AudioSource) -> bytes:
+    if isinstance(audio, bytes):
+        return audio
+    data = as_file(audio).read()
+    audio.seek(0)
+    return data
+
+
+def _start_shadow(
+    engine: str,
+    audio: bytes,
     phrase: str | None,
     hint: str | None,
     arabic_transliteration: str | None,
-) -> Dict[str, Any]:
-    client = _client()
-    transcription = _transcribe(client, audio_bytes)
-    return _evaluate(client, transcription, phrase, hint, arabic_transliteration)
+    scoring: str,
+    transcriber: str | None,
+    result: Dict[str, Any],
+) -> None:
+    """Analyze the same recording with the other engine, off the request path, and record how they differ."""
+    other = "pipeline" if engine == "audio" else "audio"
+
+    async def compare() -> None:
+        shadow: Dict[str, Any] = {}
+        try:
+            async for event, data in analyze_audio_events(
+                audio, phrase, hint, arabic_transliteration, scoring, False, transcriber, other, compare=False
+            ):
+                if event == "result":
+                    shadow = data
+        except Exception as exc:  # noqa: BLE001
+            logging.info("Shadow analysis with the %s engine failed: %s", other, exc)
+            engine_shadow_failures.inc(engine=other, reason="error")
+            return
+        keys = ("score", "translation_score", "pronunciation_score")
+        if any(data.get(key) is None for data in (result, shadow) for key in keys + ("transcription",)):
+            # e.g. the shadow engine ended without a "result" event.
+            engine_shadow_failures.inc(engine=other, reason="incomplete")
+            return
+        for key in keys:
+            engine_score_gap.observe(abs(result[key] - shadow[key]), score=key)
+        agreement = score_transliteration(shadow["transcription"], result["transcription"]).translation_score
+        engine_transcript_agreement.observe(agreement)
+
+    task = asyncio.ensure_future(compare())
+    _shadows.add(task)
+    task.add_done_callback(_shadows.discard)
 
 
 async def analyze_audio(
-    audio_bytes: bytes,
+    audio: AudioSource,
     phrase: str | None = None,
     hint: str | None = None,
     arabic_transliteration: str | None = None,
+    scoring: str | None = None,
+    transcriber: str | None = None,
+    engine: str | None = None,
 ) -> Dict[str, Any]:
     """
-    Run pronunciation analysis using Whisper for transcription, then an LLM for scoring/feedback.
-    Wrapped in a thread to avoid blocking the event loop.
+    Run pronunciation analysis using Whisper for transcription, then an LLM for feedback.
+    `audio` is the recording as bytes or as a seekable file such as the spooled upload.
+    Scores come from the local scorer ("local"), the LLM ("llm"), or the local scorer
+    alone with no LLM call ("fast"); defaults to SCORING_MODE. `engine` "audio" makes
+    one call to an audio-capable model instead of the two (default ANALYZE_ENGINE).
+    Both calls go through the shared async client, so the event loop is never blocked.
     """
-
-    return await asyncio.to_thread(
-        _run_model,
-        audio_bytes,
+    result: Dict[str, Any] = {}
+    async for event, data in analyze_audio_events(
+        audio,
         phrase,
         hint,
         arabic_transliteration,
-    )
+        scoring,
+        stream_feedback=False,
+        transcriber=transcriber,
+        engine=engine,
+    ):
+        if event == "result":
+            result = data
+    return result
+
+
+class _EvalPacker:
+    """
+    Packs the evaluations of one batch into chat calls of up to EVAL_PACK_SIZE items.
+    Items are grouped by prompt (local or model scoring). A group is sent when it is
+    full, when its first item has waited EVAL_PACK_WAIT seconds, or as soon as no
+    recording of the batch is still on its way, since nothing more could join it.
+    An item the packed answer does not cover is evaluated on its own.
+    """
+
+    def __init__(self, client: AsyncOpenAI, scoring: str, expected: int) -> None:
+        self._client = client
+        self._scoring = scoring
+        # Recordings that may still reach evaluate().
+        self._expected = expected
+        self._groups: Dict[bool, List[_PackItem]] = {False: [], True: []}
+        self._timers: Dict[bool, asyncio.TimerHandle] = {}
+        self._sends: set = set()
+
+    async def evaluate(
+        self,
+        transcription: str,
+        phrase: str | None,
+        hint: str | None,
+        arabic_transliteration: str | None,
+        deadline: Deadline,
+    ) -> Dict[str, Any]:
+        key = _eval_key(transcription, phrase, hint, arabic_transliteration, self._scoring)
+        cached = await _memo_get(key)
+        if cached is not None:
+            self.skip()
+            return cached
+        local = self._scoring == "local" and bool(arabic_transliteration)
+        loop = asyncio.get_running_loop()
+        item = _PackItem(key, transcription, phrase, hint, arabic_transliteration, deadline, loop.create_future())
+        group = self._groups[local]
+        group.append(item)
+        if len(group) >= EVAL_PACK_SIZE:
+            self._flush(local)
+        elif len(group) == 1:
+            self._timers[local] = loop.call_later(EVAL_PACK_WAIT, self._flush, local)
+        self.skip()
+        return await item.future
+
+    def skip(self) -> None:
+        """One recording will not (or no longer) join a group: it failed, or has been added."""
+        self._expected -= 1
+        if self._expected <= 0:
+            for local in self._groups:
+                self._flush(local)
+
+    def close(self) -> None:
+        for timer in self._timers.values():
+            timer.cancel()
+        for task in self._sends:
+            task.cancel()
+
+    def _flush(self, local: bool) -> None:
+        timer = self._timers.pop(local, None)
+        if timer is not None:
+            timer.cancel()
+        group, self._groups[local] = self._groups[local], []
+        if group:
+            task = asyncio.ensure_future(self._send(group, local))
+            self._sends.add(task)
+            task.add_done_callback(self._sends.discard)
+
+    async def _send(self, group: List[_PackItem], local: bool) -> None:
+        eval_pack_items.observe(len(group))
+        results: List[Dict[str, Any] | None] = [None] * len(group)
+        if len(group) > 1:
+            # The pack may not outlive any of its items.
+            deadline = min((item.deadline for item in group), key=lambda d: d.expires)
+            try:
+                results = await _evaluate_packed(self._client, group, local, deadline)
+            except (Overloaded, DeadlineExceeded) as exc:
+                # One by one would only meet the same limit.
+                for item in group:
+                    if not item.future.done():
+                        item.future.set_exception(exc)
+                return
+            except Exception as exc:  # noqa: BLE001
+                logging.info("Packed evaluation of %d items failed, evaluating them one by one: %s", len(group), exc)
+        await asyncio.gather(*(self._settle(item, result) for item, result in zip(group, results)))
+
+    async def _settle(self, item: _PackItem, result: Dict[str, Any] | None) -> None:
+        try:
+            if result is None:
+                result = await _evaluate_memoized(
+                    self._client,
+                    item.transcription,
+                    item.phrase,
+                    item.hint,
+                    item.arabic_transliteration,
+                    self._scoring,
+                    deadline=item.deadline,
+                )
+            else:
+                await _memo_set(item.key, result)
+                result = dict(result)
+        except Exception as exc:  # noqa: BLE001
+            if not item.future.done():
+                item.future.set_exception(exc)
+            return
+        if not item.future.done():
+            item.future.set_result(result)
+
+
+async def analyze_batch(
+    recordings: List[Tuple[AudioSource, Dict[str, Any]]],
+    scoring: str | None = None,
+    transcriber: str | None = None,
+) -> AsyncIterator[Tuple[int, Dict[str, Any] | Exception]]:
+    """
+    Analyze many recordings, each with its own phrase context (phrase, hint and
+    arabic_transliteration), and yield (index, result) as each one finishes, or
+    (index, exception) for one that failed; the rest carry on. BATCH_CONCURRENCY
+    recordings are transcribed at a time, each under its own ANALYZE_DEADLINE, and
+    their evaluations are packed into shared chat calls (see _EvalPacker). Always
+    uses the pipeline engine; results match analyze_audio's.
+    """
+    scoring = scoring or SCORING_MODE
+    if scoring not in SCORING_MODES:
+        raise ValueError(f"Unknown scoring mode: {scoring}.")
+    backend = transcription_backend(transcriber)
+    packer = _EvalPacker(get_client(), scoring, len(recordings)) if scoring != "fast" else None
+    gate = asyncio.Semaphore(BATCH_CONCURRENCY)
+    finished: asyncio.Queue[Tuple[int, Dict[str, Any] | Exception]] = asyncio.Queue()
+
+    async def one(audio: AudioSource, context: Dict[str, Any]) -> Dict[str, Any]:
+        started = time.perf_counter()
+        try:
+            async with gate:
+                deadline = Deadline(ANALYZE_DEADLINE)
+                transcription, audio_stats = await _transcribe_cached(audio, backend, deadline)
+        except BaseException:
+            if packer is not None:
+                packer.skip()
+            raise
+        if packer is None:
+            result = _fast_score(transcription, context.get("arabic_transliteration"))
+        else:
+            result = await packer.evaluate(
+                transcription, context.get("phrase"), context.get("hint"), context.get("arabic_transliteration"), deadline
+            )
+        result["audio"] = audio_stats
+        result["engine"] = "pipeline"
+        analysis_seconds.observe(time.perf_counter() - started, engine="pipeline")
+        return result
+
+    async def run(index: int, audio: AudioSource, context: Dict[str, Any]) -> None:
+        try:
+            finished.put_nowait((index, await one(audio, context)))
+        except Exception as exc:  # noqa: BLE001
+            finished.put_nowait((index, exc))
+
+    tasks = [asyncio.ensure_future(run(index, *recording)) for index, recording in enumerate(recordings)]
+    try:
+        for _ in tasks:
+            yield await finished.get()
+    finally:
+        # The consumer went away, or everything is done.
+        for task in tasks:
+            task.cancel()
+        if packer is not None:
+            packer.close()
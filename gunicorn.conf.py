@@ -0,0 +1,51 @@
+"""
+Production launcher: `gunicorn -c gunicorn.conf.py main:server`.
+
+WEB_CONCURRENCY uvicorn workers behind one gunicorn master. With preload (the
+default) the master imports the app, Dash and openai once and forks the workers from
+it, so they share those pages and serve from their first second. On SIGTERM each
+worker stops accepting connections, finishes the requests it is serving (at most
+GRACEFUL_TIMEOUT seconds) and then runs the lifespan shutdown, which writes the
+queued learner history. For development, `python main.py` still runs uvicorn with
+auto-reload.
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+# Worker processes; each has its own event loop, OpenAI connection pool and in-memory caches.
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn_worker.UvicornWorker"
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") != "0"
+# Seconds between SIGTERM and SIGKILL for a worker; below the platform's own shutdown delay (Render: 30).
+graceful_timeout = int(os.environ.get("GRACEFUL_TIMEOUT", "25"))
+# A worker whose event loop is stuck this long is restarted.
+timeout = int(os.environ.get("WORKER_TIMEOUT", "60"))
+keepalive = int(os.environ.get("KEEPALIVE", "5"))
+# Restart each worker after this many requests (0: never), staggered by the jitter.
+max_requests = int(os.environ.get("MAX_REQUESTS", "0"))
+max_requests_jitter = int(os.environ.get("MAX_REQUESTS_JITTER", "0"))
+accesslog = "-"
+
+# Chunks of one recording reach whichever worker accepts them, so upload sessions
+# must live where every worker sees them (see upload_sessions.py).
+if workers > 1:
+    os.environ.setdefault("UPLOAD_SESSION_DIR", ".cache/uploads")
+
+# Seconds of the graceful timeout kept for the lifespan shutdown once requests are cut off.
+SHUTDOWN_RESERVE = 5
+
+
+def post_worker_init(worker) -> None:
+    # Plain UvicornWorker waits for in-flight requests (a long batch stream, say) until
+    # gunicorn kills it; stop waiting SHUTDOWN_RESERVE seconds earlier so the lifespan
+    # shutdown still runs.
+    worker.config.timeout_graceful_shutdown = max(1, worker.cfg.graceful_timeout - SHUTDOWN_RESERVE)
+
+
+def when_ready(server) -> None:
+    # Runs in the master after the app is loaded and before any worker is forked.
+    if preload_app:
+        import main
+
+        main.preload()
@@ -0,0 +1,354 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Tuple
+
+from metrics import registry, run_in_thread
+from scoring import letter_errors, score_transliteration
+
+# SQLite file with every learner's attempts and their aggregates; "" turns history off.
+HISTORY_DB = os.environ.get("HISTORY_DB", ".cache/history.sqlite3")
+# Attempts are committed in batches, at least every HISTORY_FLUSH_INTERVAL seconds.
+HISTORY_BATCH_SIZE = int(os.environ.get("HISTORY_BATCH_SIZE", "256"))
+HISTORY_FLUSH_INTERVAL = float(os.environ.get("HISTORY_FLUSH_INTERVAL", "1"))
+# Attempts waiting to be written; past this they are dropped rather than slowing requests.
+HISTORY_QUEUE_MAX = int(os.environ.get("HISTORY_QUEUE_MAX", "10000"))
+
+LEARNER_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+history_attempts = registry.counter("coach_history_attempts_total", "Attempts handed to the history store, by outcome.")
+history_batch = registry.histogram(
+    "coach_history_batch_attempts", "Attempts committed per history transaction.", (1, 2, 5, 10, 25, 50, 100, 250, 500)
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS attempts (
+    id INTEGER PRIMARY KEY,
+    learner TEXT NOT NULL,
+    phrase_id TEXT,
+    created REAL NOT NULL,
+    score INTEGER NOT NULL,
+    translation_score INTEGER NOT NULL,
+    pronunciation_score INTEGER NOT NULL,
+    engine TEXT NOT NULL,
+    transcription TEXT NOT NULL,
+    target TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS attempts_learner ON attempts (learner, created);
+CREATE TABLE IF NOT EXISTS learner_stats (
+    learner TEXT PRIMARY KEY,
+    attempts INTEGER NOT NULL,
+    score_sum INTEGER NOT NULL,
+    best INTEGER NOT NULL,
+    first_at REAL NOT NULL,
+    last_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS phrase_stats (
+    learner TEXT NOT NULL,
+    phrase_id TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    score_sum INTEGER NOT NULL,
+    best INTEGER NOT NULL,
+    last_score INTEGER NOT NULL,
+    last_at REAL NOT NULL,
+    PRIMARY KEY (learner, phrase_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS letter_stats (
+    learner TEXT NOT NULL,
+    letter TEXT NOT NULL,
+    seen INTEGER NOT NULL,
+    errors INTEGER NOT NULL,
+    PRIMARY KEY (learner, letter)
+) WITHOUT ROWID;
+"""
+
+# Each batch is folded into the aggregates in the same transaction that stores it.
+_UPSERT_LEARNER = """
+INSERT INTO learner_stats VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (learner) DO UPDATE SET
+    attempts = attempts + excluded.attempts,
+    score_sum = score_sum + excluded.score_sum,
+    best = max(best, excluded.best),
+    first_at = min(first_at, excluded.first_at),
+    last_at = max(last_at, excluded.last_at)
+"""
+_UPSERT_PHRASE = """
+INSERT INTO phrase_stats VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (learner, phrase_id) DO UPDATE SET
+    attempts = attempts + excluded.attempts,
+    score_sum = score_sum + excluded.score_sum,
+    best = max(best, excluded.best),
+    last_score = CASE WHEN excluded.last_at >= last_at THEN excluded.last_score ELSE last_score END,
+    last_at = max(last_at, excluded.last_at)
+"""
+_UPSERT_LETTER = """
+INSERT INTO letter_stats VALUES (?, ?, ?, ?)
+ON CONFLICT (learner, letter) DO UPDATE SET
+    seen = seen + excluded.seen,
+    errors = errors + excluded.errors
+"""
+
+
+def valid_learner_id(learner_id: str) -> bool:
+    return LEARNER_ID.match(learner_id) is not None
+
+
+@dataclass(frozen=True)
+class Attempt:
+    learner: str
+    phrase_id: str | None
+    # The target transliteration the attempt was scored against ("" when there was none).
+    target: str
+    transcription: str
+    score: int
+    translation_score: int
+    pronunciation_score: int
+    engine: str
+    created: float
+
+    @classmethod
+    def from_result(
+        cls, learner: str, phrase_id: str | None, target: str | None, result: Dict[str, Any]
+    ) -> "Attempt":
+        return cls(
+            learner=learner,
+            phrase_id=phrase_id,
+            target=target or "",
+            transcription=result.get("transcription", ""),
+            score=int(result.get("score", 0)),
+            translation_score=int(result.get("translation_score", 0)),
+            pronunciation_score=int(result.get("pronunciation_score", 0)),
+            engine=result.get("engine", ""),
+            created=time.time(),
+        )
+
+
+class HistoryDB:
+    """
+    Attempts and per-learner, per-phrase and per-letter aggregates in one SQLite file
+    (WAL, so reads never wait for the writer). Writes and reads use separate
+    connections. Blocking; call it from a worker thread.
+    """
+
+    def __init__(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._write_lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._writer = self._connect(path)
+        self._writer.executescript(_SCHEMA)
+        self._reader = self._connect(path)
+
+    @staticmethod
+    def _connect(path: str) -> sqlite3.Connection:
+        conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # Durable at each checkpoint rather than each commit; WAL keeps the file consistent.
+        conn.execute("PRAGMA synchronous=NORMAL")
+        # Other worker processes share the file; wait for their commits instead of failing.
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    def write(self, attempts: List[Attempt]) -> None:
+        learners: Dict[str, List[Any]] = {}
+        phrases: Dict[Tuple[str, str], List[Any]] = {}
+        letters: Dict[Tuple[str, str], List[int]] = {}
+        for attempt in attempts:
+            learner = learners.setdefault(attempt.learner, [0, 0, 0, attempt.created, attempt.created])
+            learner[0] += 1
+            learner[1] += attempt.score
+            learner[2] = max(learner[2], attempt.score)
+            learner[3] = min(learner[3], attempt.created)
+            learner[4] = max(learner[4], attempt.created)
+            if attempt.phrase_id:
+                phrase = phrases.setdefault((attempt.learner, attempt.phrase_id), [0, 0, 0, 0, 0.0])
+                phrase[0] += 1
+                phrase[1] += attempt.score
+                phrase[2] = max(phrase[2], attempt.score)
+                if attempt.created >= phrase[4]:
+                    phrase[3], phrase[4] = attempt.score, attempt.created
+            if attempt.target:
+                scored = score_transliteration(attempt.transcription, attempt.target)
+                for letter, (seen, errors) in letter_errors(scored).items():
+                    counts = letters.setdefault((attempt.learner, letter), [0, 0])
+                    counts[0] += seen
+                    counts[1] += errors
+
+        with self._write_lock:
+            self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                self._writer.executemany(
+                    "INSERT INTO attempts (learner, phrase_id, created, score, translation_score,"
+                    " pronunciation_score, engine, transcription, target) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (
+                            a.learner,
+                            a.phrase_id,
+                            a.created,
+                            a.score,
+                            a.translation_score,
+                            a.pronunciation_score,
+                            a.engine,
+                            a.transcription,
+                            a.target,
+                        )
+                        for a in attempts
+                    ],
+                )
+                self._writer.executemany(_UPSERT_LEARNER, [(key, *values) for key, values in learners.items()])
+                self._writer.executemany(_UPSERT_PHRASE, [(*key, *values) for key, values in phrases.items()])
+                self._writer.executemany(_UPSERT_LETTER, [(*key, *values) for key, values in letters.items()])
+            except BaseException:
+                self._writer.execute("ROLLBACK")
+                raise
+            self._writer.execute("COMMIT")
+
+    def progress(self, learner: str, phrases: int) -> Dict[str, Any]:
+        """A learner's totals, letters by error rate, and their `phrases` lowest-scoring phrases."""
+        with self._read_lock:
+            totals = self._reader.execute(
+                "SELECT attempts, score_sum, best, first_at, last_at FROM learner_stats WHERE learner = ?", (learner,)
+            ).fetchone()
+            letter_rows = self._reader.execute(
+                "SELECT letter, seen, errors FROM letter_stats WHERE learner = ?"
+                " ORDER BY CAST(errors AS REAL) / seen DESC, seen DESC",
+                (learner,),
+            ).fetchall()
+            phrase_rows = self._reader.execute(
+                "SELECT phrase_id, attempts, score_sum, best, last_score, last_at FROM phrase_stats WHERE learner = ?"
+                " ORDER BY CAST(score_sum AS REAL) / attempts, last_at LIMIT ?",
+                (learner, phrases),
+            ).fetchall()
+        attempts, score_sum, best, first_at, last_at = totals or (0, 0, 0, None, None)
+        return {
+            "learner_id": learner,
+            "attempts": attempts,
+            "mean_score": round(score_sum / attempts, 1) if attempts else None,
+            "best_score": best if attempts else None,
+            "first_at": first_at,
+            "last_at": last_at,
+            "letters": [
+                {"letter": letter, "seen": seen, "errors": errors, "error_rate": round(errors / seen, 3)}
+                for letter, seen, errors in letter_rows
+            ],
+            "weak_phrases": [
+                {
+                    "phrase_id": phrase_id,
+                    "attempts": count,
+                    "mean_score": round(total / count, 1),
+                    "best_score": top,
+                    "last_score": last_score,
+                    "last_at": at,
+                }
+                for phrase_id, count, total, top, last_score, at in phrase_rows
+            ],
+        }
+
+    def close(self) -> None:
+        with self._write_lock, self._read_lock:
+            self._writer.close()
+            self._reader.close()
+
+
+class LearnerHistory:
+    """
+    Write-behind front for HistoryDB. record() only appends to an in-memory queue, so
+    a request never waits on the disk; a background task commits the queue in batches
+    of up to HISTORY_BATCH_SIZE every HISTORY_FLUSH_INTERVAL seconds, or as soon as a
+    full batch is waiting. Attempts still queued are written on close().
+    """
+
+    def __init__(self, path: str, batch_size: int, interval: float, max_queue: int) -> None:
+        self.path = path
+        self.batch_size = max(1, batch_size)
+        self.interval = interval
+        self.max_queue = max_queue
+        self.db: HistoryDB | None = None
+        self._pending: Deque[Attempt] = deque()
+        self._wake: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        self._closing = False
+
+    @classmethod
+    def from_env(cls) -> "LearnerHistory":
+        return cls(HISTORY_DB, HISTORY_BATCH_SIZE, HISTORY_FLUSH_INTERVAL, HISTORY_QUEUE_MAX)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    async def start(self) -> None:
+        """Open the database and start the writer; called from the FastAPI lifespan."""
+        if not self.enabled or self._task is not None:
+            return
+        self.db = await run_in_thread("history_open", HistoryDB, self.path)
+        self._closing = False
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    def record(self, attempt: Attempt) -> bool:
+        """Queue an attempt for the next batch; False when history is off or the queue is full."""
+        if not self.enabled:
+            return False
+        if len(self._pending) >= self.max_queue:
+            history_attempts.inc(outcome="dropped")
+            return False
+        self._pending.append(attempt)
+        if len(self._pending) >= self.batch_size and self._wake is not None:
+            self._wake.set()
+        return True
+
+    async def progress(self, learner: str, phrases: int) -> Dict[str, Any]:
+        if self.db is None:
+            raise ValueError("Learner history is not open.")
+        return await run_in_thread("history_read", self.db.progress, learner, phrases)
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+        self._closing = True
+        self._wake.set()
+        await self._task
+        self._task = None
+        self.db.close()
+        self.db = None
+
+    async def _run(self) -> None:
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self._flush()
+        await self._flush()
+
+    async def _flush(self) -> None:
+        while self._pending:
+            batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+            try:
+                await run_in_thread("history_write", self.db.write, batch)
+            except Exception:  # noqa: BLE001
+                # The request that produced these has long been answered; log and move on.
+                logging.exception("Could not write %d attempts to the learner history", len(batch))
+                history_attempts.inc(len(batch), outcome="failed")
+                continue
+            history_attempts.inc(len(batch), outcome="written")
+            history_batch.observe(len(batch))
+
+
+history = LearnerHistory.from_env()
+
+registry.gauge_callback(
+    "coach_history_queue", "Attempts waiting to be written to the learner history.", lambda: [({}, len(history))]
+)
@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import asyncio
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict
+
+from metrics import record, watch_limiter
+
+
+class Overloaded(Exception):
+    """
+    Admission was refused. `status` is 429 when the rate limit is the cause and 503
+    when the queue is full or the wait would blow the deadline.
+    """
+
+    def __init__(self, name: str, reason: str, retry_after: float, status: int) -> None:
+        super().__init__(f"{name}: {reason}")
+        self.name = name
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.status = status
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.capacity = max(burst, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self) -> float:
+        """Take a token, returning how long the caller must wait before using it."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def refund(self) -> None:
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+
+class Limiter:
+    """
+    Guards one upstream operation with a concurrency cap, an optional token-bucket
+    rate limit and a bounded wait queue. Callers that cannot be admitted before their
+    deadline are rejected immediately instead of piling up behind the upstream.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        concurrency: int,
+        rate: float = 0.0,
+        burst: float = 0.0,
+        max_queue: int = 64,
+        max_wait: float = 10.0,
+    ) -> None:
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._bucket = TokenBucket(rate, burst or rate) if rate > 0 else None
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {"queue_full": 0, "rate_limited": 0, "deadline": 0}
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        # Exponential moving average of time spent holding a slot, for wait estimates.
+        self._service_time = 1.0
+        watch_limiter(self)
+
+    @classmethod
+    def from_env(cls, name: str, concurrency: int, rate: float = 0.0) -> "Limiter":
+        prefix = f"LIMIT_{name.upper()}"
+        return cls(
+            name,
+            concurrency=int(os.environ.get(f"{prefix}_CONCURRENCY", str(concurrency))),
+            rate=float(os.environ.get(f"{prefix}_RPS", str(rate))),
+            burst=float(os.environ.get(f"{prefix}_BURST", "0")),
+            max_queue=int(os.environ.get(f"{prefix}_QUEUE", os.environ.get("LIMIT_QUEUE", "64"))),
+            max_wait=float(os.environ.get(f"{prefix}_MAX_WAIT", os.environ.get("LIMIT_MAX_WAIT", "10"))),
+        )
+
+    def _reject(self, reason: str, retry_after: float, status: int = 503) -> Overloaded:
+        self.rejected[reason] += 1
+        return Overloaded(self.name, reason, retry_after, status)
+
+    def _estimated_wait(self) -> float:
+        waiting_rounds = (self.queued + 1) / self.concurrency if self.in_flight >= self.concurrency else 0
+        return waiting_rounds * self._service_time
+
+    @asynccontextmanager
+    async def slot(self, deadline: float | None = None) -> AsyncIterator[None]:
+        """Hold one upstream slot; `deadline` is a time.monotonic() value."""
+        started = time.monotonic()
+        budget = self.max_wait if deadline is None else min(self.max_wait, deadline - started)
+
+        if self._bucket is not None:
+            delay = self._bucket.reserve()
+            if delay > budget:
+                self._bucket.refund()
+                raise self._reject("rate_limited", delay, status=429)
+        else:
+            delay = 0.0
+
+        if self._semaphore.locked():
+            if self.queued >= self.max_queue:
+                if self._bucket is not None:
+                    self._bucket.refund()
+                raise self._reject("queue_full", self._estimated_wait())
+            if self._estimated_wait() + delay > budget:
+                if self._bucket is not None:
+                    self._bucket.refund()
+                raise self._reject("deadline", self._estimated_wait())
+
+        self.queued += 1
+        try:
+            if delay:
+                await asyncio.sleep(delay)
+            remaining = budget - (time.monotonic() - started)
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=max(remaining, 0.001))
+        except asyncio.TimeoutError:
+            if self._bucket is not None:
+                self._bucket.refund()
+            raise self._reject("deadline", self._estimated_wait()) from None
+        finally:
+            self.queued -= 1
+
+        waited = time.monotonic() - started
+        self.admitted += 1
+        self.wait_seconds_total += waited
+        self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        record(f"{self.name}_wait", waited)
+        self.in_flight += 1
+        held_from = time.monotonic()
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+            self._service_time = 0.8 * self._service_time + 0.2 * (time.monotonic() - held_from)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "concurrency": self.concurrency,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "wait_seconds_avg": round(self.wait_seconds_total / self.admitted, 4) if self.admitted else 0.0,
+            "wait_seconds_max": round(self.wait_seconds_max, 4),
+        }
+
+
+# One limiter per upstream operation, shared by every request in this worker.
+transcribe_limiter = Limiter.from_env("transcribe", concurrency=16)
+evaluate_limiter = Limiter.from_env("evaluate", concurrency=16)
+tts_limiter = Limiter.from_env("tts", concurrency=8)
+# Single-call analysis with an audio-capable model (ANALYZE_ENGINE=audio).
+audio_limiter = Limiter.from_env("audio", concurrency=16)
+
+
+def limiter_stats() -> Dict[str, Any]:
+    return {lim.name: lim.stats() for lim in (transcribe_limiter, evaluate_limiter, tts_limiter, audio_limiter)}
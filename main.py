@@ -1,19 +1,93 @@
 from __future__ import annotations
 
+import asyncio
+import json
 import logging
 import os
-from typing import Any, Dict
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, BinaryIO, Callable, Dict, List, Tuple
 
-from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from fastapi import FastAPI, File, Form, HTTPException, Path, Query, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.middleware.wsgi import WSGIMiddleware
-from fastapi.responses import Response
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 
-from app import app
-from gemini_service import analyze_audio
-from openai import OpenAI
+from audio_prep import AudioQualityError
+from batch import BATCH_MAX_BYTES, PHRASE_FIELDS, WAV_TYPES, BatchItem, close_items, from_archive, from_files, parse_manifest
+from cache import LRUCache, SingleFlight
+from gemini_service import (
+    ANALYZE_ENGINES,
+    SCORING_MODES,
+    TRANSCRIBE_BACKENDS,
+    analyze_audio,
+    analyze_audio_events,
+    analyze_batch,
+    close_client,
+    get_client,
+    local_transcriber,
+    warm_client,
+)
+from history import Attempt, history, valid_learner_id
+from limits import Overloaded, limiter_stats, tts_limiter
+from metrics import MetricsMiddleware, registry, run_in_thread, stage, upload_bytes, watch_cache
+from phrases import PHRASES_MAX_PAGE_SIZE, PHRASES_PAGE_SIZE, catalog
+from reference_audio import REFERENCE_AUDIO_WARM, ReferenceAudio, parse_range
+from static_assets import DASH_ASSETS_PATH, DASH_ROUTES_PREFIX, IMMUTABLE, REVALIDATE, DashApp, DashStatic, StaticFile
+from tts_cache import Lead, TTSCache, tts_key
+from upload_sessions import UPLOAD_CHUNK_MAX_BYTES, SessionError, upload_sessions
+from uploads import UPLOAD_MAX_BYTES, TOO_LARGE, UploadLimitMiddleware
+from upstream import TTS_DEADLINE, Deadline, DeadlineExceeded, tts_policy
+
+TTS_MODEL = os.environ.get("OPENAI_MODEL_TTS", "gpt-4o-mini-tts")
+TTS_VOICE = os.environ.get("OPENAI_TTS_VOICE", "alloy")
+TTS_STREAM_CHUNK_BYTES = int(os.environ.get("TTS_STREAM_CHUNK_BYTES", "4096"))
+# Opus (in an Ogg container) is the low-bitrate option for slow mobile links.
+TTS_FORMATS = {"mp3": "audio/mpeg", "opus": "audio/ogg", "aac": "audio/aac"}
+
+tts_cache = TTSCache.from_env()
+# Dash and the layout are imported by the lifespan's warm-up, after the server starts accepting requests.
+dash_app = DashApp()
+dash_static = DashStatic(dash_app)
+# _synthesize is defined with the TTS endpoints below; the lambda defers the lookup.
+reference_audio = ReferenceAudio.from_env((TTS_MODEL, TTS_VOICE), lambda text, fmt: _synthesize(text, fmt))
+
+# Completed /api/analyze results by client-supplied idempotency key, so retries are free.
+IDEMPOTENCY_TTL = float(os.environ.get("IDEMPOTENCY_TTL", "600"))
+_idempotent_results: LRUCache[Dict[str, Any]] = LRUCache(
+    int(os.environ.get("IDEMPOTENCY_CACHE_SIZE", "1024")), ttl=IDEMPOTENCY_TTL
+)
+_idempotent_flights = SingleFlight()
+
+watch_cache("idempotency", _idempotent_results)
+watch_cache("tts_memory", tts_cache.memory)
 
-server = FastAPI(title="Levantine Pronunciation Coach API")
+
+@asynccontextmanager
+async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+    await history.start()
+    # Load Dash and precompress the page's bundles in the background; requests meanwhile join the same work.
+    # The page comes first: a visitor needs it seconds before their first recording.
+    warm = [asyncio.create_task(dash_static.warm())]
+    # One pooled OpenAI client per worker, shared by /api/analyze and /api/tts, created and
+    # connected in the background; a request arriving first creates it itself.
+    warm.append(asyncio.create_task(warm_client()))
+    if REFERENCE_AUDIO_WARM:
+        # Synthesizes only phrases added or edited since the last run.
+        warm.append(asyncio.create_task(reference_audio.warm(catalog.phrases)))
+    if local_transcriber.available():
+        # Worker processes load the speech model once, before the first recording needs it.
+        warm.append(asyncio.create_task(local_transcriber.start()))
+    try:
+        yield
+    finally:
+        for task in warm:
+            task.cancel()
+        local_transcriber.close()
+        # Writes the attempts still queued.
+        await history.close()
+        await close_client()
+
+
+server = FastAPI(title="Levantine Pronunciation Coach API", lifespan=lifespan)
 
 # Allow local development from different origins (e.g., Dash hot reload).
 server.add_middleware(
@@ -23,80 +97,766 @@ server.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Size cap on recordings, enforced while the body streams in.
+server.add_middleware(UploadLimitMiddleware, paths=("/api/analyze", "/api/analyze/stream"))
+server.add_middleware(UploadLimitMiddleware, paths=("/api/analyze/batch",), max_bytes=BATCH_MAX_BYTES)
+# Stage histograms for /metrics and a Server-Timing header on every response.
+server.add_middleware(MetricsMiddleware)
+
+
+def _overloaded(exc: Overloaded) -> HTTPException:
+    """Fast rejection from admission control; clients should back off for Retry-After seconds."""
+    return HTTPException(
+        status_code=exc.status,
+        detail="השרת עמוס כרגע. נסו שוב בעוד מספר שניות.",
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+def _timed_out(exc: DeadlineExceeded) -> HTTPException:
+    """The upstream did not answer within the request deadline, retries and hedges included."""
+    return HTTPException(status_code=504, detail="השירות לא הגיב בזמן. נסו שוב.")
+
+
+def _http_error(exc: Exception) -> HTTPException:
+    """Translate an analysis pipeline failure into the HTTP error the client sees."""
+    if isinstance(exc, HTTPException):
+        return exc
+    if isinstance(exc, Overloaded):
+        return _overloaded(exc)
+    if isinstance(exc, DeadlineExceeded):
+        return _timed_out(exc)
+    if isinstance(exc, AudioQualityError):
+        # Rejected before any upstream call; the UI shows the message as-is.
+        return HTTPException(
+            status_code=422,
+            detail={"code": exc.code, "message": exc.message, "metrics": exc.metrics},
+        )
+    if isinstance(exc, ValueError):
+        # Likely configuration issues such as missing API key.
+        return HTTPException(status_code=500, detail=str(exc))
+    logging.error("Gemini analysis failed", exc_info=exc)
+    return HTTPException(status_code=500, detail="Failed to analyze audio.")
+
+
+async def _analyze(audio: BinaryIO, **context: Any) -> Dict[str, Any]:
+    """Run the analysis pipeline and translate its failures into HTTP errors."""
+    try:
+        return await analyze_audio(audio, **context)
+    except Exception as exc:  # noqa: BLE001
+        raise _http_error(exc) from exc
+
+
+def _check_upload(
+    file: UploadFile | None,
+    upload_id: str | None,
+    scoring: str | None,
+    transcriber: str | None,
+    engine: str | None,
+) -> None:
+    if (file is None) == (upload_id is None):
+        raise HTTPException(status_code=400, detail="Send either a file or an upload_id.")
+    if file is not None and file.content_type not in WAV_TYPES:
+        raise HTTPException(status_code=400, detail="File must be a WAV audio.")
+    _check_options(scoring, transcriber, engine)
+
+
+def _check_options(scoring: str | None, transcriber: str | None, engine: str | None = None) -> None:
+    if scoring is not None and scoring not in SCORING_MODES:
+        raise HTTPException(status_code=400, detail=f"scoring must be one of: {', '.join(SCORING_MODES)}.")
+    if transcriber is not None:
+        available = [name for name, backend in TRANSCRIBE_BACKENDS.items() if backend.available()]
+        if transcriber not in available:
+            raise HTTPException(status_code=400, detail=f"transcriber must be one of: {', '.join(available)}.")
+    if engine is not None and engine not in ANALYZE_ENGINES:
+        raise HTTPException(status_code=400, detail=f"engine must be one of: {', '.join(ANALYZE_ENGINES)}.")
+
+
+def _upload_source(file: UploadFile) -> BinaryIO:
+    """
+    The spooled upload itself (memory up to UPLOAD_SPOOL_BYTES, a temporary file beyond),
+    handed to the pipeline as-is rather than read into a bytes object here.
+    """
+    size = file.size if file.size is not None else file.file.seek(0, os.SEEK_END)
+    upload_bytes.observe(size)
+    if not size:
+        raise HTTPException(status_code=400, detail="Empty audio file received.")
+    file.file.seek(0)
+    return file.file
+
+
+def _session_error(exc: SessionError) -> HTTPException:
+    # next_seq tells a reconnecting client which chunk to resend from.
+    detail = exc.message if exc.next_seq is None else {"message": exc.message, "next_seq": exc.next_seq}
+    return HTTPException(status_code=exc.status, detail=detail)
+
+
+def _finalize_upload(upload_id: str, chunks: int | None) -> BinaryIO:
+    """The recording assembled by a chunked upload session; the caller closes it."""
+    try:
+        audio = upload_sessions.finalize(upload_id, chunks)
+    except SessionError as exc:
+        raise _session_error(exc) from exc
+    upload_bytes.observe(audio.seek(0, os.SEEK_END))
+    audio.seek(0)
+    return audio
+
+
+async def _analyze_upload(
+    file: UploadFile | None, upload_id: str | None, chunks: int | None, context: Dict[str, Any]
+) -> Dict[str, Any]:
+    if file is not None:
+        return await _analyze(_upload_source(file), **context)
+    audio = _finalize_upload(upload_id, chunks)
+    try:
+        return await _analyze(audio, **context)
+    finally:
+        audio.close()
+
+
+def _check_learner(learner_id: str | None) -> None:
+    if learner_id is not None and not valid_learner_id(learner_id):
+        raise HTTPException(status_code=400, detail="learner_id must be 1-64 letters, digits, '-' or '_'.")
+
+
+def _record_attempt(
+    learner_id: str | None, phrase_id: str | None, context: Dict[str, Any], result: Dict[str, Any]
+) -> None:
+    """Queue the attempt for the learner's history; the write happens off the request path."""
+    if learner_id:
+        history.record(Attempt.from_result(learner_id, phrase_id, context.get("arabic_transliteration"), result))
+
+
+def _phrase_context(
+    phrase_id: str | None, phrase: str | None, hint: str | None, arabic_transliteration: str | None
+) -> Dict[str, Any]:
+    """Fill the target phrase from the catalog when the client sends only its id."""
+    if phrase_id is not None:
+        entry = catalog.get(phrase_id)
+        if entry is None:
+            raise HTTPException(status_code=404, detail="Unknown phrase_id.")
+        phrase = phrase or entry.native
+        hint = hint or entry.hint
+        arabic_transliteration = arabic_transliteration or entry.arabic_transliteration
+    return {"phrase": phrase, "hint": hint, "arabic_transliteration": arabic_transliteration}
 
 
 @server.post("/api/analyze")
 async def analyze(
-    file: UploadFile = File(...),
+    request: Request,
+    file: UploadFile | None = File(None),
+    upload_id: str | None = Form(None),
+    chunks: int | None = Form(None),
+    phrase_id: str | None = Form(None),
     phrase: str | None = Form(None),
     hint: str | None = Form(None),
     arabic_transliteration: str | None = Form(None),
+    scoring: str | None = Form(None),
+    transcriber: str | None = Form(None),
+    engine: str | None = Form(None),
+    idempotency_key: str | None = Form(None),
+    learner_id: str | None = Form(None),
 ) -> Dict[str, Any]:
     """
     Receive an uploaded WAV file from the frontend, run Gemini analysis,
-    and return structured feedback. Accepts the native phrase as context.
+    and return structured feedback. Accepts the native phrase as context,
+    or a catalog `phrase_id` in place of phrase, hint and transliteration.
+    `scoring` overrides SCORING_MODE for this request ("local", "llm" or "fast"), and
+    `transcriber` overrides TRANSCRIBE_BACKEND ("openai" or, when installed, "local"), and
+    `engine` overrides ANALYZE_ENGINE ("pipeline", or "audio" for one audio-model call).
+    In place of `file`, `upload_id` finalizes a chunked upload (see /api/uploads);
+    `chunks`, the number of chunks sent, makes it refuse with 409 until all arrived.
+    Repeating a request with the same idempotency key (form field or
+    Idempotency-Key header) returns the first result without any model call.
+    With `learner_id`, the attempt is added to that learner's history (/api/progress).
     """
-    if file.content_type not in {"audio/wav", "audio/x-wav", "audio/wave"}:
-        raise HTTPException(status_code=400, detail="File must be a WAV audio.")
+    _check_upload(file, upload_id, scoring, transcriber, engine)
+    _check_learner(learner_id)
+    context = _phrase_context(phrase_id, phrase, hint, arabic_transliteration)
 
-    audio_bytes = await file.read()
-    if not audio_bytes:
-        raise HTTPException(status_code=400, detail="Empty audio file received.")
+    idempotency_key = idempotency_key or request.headers.get("idempotency-key")
+    if idempotency_key:
+        previous = _idempotent_results.get(idempotency_key)
+        if previous is not None:
+            return previous
+
+    context["scoring"] = scoring
+    context["transcriber"] = transcriber
+    context["engine"] = engine
+    if not idempotency_key:
+        result = await _analyze_upload(file, upload_id, chunks, context)
+        _record_attempt(learner_id, phrase_id, context, result)
+        return result
+
+    async def run() -> Dict[str, Any]:
+        # A retry that joins this flight must not try to finalize the session a second time.
+        result = await _analyze_upload(file, upload_id, chunks, context)
+        _idempotent_results.set(idempotency_key, result)
+        _record_attempt(learner_id, phrase_id, context, result)
+        return result
+
+    return await _idempotent_flights.do(idempotency_key, run)
+
+
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _replay(result: Dict[str, Any]) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """Events for a result that is already complete (idempotent retry)."""
+    yield "transcription", {"transcription": result.get("transcription", "")}
+    yield "scores", {key: result.get(key) for key in ("transcription", "score", "translation_score", "pronunciation_score")}
+    yield "feedback", {"feedback": result.get("feedback", "")}
+    yield "result", result
+
+
+@server.post("/api/analyze/stream")
+async def analyze_stream(
+    request: Request,
+    file: UploadFile | None = File(None),
+    upload_id: str | None = Form(None),
+    chunks: int | None = Form(None),
+    phrase_id: str | None = Form(None),
+    phrase: str | None = Form(None),
+    hint: str | None = Form(None),
+    arabic_transliteration: str | None = Form(None),
+    scoring: str | None = Form(None),
+    transcriber: str | None = Form(None),
+    engine: str | None = Form(None),
+    idempotency_key: str | None = Form(None),
+    learner_id: str | None = Form(None),
+) -> StreamingResponse:
+    """
+    Same input as /api/analyze, answered as Server-Sent Events: `transcription` as soon
+    as Whisper returns, `feedback_delta` while the feedback is generated, then `scores`,
+    `feedback` and `result` (the full /api/analyze payload). Failures before the first
+    event are ordinary HTTP errors; later ones arrive as an `error` event.
+    """
+    _check_upload(file, upload_id, scoring, transcriber, engine)
+    _check_learner(learner_id)
+    context = _phrase_context(phrase_id, phrase, hint, arabic_transliteration)
+
+    idempotency_key = idempotency_key or request.headers.get("idempotency-key")
+    previous = _idempotent_results.get(idempotency_key) if idempotency_key else None
+    assembled: BinaryIO | None = None
+    if previous is not None:
+        events = _replay(previous)
+    else:
+        # FastAPI closes the upload when this handler returns, and an assembled session
+        # is closed below; the pipeline has finished reading either by the time the first
+        # event (the transcription) is primed.
+        if file is not None:
+            audio = _upload_source(file)
+        else:
+            audio = assembled = _finalize_upload(upload_id, chunks)
+        events = analyze_audio_events(audio, scoring=scoring, transcriber=transcriber, engine=engine, **context)
 
     try:
-        result = await analyze_audio(
-            audio_bytes,
-            phrase=phrase,
-            hint=hint,
-            arabic_transliteration=arabic_transliteration,
-        )
-    except ValueError as exc:
-        # Likely configuration issues such as missing API key.
-        raise HTTPException(status_code=500, detail=str(exc)) from exc
+        first = await events.__anext__()
+    except Exception as exc:  # noqa: BLE001
+        raise _http_error(exc) from exc
+    finally:
+        if assembled is not None:
+            assembled.close()
+
+    async def body() -> AsyncIterator[str]:
+        yield _sse(*first)
+        try:
+            async for event, data in events:
+                if event == "result" and previous is None:
+                    if idempotency_key:
+                        _idempotent_results.set(idempotency_key, data)
+                    _record_attempt(learner_id, phrase_id, context, data)
+                yield _sse(event, data)
+        except Exception as exc:  # noqa: BLE001
+            error = _http_error(exc)
+            yield _sse("error", {"status": error.status_code, "detail": error.detail})
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(body(), media_type="text/event-stream", headers=headers)
+
+
+def _ndjson(data: Any) -> str:
+    return json.dumps(data, ensure_ascii=False) + "\n"
+
+
+def _batch_line(index: int, item: BatchItem, outcome: Dict[str, Any] | Exception) -> Dict[str, Any]:
+    if isinstance(outcome, Exception):
+        error = _http_error(outcome)
+        return {"index": index, "file": item.name, "status": error.status_code, "detail": error.detail}
+    return {"index": index, "file": item.name, "status": 200, "result": outcome}
+
+
+@server.post("/api/analyze/batch")
+async def analyze_batch_endpoint(
+    files: List[UploadFile] = File(None),
+    archive: UploadFile | None = File(None),
+    manifest: str | None = Form(None),
+    phrase_id: str | None = Form(None),
+    phrase: str | None = Form(None),
+    hint: str | None = Form(None),
+    arabic_transliteration: str | None = Form(None),
+    scoring: str | None = Form(None),
+    transcriber: str | None = Form(None),
+    learner_id: str | None = Form(None),
+) -> StreamingResponse:
+    """
+    Analyze a whole set of recordings: several `files` fields, or one zip `archive` of
+    WAV files. The phrase fields and `learner_id` apply to every recording, and
+    `manifest` (JSON, or a manifest.json in the zip) overrides them per file name, e.g.
+    {"dana.wav": {"phrase_id": "p12", "learner_id": "dana"}}. Answers with NDJSON, one line per recording
+    as it finishes ({"index", "file", "status", "result"}, or "detail" in place of
+    "result" when that recording failed), then {"done": true, "ok": n, "failed": m}.
+    Always uses the pipeline engine; see analyze_batch for how calls are shared.
+    """
+    if (not files) == (archive is None):
+        raise HTTPException(status_code=400, detail="Send either files or an archive.")
+    _check_options(scoring, transcriber)
+    overrides = parse_manifest(manifest)
+    if archive is not None:
+        items, bundled = await run_in_thread("batch_unpack", from_archive, archive)
+        overrides = {**bundled, **overrides}
+    else:
+        items = await run_in_thread("batch_copy", from_files, files)
+
+    defaults = {
+        "phrase_id": phrase_id,
+        "phrase": phrase,
+        "hint": hint,
+        "arabic_transliteration": arabic_transliteration,
+        "learner_id": learner_id,
+    }
+    recordings: List[Tuple[int, BatchItem, Dict[str, Any]]] = []
+    rejected: List[Dict[str, Any]] = []
+    try:
+        if not items:
+            raise HTTPException(status_code=400, detail="The archive holds no recordings.")
+        unknown = set(overrides) - {item.name for item in items}
+        if unknown:
+            detail = f"manifest names files not in the batch: {', '.join(sorted(unknown))}."
+            raise HTTPException(status_code=400, detail=detail)
+        for index, item in enumerate(items):
+            item.fields = {**defaults, **overrides.get(item.name, {})}
+            try:
+                _check_learner(item.fields["learner_id"])
+                context = _phrase_context(*(item.fields[key] for key in PHRASE_FIELDS))
+            except HTTPException as exc:
+                rejected.append(_batch_line(index, item, exc))
+                continue
+            upload_bytes.observe(item.audio.seek(0, os.SEEK_END))
+            item.audio.seek(0)
+            recordings.append((index, item, context))
+        events = analyze_batch([(item.audio, context) for _, item, context in recordings], scoring, transcriber)
+        # Configuration errors (e.g. no API key) surface before the first result, as an HTTP error.
+        first = await anext(events, None)
     except Exception as exc:  # noqa: BLE001
-        logging.exception("Gemini analysis failed")
-        raise HTTPException(status_code=500, detail="Failed to analyze audio.") from exc
+        close_items(items)
+        raise _http_error(exc) from exc
 
-    return result
+    async def body() -> AsyncIterator[str]:
+        failed = len(rejected)
+        try:
+            for line in rejected:
+                yield _ndjson(line)
+            outcome = first
+            while outcome is not None:
+                position, result = outcome
+                index, item, context = recordings[position]
+                line = _batch_line(index, item, result)
+                if line["status"] == 200:
+                    _record_attempt(item.fields["learner_id"], item.fields["phrase_id"], context, result)
+                else:
+                    failed += 1
+                yield _ndjson(line)
+                outcome = await anext(events, None)
+        finally:
+            await events.aclose()
+            close_items(items)
+        yield _ndjson({"done": True, "ok": len(items) - failed, "failed": failed})
 
+    return StreamingResponse(body(), media_type="application/x-ndjson", headers={"X-Accel-Buffering": "no"})
 
-def _tts_client() -> OpenAI:
-    api_key = os.environ.get("OPENAI_API_KEY")
-    if not api_key:
-        raise HTTPException(status_code=500, detail="OPENAI_API_KEY is not set.")
-    return OpenAI(api_key=api_key)
+
+@server.post("/api/uploads")
+async def open_upload() -> Dict[str, Any]:
+    """
+    Start a chunked upload, so a recording can be sent while it is still being made.
+    PUT its chunks to /api/uploads/{upload_id}/chunks/{seq} (0, 1, 2...) as they are
+    recorded, then pass `upload_id` to /api/analyze or /api/analyze/stream in place
+    of `file`. A session idle for UPLOAD_SESSION_TTL seconds is dropped.
+    """
+    try:
+        session = upload_sessions.open()
+    except Overloaded as exc:
+        raise _overloaded(exc) from exc
+    return {**session.status(), "max_bytes": UPLOAD_MAX_BYTES}
+
+
+@server.get("/api/uploads/{upload_id}")
+async def upload_status(upload_id: str) -> Dict[str, Any]:
+    """Chunks and bytes received so far; a client resumes after a reconnect from `next_seq`."""
+    try:
+        return upload_sessions.get(upload_id).status()
+    except SessionError as exc:
+        raise _session_error(exc) from exc
+
+
+@server.put("/api/uploads/{upload_id}/chunks/{seq}")
+async def upload_chunk(request: Request, upload_id: str, seq: int = Path(..., ge=0)) -> Dict[str, Any]:
+    """
+    Append chunk `seq` (the raw request body). Chunks must arrive in order; a chunk
+    resent after a lost response is acknowledged without being stored twice, and one
+    that skips ahead gets 409 with the `next_seq` expected.
+    """
+    try:
+        upload_sessions.get(upload_id)
+    except SessionError as exc:
+        raise _session_error(exc) from exc
+    declared = request.headers.get("content-length")
+    if declared is not None and declared.isdigit() and int(declared) > UPLOAD_CHUNK_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=TOO_LARGE)
+    body = bytearray()
+    async for piece in request.stream():
+        body += piece
+        if len(body) > UPLOAD_CHUNK_MAX_BYTES:
+            raise HTTPException(status_code=413, detail=TOO_LARGE)
+    try:
+        # Checked and written in one step with no await in between, so a chunk
+        # retried while its first copy is still arriving is never written twice.
+        return upload_sessions.append(upload_id, seq, bytes(body)).status()
+    except SessionError as exc:
+        raise _session_error(exc) from exc
+
+
+@server.delete("/api/uploads/{upload_id}", status_code=204)
+async def discard_upload(upload_id: str) -> Response:
+    """Drop an upload that will not be analyzed (e.g. the recording was cancelled)."""
+    upload_sessions.discard(upload_id)
+    return Response(status_code=204)
+
+
+async def _synthesize(content: str, audio_format: str) -> bytes:
+    client = get_client()
+
+    async def attempt() -> bytes:
+        with stage("tts"):
+            speech = await client.audio.speech.create(
+                model=TTS_MODEL,
+                voice=TTS_VOICE,
+                input=content,
+                response_format=audio_format,
+            )
+            return speech.read()
+
+    return await tts_policy.call(attempt, Deadline(TTS_DEADLINE))
+
+
+async def _stream_speech(content: str, audio_format: str, stack: AsyncExitStack) -> AsyncIterator[bytes]:
+    """
+    Open the upstream speech stream before the response starts, so connection
+    errors still surface as a 500 instead of a truncated body. The TTS slot and the
+    upstream response are entered on `stack`, which the caller closes when done.
+    """
+    client = get_client()
+    deadline = Deadline(TTS_DEADLINE)
+
+    async def attempt() -> Any:
+        with stage("tts_open"):
+            return await stack.enter_async_context(
+                client.audio.speech.with_streaming_response.create(
+                    model=TTS_MODEL,
+                    voice=TTS_VOICE,
+                    input=content,
+                    response_format=audio_format,
+                )
+            )
+
+    # The slot is held until the stream is fully relayed; only opening it is retried.
+    await stack.enter_async_context(tts_limiter.slot(deadline.expires))
+    upstream = await tts_policy.call(attempt, deadline, hedge=False, slot=False)
+    return upstream.iter_bytes(TTS_STREAM_CHUNK_BYTES)
+
+
+class _ClosingStreamingResponse(StreamingResponse):
+    """
+    A StreamingResponse that runs `close` once it is over, however it ended. A client
+    that leaves before the first chunk is pulled means the body generator never
+    starts, so its own finally never runs; this does.
+    """
+
+    def __init__(self, content: AsyncIterator[bytes], close: Callable[[], Awaitable[None]], **kwargs: Any) -> None:
+        super().__init__(content, **kwargs)
+        self._close = close
+
+    async def __call__(self, scope: Any, receive: Any, send: Any) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self._close()
+
+
+async def _tts_response(content: str, audio_format: str, stream: bool, request: Request) -> Response:
+    media_type = TTS_FORMATS.get(audio_format)
+    if media_type is None:
+        raise HTTPException(status_code=400, detail=f"Unsupported audio format. Use one of: {', '.join(TTS_FORMATS)}.")
+
+    key = tts_key(content, TTS_MODEL, TTS_VOICE, audio_format)
+    headers = {
+        "Content-Disposition": f'attachment; filename="feedback.{audio_format}"',
+        # The URL/body fully determines the audio, so clients may keep it forever.
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "ETag": f'"{key}"',
+    }
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match.strip() == "*" or headers["ETag"] in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+
+    try:
+        if stream:
+            found = await tts_cache.lookup(key)
+            if isinstance(found, Lead):
+                # Identical requests wait for this stream; whatever happens, the lead is
+                # settled and the slot and upstream released when the stack closes (LIFO).
+                stack = AsyncExitStack()
+                stack.callback(found.abandon)
+                try:
+                    chunks = await _stream_speech(content, audio_format, stack)
+                except BaseException:
+                    await stack.aclose()
+                    raise
+                body = tts_cache.tee(found, chunks)
+                stack.push_async_callback(body.aclose)
+                return _ClosingStreamingResponse(body, stack.aclose, media_type=media_type, headers=headers)
+            audio_bytes = found
+        else:
+            audio_bytes = await tts_cache.get_or_create(key, lambda: _synthesize(content, audio_format))
+    except Overloaded as exc:
+        raise _overloaded(exc) from exc
+    except DeadlineExceeded as exc:
+        raise _timed_out(exc) from exc
+    except ValueError as exc:
+        raise HTTPException(status_code=500, detail=str(exc)) from exc
+    except Exception as exc:  # noqa: BLE001
+        logging.exception("TTS generation failed")
+        raise HTTPException(status_code=500, detail="Failed to generate audio.") from exc
+
+    return Response(content=audio_bytes, media_type=media_type, headers=headers)
 
 
 @server.post("/api/tts")
-async def tts(text: Dict[str, str]) -> Response:
+async def tts(text: Dict[str, Any], request: Request) -> Response:
     """
     Convert Hebrew feedback text to speech using OpenAI TTS and return audio bytes.
+    Results are cached by content, so repeated phrases never hit the upstream twice.
+    Pass "stream": true to receive audio chunks as soon as synthesis produces them.
     """
     content = text.get("text") if isinstance(text, dict) else None
     if not content or not isinstance(content, str):
         raise HTTPException(status_code=400, detail="Missing text for TTS.")
+    audio_format = str(text.get("format") or "mp3")
+    return await _tts_response(content, audio_format, bool(text.get("stream")), request)
+
+
+@server.get("/api/tts")
+async def tts_get(
+    request: Request,
+    text: str = Query(""),
+    format: str = Query("mp3"),  # noqa: A002
+    stream: bool = Query(False),
+) -> Response:
+    """Cacheable GET variant of /api/tts, usable directly as an <audio> source."""
+    if not text:
+        raise HTTPException(status_code=400, detail="Missing text for TTS.")
+    return await _tts_response(text, format, stream, request)
+
+
+@server.get("/api/tts/stats")
+async def tts_stats() -> Dict[str, Any]:
+    return tts_cache.stats()
 
+
+@server.get("/metrics", include_in_schema=False)
+async def metrics() -> PlainTextResponse:
+    """Stage latency histograms, upload sizes, token usage, cache and concurrency gauges."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@server.get("/api/limits")
+async def limits_stats() -> Dict[str, Any]:
+    """Queue depth, in-flight calls, rejections and wait times per upstream operation."""
+    return limiter_stats()
+
+
+@server.get("/api/phrases")
+async def list_phrases(
+    request: Request,
+    cursor: str | None = Query(None),
+    limit: int = Query(PHRASES_PAGE_SIZE, ge=1, le=PHRASES_MAX_PAGE_SIZE),
+    level: int | None = Query(None),
+    topic: str | None = Query(None),
+    tag: str | None = Query(None),
+) -> Response:
+    """
+    One page of the phrase catalog in catalog order. Pass `next_cursor` back as
+    `cursor` for the following page; it is null on the last page. `tag` is an
+    Arabic letter class (e.g. "ح") the phrase exercises.
+    """
+    etag = catalog.etag(cursor, limit, level, topic, tag)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
     try:
-        client = _tts_client()
-        speech = client.audio.speech.create(
-            model=os.environ.get("OPENAI_MODEL_TTS", "gpt-4o-mini-tts"),
-            voice=os.environ.get("OPENAI_TTS_VOICE", "alloy"),
-            input=content,
-        )
+        items, next_cursor = catalog.page(cursor, limit, level=level, topic=topic, tag=tag)
+    except KeyError:
+        raise HTTPException(status_code=400, detail="Unknown cursor.") from None
+    body = {"items": [item.to_dict() for item in items], "next_cursor": next_cursor, "version": catalog.version}
+    return JSONResponse(body, headers=headers)
+
+
+@server.get("/api/phrases/{phrase_id}")
+async def get_phrase(phrase_id: str) -> Dict[str, Any]:
+    entry = catalog.get(phrase_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Unknown phrase_id.")
+    return entry.to_dict()
+
+
+@server.get("/api/phrases/{phrase_id}/audio")
+async def phrase_audio(phrase_id: str, request: Request) -> Response:
+    """
+    Reference pronunciation of the phrase's transliteration, synthesized ahead of time
+    at startup (or now, if warming has not reached it). Supports single byte ranges.
+    """
+    entry = catalog.get(phrase_id)
+    if entry is None or not entry.arabic_transliteration:
+        raise HTTPException(status_code=404, detail="Unknown phrase_id.")
+    try:
+        path = await reference_audio.ensure(entry)
+    except Overloaded as exc:
+        raise _overloaded(exc) from exc
+    except DeadlineExceeded as exc:
+        raise _timed_out(exc) from exc
+    except ValueError as exc:
+        raise HTTPException(status_code=500, detail=str(exc)) from exc
     except Exception as exc:  # noqa: BLE001
-        logging.exception("TTS generation failed")
+        logging.exception("Reference audio generation failed")
         raise HTTPException(status_code=500, detail="Failed to generate audio.") from exc
 
-    audio_bytes = speech.read()
-    headers = {"Content-Disposition": 'attachment; filename="feedback.mp3"'}
-    return Response(content=audio_bytes, media_type="audio/mpeg", headers=headers)
+    etag = f'"{path.stem}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Accept-Ranges": "bytes"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    data = await asyncio.to_thread(path.read_bytes)
+    media_type = TTS_FORMATS[reference_audio.audio_format]
+    range_header = request.headers.get("range")
+    if range_header and request.headers.get("if-range", etag) == etag:
+        try:
+            byte_range = parse_range(range_header, len(data))
+        except ValueError:
+            headers["Content-Range"] = f"bytes */{len(data)}"
+            return Response(status_code=416, headers=headers)
+        if byte_range is not None:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+            return Response(data[start : end + 1], status_code=206, media_type=media_type, headers=headers)
+    return Response(data, media_type=media_type, headers=headers)
+
+
+@server.get("/api/phrases/audio/stats")
+async def phrase_audio_stats() -> Dict[str, Any]:
+    """Progress of the reference audio warm-up."""
+    return reference_audio.stats()
+
 
+@server.get("/api/progress")
+async def progress(
+    learner_id: str = Query(...),
+    phrases: int = Query(5, ge=0, le=PHRASES_MAX_PAGE_SIZE),
+) -> Dict[str, Any]:
+    """
+    A learner's totals, each Arabic letter class with how often it was missed (highest
+    error rate first), and their `phrases` lowest-scoring catalog phrases. Read from the
+    aggregates kept up to date as attempts are written, so attempts from the last
+    HISTORY_FLUSH_INTERVAL seconds may not be counted yet.
+    """
+    _check_learner(learner_id)
+    if not history.enabled:
+        raise HTTPException(status_code=404, detail="Learner history is disabled.")
+    try:
+        summary = await history.progress(learner_id, phrases)
+    except ValueError as exc:
+        raise HTTPException(status_code=503, detail=str(exc)) from exc
+    for entry in summary["weak_phrases"]:
+        phrase = catalog.get(entry["phrase_id"])
+        entry["native"] = phrase.native if phrase is not None else None
+    return summary
+
+
+def _static_response(entry: StaticFile, request: Request, cache_control: str) -> Response:
+    coding = entry.negotiate(request.headers.get("accept-encoding", ""))
+    headers = {"ETag": entry.variant_etag(coding), "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if coding != "identity":
+        headers["Content-Encoding"] = coding
+    known = {entry.variant_etag(c) for c in entry.variants} | {"*"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if any(tag.strip().removeprefix("W/") in known for tag in if_none_match.split(",")):
+        dash_static.not_modified += 1
+        return Response(status_code=304, headers=headers)
+    return Response(entry.variants[coding], media_type=entry.media_type, headers=headers)
+
+
+@server.api_route(
+    f"{DASH_ROUTES_PREFIX}_dash-component-suites/{{package}}/{{path:path}}",
+    methods=["GET", "HEAD"],
+    include_in_schema=False,
+)
+async def dash_component_suite(package: str, path: str, request: Request) -> Response:
+    """Dash JS/CSS bundles, served without the WSGI bridge."""
+    entry, fingerprinted = await dash_static.component_suite(package, path)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Not found.")
+    return _static_response(entry, request, IMMUTABLE if fingerprinted else REVALIDATE)
+
+
+@server.api_route(
+    f"{DASH_ROUTES_PREFIX}{DASH_ASSETS_PATH}/{{path:path}}",
+    methods=["GET", "HEAD"],
+    include_in_schema=False,
+)
+async def dash_asset(path: str, request: Request) -> Response:
+    """Files from assets/. Dash links them with `?m=<mtime>`, so a matching URL never changes."""
+    entry = await dash_static.asset(path)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Not found.")
+    current = request.query_params.get("m") == entry.version
+    return _static_response(entry, request, IMMUTABLE if current else REVALIDATE)
+
+
+@server.get("/api/static/stats")
+async def static_stats() -> Dict[str, Any]:
+    return dash_static.stats()
+
+
+# Mount Dash under the root path after API and static routes are registered;
+# only the index and Dash's callback endpoints reach the WSGI bridge.
+server.mount("/", dash_app)
+
+
+def preload() -> None:
+    """
+    Import what each worker would otherwise import lazily, for a server that loads the
+    app once and forks its workers from it (gunicorn.conf.py with GUNICORN_PRELOAD): the
+    workers share those pages and serve from their first second. Opens no clients,
+    files or threads, which must not cross a fork.
+    """
+    import openai  # noqa: F401
 
-# Mount Dash under the root path after API routes are registered.
-server.mount("/", WSGIMiddleware(app.server))
+    dash_app.load()
 
 
 if __name__ == "__main__":
+    # Development server with auto-reload; production runs `gunicorn -c gunicorn.conf.py main:server`.
     import uvicorn
 
     port = int(os.environ.get("PORT", "8000"))
@@ -0,0 +1,298 @@
+from __future__ import annotations
+
+import asyncio
+import bisect
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple, TypeVar
+
+T = TypeVar("T")
+
+Labels = Tuple[Tuple[str, str], ...]
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BYTES_BUCKETS = tuple(float(2**n) for n in range(10, 25, 2))  # 1 KiB .. 16 MiB
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str) -> None:
+        self.name = name
+        self.help = help_text
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = list(self._values.items())
+        lines += [f"{self.name}{_format_labels(labels)} {_format_value(value)}" for labels, value in items]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: Iterable[float] = LATENCY_BUCKETS) -> None:
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        # labels -> (count per bucket with a final +Inf bucket, [sum])
+        self._values: Dict[Labels, Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = _labels(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            counts, total = entry
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            total[0] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(labels, list(counts), total[0]) for labels, (counts, total) in self._values.items()]
+        for labels, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = (("le", _format_value(bound)),)
+                lines.append(f"{self.name}_bucket{_format_labels(labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+class CallbackMetric:
+    """Gauge or counter whose samples are read from live objects at scrape time."""
+
+    def __init__(
+        self, name: str, help_text: str, kind: str, collect: Callable[[], Iterable[Tuple[Dict[str, Any], float]]]
+    ) -> None:
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self._collect = collect
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines += [
+            f"{self.name}{_format_labels(_labels(labels))} {_format_value(value)}" for labels, value in self._collect()
+        ]
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: List[Any] = []
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        metric = Counter(name, help_text)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, buckets: Iterable[float] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge_callback(
+        self, name: str, help_text: str, collect: Callable[[], Iterable[Tuple[Dict[str, Any], float]]]
+    ) -> None:
+        self._metrics.append(CallbackMetric(name, help_text, "gauge", collect))
+
+    def counter_callback(
+        self, name: str, help_text: str, collect: Callable[[], Iterable[Tuple[Dict[str, Any], float]]]
+    ) -> None:
+        self._metrics.append(CallbackMetric(name, help_text, "counter", collect))
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+stage_seconds = registry.histogram("coach_stage_seconds", "Time spent in each request stage.")
+http_seconds = registry.histogram("coach_http_request_seconds", "HTTP request duration until the response body ends.")
+upload_bytes = registry.histogram("coach_upload_bytes", "Size of uploaded recordings.", BYTES_BUCKETS)
+prepared_bytes = registry.histogram("coach_prepared_audio_bytes", "Size of audio sent to transcription.", BYTES_BUCKETS)
+tokens = registry.counter("coach_openai_tokens_total", "OpenAI tokens used, by model and kind.")
+tokens_per_call = registry.histogram("coach_openai_tokens_per_call", "Total tokens per chat call.", TOKEN_BUCKETS)
+
+_in_flight = {"requests": 0}
+registry.gauge_callback(
+    "coach_http_requests_in_flight", "HTTP requests currently being served.", lambda: [({}, _in_flight["requests"])]
+)
+
+# Objects whose own counters are exported at scrape time.
+_caches: Dict[str, Any] = {}
+_limiters: List[Any] = []
+
+
+def watch_cache(name: str, cache: Any) -> None:
+    """Export an LRUCache's hits, misses and size."""
+    _caches[name] = cache
+
+
+def watch_limiter(limiter: Any) -> None:
+    _limiters.append(limiter)
+
+
+registry.counter_callback(
+    "coach_cache_hits_total", "Cache lookups that hit.", lambda: [({"cache": n}, c.hits) for n, c in _caches.items()]
+)
+registry.counter_callback(
+    "coach_cache_misses_total",
+    "Cache lookups that missed.",
+    lambda: [({"cache": n}, c.misses) for n, c in _caches.items()],
+)
+registry.gauge_callback(
+    "coach_cache_entries", "Entries held per cache.", lambda: [({"cache": n}, len(c)) for n, c in _caches.items()]
+)
+registry.gauge_callback(
+    "coach_upstream_in_flight",
+    "Upstream calls holding a limiter slot.",
+    lambda: [({"limiter": lim.name}, lim.in_flight) for lim in _limiters],
+)
+registry.gauge_callback(
+    "coach_upstream_queued",
+    "Callers waiting for a limiter slot.",
+    lambda: [({"limiter": lim.name}, lim.queued) for lim in _limiters],
+)
+registry.gauge_callback(
+    "coach_upstream_concurrency",
+    "Configured limiter concurrency.",
+    lambda: [({"limiter": lim.name}, lim.concurrency) for lim in _limiters],
+)
+registry.counter_callback(
+    "coach_upstream_rejected_total",
+    "Calls refused by admission control.",
+    lambda: [({"limiter": lim.name, "reason": r}, n) for lim in _limiters for r, n in lim.rejected.items()],
+)
+
+# Per-request stage durations for the Server-Timing header; None outside a request.
+_timings: contextvars.ContextVar[List[Tuple[str, float]] | None] = contextvars.ContextVar("timings", default=None)
+
+
+def record(name: str, seconds: float) -> None:
+    """Observe a stage duration and add it to the current request's Server-Timing."""
+    stage_seconds.observe(seconds, stage=name)
+    timings = _timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+
+
+async def run_in_thread(name: str, fn: Callable[..., T], *args: Any) -> T:
+    """
+    asyncio.to_thread that reports time spent waiting for a pool thread
+    (`<name>_queue`) separately from the work itself (`<name>`).
+    """
+    submitted = time.perf_counter()
+    started: List[float] = []
+
+    def call() -> T:
+        started.append(time.perf_counter())
+        record(f"{name}_queue", started[0] - submitted)
+        return fn(*args)
+
+    try:
+        return await asyncio.to_thread(call)
+    finally:
+        if started:
+            record(name, time.perf_counter() - started[0])
+
+
+def record_usage(model: str, usage: Any, **labels: Any) -> None:
+    """Count tokens from an OpenAI `usage` object (absent on some responses), e.g. per prompt version."""
+    if usage is None:
+        return
+    prompt = getattr(usage, "prompt_tokens", 0) or 0
+    completion = getattr(usage, "completion_tokens", 0) or 0
+    tokens.inc(prompt, model=model, kind="prompt", **labels)
+    tokens.inc(completion, model=model, kind="completion", **labels)
+    cached = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None) or 0
+    if cached:
+        tokens.inc(cached, model=model, kind="cached_prompt", **labels)
+    tokens_per_call.observe(prompt + completion, model=model, **labels)
+
+
+def server_timing(timings: List[Tuple[str, float]]) -> str:
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings)
+
+
+class MetricsMiddleware:
+    """
+    Times every HTTP request and adds a Server-Timing header listing the stages
+    recorded before the response started (for streamed responses, the early ones).
+    """
+
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings: List[Tuple[str, float]] = []
+        token = _timings.set(timings)
+        started = time.perf_counter()
+        status = [500]
+
+        async def send_with_timing(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                header = server_timing(timings + [("app", time.perf_counter() - started)])
+                message = {**message, "headers": [*message.get("headers", []), (b"server-timing", header.encode())]}
+            await send(message)
+
+        _in_flight["requests"] += 1
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _in_flight["requests"] -= 1
+            _timings.reset(token)
+            route = getattr(scope.get("route"), "path", None) or "dash"
+            http_seconds.observe(
+                time.perf_counter() - started, route=route, method=scope["method"], status=status[0]
+            )
@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import bisect
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, List, Tuple
+
+from scoring import MARKED_TOKENS, letter_class, normalize, tokenize
+
+PHRASES_PATH = os.environ.get("PHRASES_PATH", os.path.join(os.path.dirname(__file__), "phrases.jsonl"))
+PHRASES_PAGE_SIZE = int(os.environ.get("PHRASES_PAGE_SIZE", "20"))
+PHRASES_MAX_PAGE_SIZE = 100
+
+
+@dataclass(frozen=True)
+class Phrase:
+    id: str
+    native: str
+    arabic_transliteration: str
+    hint: str = ""
+    level: int = 1
+    topic: str = ""
+    # Precomputed at load: the scorer's canonical target and the Levantine letters it exercises.
+    normalized: str = ""
+    tags: Tuple[str, ...] = ()
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> "Phrase":
+        native = record["native"]
+        target = record.get("arabic_transliteration") or ""
+        tokens = tokenize(target)
+        return cls(
+            # Explicit ids survive edits to the text; derived ids are a fallback for quick additions.
+            id=str(record.get("id") or hashlib.sha1(f"{native}\0{target}".encode("utf-8")).hexdigest()[:10]),
+            native=native,
+            arabic_transliteration=target,
+            hint=record.get("hint") or "",
+            level=int(record.get("level", 1)),
+            topic=record.get("topic") or "",
+            normalized=normalize(target),
+            tags=tuple(sorted({letter_class(tok) for tok in tokens if tok in MARKED_TOKENS})),
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "native": self.native,
+            "arabic_transliteration": self.arabic_transliteration,
+            "hint": self.hint,
+            "level": self.level,
+            "topic": self.topic,
+            "tags": list(self.tags),
+        }
+
+
+class PhraseCatalog:
+    """
+    Read-only phrase list loaded once from JSONL (one phrase object per line), in file
+    order, with per-level, per-topic and per-tag position indexes. Pages are addressed
+    by cursor (the id of the last phrase returned), so they stay stable across reloads
+    that only append phrases.
+    """
+
+    def __init__(self, phrases: List[Phrase], version: str) -> None:
+        self.phrases = phrases
+        self.version = version
+        self._by_id: Dict[str, int] = {}
+        self._indexes: Dict[Tuple[str, Any], List[int]] = {}
+        for position, phrase in enumerate(phrases):
+            if phrase.id in self._by_id:
+                raise ValueError(f"Duplicate phrase id: {phrase.id}")
+            self._by_id[phrase.id] = position
+            keys = [("level", phrase.level), ("topic", phrase.topic)] + [("tag", tag) for tag in phrase.tags]
+            for key in keys:
+                self._indexes.setdefault(key, []).append(position)
+
+    @classmethod
+    def load(cls, path: str) -> "PhraseCatalog":
+        with open(path, "rb") as handle:
+            raw = handle.read()
+        phrases = [Phrase.from_record(json.loads(line)) for line in raw.decode("utf-8").splitlines() if line.strip()]
+        digest = hashlib.sha256(raw)
+        # Tags come from the scorer's letter map, so a change there must change the ETags too.
+        digest.update(json.dumps([phrase.tags for phrase in phrases], ensure_ascii=False).encode("utf-8"))
+        return cls(phrases, digest.hexdigest()[:16])
+
+    @classmethod
+    def from_env(cls) -> "PhraseCatalog":
+        return cls.load(PHRASES_PATH)
+
+    def __len__(self) -> int:
+        return len(self.phrases)
+
+    def get(self, phrase_id: str) -> Phrase | None:
+        position = self._by_id.get(phrase_id)
+        return None if position is None else self.phrases[position]
+
+    def page(
+        self,
+        cursor: str | None = None,
+        limit: int = PHRASES_PAGE_SIZE,
+        level: int | None = None,
+        topic: str | None = None,
+        tag: str | None = None,
+    ) -> Tuple[List[Phrase], str | None]:
+        """
+        Up to `limit` phrases after `cursor` matching every given filter, and the cursor
+        for the next page (None on the last page). Raises KeyError for an unknown cursor.
+        """
+        start = 0 if cursor is None else self._by_id[cursor] + 1
+        filters = [key for key in (("level", level), ("topic", topic), ("tag", tag)) if key[1] is not None]
+        if filters:
+            # Walk the smallest matching index and check the other filters per phrase.
+            candidates = min((self._indexes.get(key, []) for key in filters), key=len)
+            candidates = candidates[bisect.bisect_left(candidates, start) :]
+        else:
+            candidates = range(start, len(self.phrases))
+
+        items: List[Phrase] = []
+        for position in candidates:
+            phrase = self.phrases[position]
+            if level is not None and phrase.level != level:
+                continue
+            if topic is not None and phrase.topic != topic:
+                continue
+            if tag is not None and tag not in phrase.tags:
+                continue
+            if len(items) == limit:
+                return items, items[-1].id
+            items.append(phrase)
+        return items, None
+
+    def etag(self, *params: Any) -> str:
+        """Validator for a page: same catalog version and same query give the same body."""
+        digest = hashlib.sha256(json.dumps(params, ensure_ascii=False).encode("utf-8")).hexdigest()[:12]
+        return f'"{self.version}-{digest}"'
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "phrases": len(self.phrases),
+            "version": self.version,
+            "levels": sorted({key[1] for key in self._indexes if key[0] == "level"}),
+            "topics": sorted({key[1] for key in self._indexes if key[0] == "topic"}),
+            "tags": sorted({key[1] for key in self._indexes if key[0] == "tag"}),
+        }
+
+
+catalog = PhraseCatalog.from_env()
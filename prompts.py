@@ -0,0 +1,237 @@
+from __future__ import annotations
+
+import base64
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, List, Tuple
+
+from scoring import letter_map_hint
+
+# "v1": the original long prompts with free-form JSON; "v2": compact prompts with a strict schema.
+PROMPT_VERSION = os.environ.get("PROMPT_VERSION", "v2")
+# Hard cap on the evaluation answer (v2); a transliteration plus a few lines of feedback fit well within it.
+EVAL_MAX_TOKENS = int(os.environ.get("EVAL_MAX_TOKENS", "400"))
+
+SYSTEM_PROMPT_ENG = (
+    "You are a strict Levantine Arabic pronunciation and translation coach. "
+    "Use the transcript to judge translation accuracy and provide concise, "
+    "actionable pronunciation feedback (focus on Levantine phonemes like Qaf glottal stop, Haa, and 'Ayn). "
+    "Return STRICT JSON with keys transcription, score (0-100), and feedback. "
+    "Score reflects overall pronunciation quality and translation accuracy."
+)
+
+_PROMPT_INTRO = (
+    "אתה מורה לערבית לבנטינית לדוברי עברית. בצע שני שלבים:\n"
+    "1) המר את דיבור הלומד לתעתיק עברי בלבד (אין להשתמש באותיות ערביות). "
+    "   הקפד לבחור אותיות עבריות המייצגות היטב את ההגייה הלבנטינית (קוף חיכית/גלוטלית, אותיות מודגשות, ח'/ח, ר מגולגלת/גרונית, ע׳ין/עין וכו').\n"
+)
+_PROMPT_LETTER_MAP = (
+    "שמור על תעתיק עברי בלבד; אל תשתמש באותיות ערביות. השתמש במפה הבאה כרמז תעתיק: "
+    + letter_map_hint()
+)
+
+SYSTEM_PROMPT = (
+    _PROMPT_INTRO
+    + "2) השווה רק בין התעתיק העברי של הלומד לבין תעתיק היעד (arabic_transliteration). "
+    "   תן שני ציונים (0-100):\n"
+    "   - translation_score: מבוסס על קרבת מחרוזות (לדוגמה, מרחק עריכה/דיוק לשוני) בין התעתיק של הלומד לתעתיק היעד.\n"
+    "   - pronunciation_score: מבוסס על בחירת האותיות העבריות שמייצגות הגייה נכונה (האם בחרו ק/כ/ק׳, ח/ח׳, ע/א, ר מגולגלת, אות מודגשת וכד').\n"
+    "score יכול להיות ממוצע בין שניהם. "
+    + _PROMPT_LETTER_MAP
+    + "החזר JSON קפדני עם המפתחות transcription, score (0-100), feedback (באותיות עבריות). "
+    "אם ניתנת arabic_transliteration השתמש בה כמשפט היעד המדויק להשוואת תרגום/הגייה. "
+    "החזר גם translation_score (0-100) להערכת דיוק התרגום, ו-pronunciation_score (0-100) להערכת הגייה. "
+    "score יכול להיות הממוצע בין שניהם. "
+    "הציון משקף איכות הגייה ודיוק תרגום; המשוב ישים: אילו אותיות/הברות היו שגויות ואיזו אות עברית להשתמש כדי לתקן."
+)
+
+# Used when scores are computed locally (see scoring.py): the model only transliterates and gives feedback.
+FEEDBACK_PROMPT = (
+    _PROMPT_INTRO
+    + "2) השווה רק בין התעתיק העברי של הלומד לבין תעתיק היעד (arabic_transliteration) וכתוב משוב. "
+    "הציונים מחושבים בנפרד; אל תחזיר ציונים.\n"
+    + _PROMPT_LETTER_MAP
+    + "החזר JSON קפדני עם המפתחות transcription ו-feedback (באותיות עבריות). "
+    "המשוב ישים: אילו אותיות/הברות היו שגויות ואיזו אות עברית להשתמש כדי לתקן."
+)
+
+# v2: every instruction once, and the schema carries the output format instead of prose.
+_COMPACT_INTRO = (
+    "אתה מורה לערבית לבנטינית לדוברי עברית.\n"
+    "t: דיבור הלומד בתעתיק עברי בלבד, בלי אותיות ערביות, באותיות שמשקפות את ההגייה הלבנטינית. "
+    "מפת תעתיק: " + letter_map_hint() + "\n"
+)
+_COMPACT_FEEDBACK = (
+    "f: משוב קצר וישים בעברית מול תעתיק היעד (arabic_transliteration): "
+    "אילו אותיות/הברות שגויות ובאיזו אות עברית לתקן.\n"
+)
+COMPACT_SCORE_PROMPT = (
+    _COMPACT_INTRO
+    + _COMPACT_FEEDBACK
+    + "ts: 0-100, קרבת התעתיק של הלומד לתעתיק היעד.\n"
+    "ps: 0-100, האם נבחרו האותיות שמייצגות הגייה נכונה (ק/כ/ק׳, ח/ח׳, ע/א, אותיות מודגשות).\n"
+)
+COMPACT_FEEDBACK_PROMPT = _COMPACT_INTRO + _COMPACT_FEEDBACK + "הציונים מחושבים בנפרד.\n"
+
+
+def _schema(properties: Dict[str, str]) -> Dict[str, Any]:
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "evaluation",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {key: {"type": kind} for key, kind in properties.items()},
+                "required": list(properties),
+                "additionalProperties": False,
+            },
+        },
+    }
+
+
+@dataclass(frozen=True)
+class EvalPrompt:
+    """
+    One version of the evaluation request. `system` is the static prefix and always
+    comes first, so the provider can cache it across calls; only the user message varies.
+    `keys` maps the result fields to the keys this version asks the model for.
+    """
+
+    version: str
+    system: str
+    response_format: Dict[str, Any]
+    keys: Dict[str, str]
+    max_tokens: int | None = None
+    # Appended to the user message (v1 restates the expected keys there).
+    closing: str = ""
+
+    @property
+    def fingerprint(self) -> str:
+        """Changes whenever anything sent besides the per-request context changes."""
+        spec = json.dumps([self.version, self.system, self.response_format, self.max_tokens, self.closing])
+        return hashlib.sha256(spec.encode("utf-8")).hexdigest()
+
+    def messages(self, context: List[Tuple[str, str]], transcription: str) -> List[Dict[str, Any]]:
+        lines = [f"{label}: {value}" for label, value in context] or ["No target phrase provided."]
+        lines.append(f"Learner transcription: {transcription}")
+        if self.closing:
+            lines.append(self.closing)
+        return [{"role": "system", "content": self.system}, {"role": "user", "content": "\n".join(lines)}]
+
+    def audio_messages(self, context: List[Tuple[str, str]], wav: bytes) -> List[Dict[str, Any]]:
+        """
+        The same request with the recording itself in place of a transcript, for an
+        audio-capable model. Those take no response_format, so the keys are spelled out.
+        """
+        lines = [f"{label}: {value}" for label, value in context] or ["No target phrase provided."]
+        lines.append("Learner recording: attached.")
+        lines.append(self.closing or f"Return only a JSON object with the keys {', '.join(self.keys.values())}.")
+        audio = {"data": base64.b64encode(wav).decode("ascii"), "format": "wav"}
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": [{"type": "text", "text": "\n".join(lines)}, {"type": "input_audio", "input_audio": audio}]},
+        ]
+
+    def packed_format(self) -> Dict[str, Any]:
+        """
+        The response format for several evaluations in one answer: {"items": [...]}, each
+        entry this version's object plus "i", the item's number. json_object stays as is.
+        """
+        if self.response_format["type"] != "json_schema":
+            return self.response_format
+        schema = self.response_format["json_schema"]["schema"]
+        entry = {
+            **schema,
+            "properties": {"i": {"type": "integer"}, **schema["properties"]},
+            "required": ["i", *schema["required"]],
+        }
+        return {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "evaluations",
+                "strict": True,
+                "schema": {
+                    "type": "object",
+                    "properties": {"items": {"type": "array", "items": entry}},
+                    "required": ["items"],
+                    "additionalProperties": False,
+                },
+            },
+        }
+
+    def packed_messages(self, items: List[Tuple[List[Tuple[str, str]], str]]) -> List[Dict[str, Any]]:
+        """
+        One user message holding several (context, transcription) items, numbered from 0.
+        The system message is the single-item one, so the cached prefix is shared.
+        """
+        blocks = []
+        for index, (context, transcription) in enumerate(items):
+            lines = [f"Item {index}:"]
+            lines += [f"{label}: {value}" for label, value in context] or ["No target phrase provided."]
+            lines.append(f"Learner transcription: {transcription}")
+            blocks.append("\n".join(lines))
+        keys = ", ".join(self.keys.values())
+        blocks.append(
+            f'Evaluate each item on its own. Return a JSON object {{"items": [...]}} with one entry per item, '
+            f"holding its number as i and the keys {keys}."
+        )
+        return [{"role": "system", "content": self.system}, {"role": "user", "content": "\n\n".join(blocks)}]
+
+    def fields(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """The model's answer under the result field names, e.g. {"t": ...} -> {"transcription": ...}."""
+        names = {key: field for field, key in self.keys.items()}
+        return {names.get(key, key): value for key, value in data.items()}
+
+
+_V1_KEYS = {
+    name: name for name in ("transcription", "feedback", "score", "translation_score", "pronunciation_score")
+}
+
+# version -> (prompt when scores are computed locally, prompt when the model scores)
+PROMPTS: Dict[str, Tuple[EvalPrompt, EvalPrompt]] = {
+    "v1": (
+        EvalPrompt(
+            "v1",
+            FEEDBACK_PROMPT,
+            {"type": "json_object"},
+            _V1_KEYS,
+            closing="Return JSON with transcription, feedback.",
+        ),
+        EvalPrompt(
+            "v1",
+            SYSTEM_PROMPT,
+            {"type": "json_object"},
+            _V1_KEYS,
+            closing="Return JSON with transcription, score, feedback.",
+        ),
+    ),
+    "v2": (
+        EvalPrompt(
+            "v2",
+            COMPACT_FEEDBACK_PROMPT,
+            _schema({"t": "string", "f": "string"}),
+            {"transcription": "t", "feedback": "f"},
+            EVAL_MAX_TOKENS,
+        ),
+        # No overall score key: it is the mean of the two, computed by the caller.
+        EvalPrompt(
+            "v2",
+            COMPACT_SCORE_PROMPT,
+            _schema({"t": "string", "f": "string", "ts": "integer", "ps": "integer"}),
+            {"transcription": "t", "feedback": "f", "translation_score": "ts", "pronunciation_score": "ps"},
+            EVAL_MAX_TOKENS,
+        ),
+    ),
+}
+
+if PROMPT_VERSION not in PROMPTS:
+    raise ValueError(f"Unknown PROMPT_VERSION: {PROMPT_VERSION}.")
+
+
+def eval_prompt(local: bool, version: str = PROMPT_VERSION) -> EvalPrompt:
+    """The evaluation prompt for local scoring (feedback only) or model scoring."""
+    feedback_only, scored = PROMPTS[version]
+    return feedback_only if local else scored
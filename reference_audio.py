@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+import asyncio
+import fcntl
+import logging
+import os
+import re
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterable, Tuple
+
+from cache import SingleFlight
+from limits import Overloaded
+from phrases import Phrase
+from tts_cache import tts_key
+
+REFERENCE_AUDIO_DIR = os.environ.get("REFERENCE_AUDIO_DIR", ".cache/reference")
+REFERENCE_AUDIO_FORMAT = os.environ.get("REFERENCE_AUDIO_FORMAT", "mp3")
+# Kept well below the TTS limiter so warming never crowds out learners' requests.
+REFERENCE_AUDIO_CONCURRENCY = int(os.environ.get("REFERENCE_AUDIO_CONCURRENCY", "2"))
+REFERENCE_AUDIO_WARM = os.environ.get("REFERENCE_AUDIO_WARM", "1") != "0"
+REFERENCE_AUDIO_ATTEMPTS = 3
+
+
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def parse_range(header: str, size: int) -> Tuple[int, int] | None:
+    """
+    First and last byte (inclusive) of a single `bytes=` range, or None to send the
+    whole file (malformed or multi-range headers). Raises ValueError when the range
+    cannot be satisfied.
+    """
+    match = _RANGE.match(header.strip().lower().replace(" ", ""))
+    if match is None or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the final `last` bytes.
+        if int(last) == 0 or size == 0:
+            raise ValueError("range not satisfiable")
+        return max(0, size - int(last)), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError("range not satisfiable")
+    return start, end
+
+
+class ReferenceAudio:
+    """
+    Synthesized reference pronunciation for every catalog phrase, stored on disk under
+    a content address of the transliteration and voice settings. Warming skips files
+    that already exist, so a redeploy only synthesizes new or edited phrases.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        audio_format: str,
+        voice: Tuple[str, ...],
+        synthesize: Callable[[str, str], Awaitable[bytes]],
+        concurrency: int,
+    ) -> None:
+        self.directory = Path(directory)
+        self.audio_format = audio_format
+        self.voice = voice
+        self.concurrency = max(1, concurrency)
+        self._synthesize = synthesize
+        self._flights = SingleFlight()
+        self.progress: Dict[str, Any] = {"total": 0, "existing": 0, "synthesized": 0, "failed": 0, "pruned": 0}
+        self.running = False
+
+    @classmethod
+    def from_env(
+        cls, voice: Tuple[str, ...], synthesize: Callable[[str, str], Awaitable[bytes]]
+    ) -> "ReferenceAudio":
+        return cls(REFERENCE_AUDIO_DIR, REFERENCE_AUDIO_FORMAT, voice, synthesize, REFERENCE_AUDIO_CONCURRENCY)
+
+    def path(self, phrase: Phrase) -> Path:
+        key = tts_key(phrase.arabic_transliteration, *self.voice, self.audio_format)
+        return self.directory / f"{key}.{self.audio_format}"
+
+    async def ensure(self, phrase: Phrase) -> Path:
+        """Path of the phrase's audio, synthesizing it first if needed."""
+        path = self.path(phrase)
+        if path.exists():
+            return path
+        await self._flights.do(path.name, lambda: self._produce(phrase, path))
+        return path
+
+    async def _produce(self, phrase: Phrase, path: Path) -> None:
+        for attempt in range(REFERENCE_AUDIO_ATTEMPTS):
+            try:
+                data = await self._synthesize(phrase.arabic_transliteration, self.audio_format)
+                break
+            except Overloaded as exc:
+                if attempt == REFERENCE_AUDIO_ATTEMPTS - 1:
+                    raise
+                await asyncio.sleep(exc.retry_after)
+        await asyncio.to_thread(self._write, path, data)
+
+    def _write(self, path: Path, data: bytes) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+    async def warm(self, phrases: Iterable[Phrase]) -> Dict[str, Any]:
+        """
+        Synthesize whatever is missing with a few workers, then drop files no phrase uses.
+        With several server processes only the one holding the directory lock warms.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        lock = open(self.directory / ".warm.lock", "w")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return self.progress
+        try:
+            return await self._warm(phrases)
+        finally:
+            lock.close()
+
+    async def _warm(self, phrases: Iterable[Phrase]) -> Dict[str, Any]:
+        phrases = [phrase for phrase in phrases if phrase.arabic_transliteration]
+        wanted = {self.path(phrase).name for phrase in phrases}
+        self.progress = {"total": len(phrases), "existing": 0, "synthesized": 0, "failed": 0, "pruned": 0}
+        self.running = True
+        started = time.monotonic()
+        queue: asyncio.Queue[Phrase] = asyncio.Queue()
+        for phrase in phrases:
+            queue.put_nowait(phrase)
+
+        async def worker() -> None:
+            while not queue.empty():
+                phrase = queue.get_nowait()
+                if self.path(phrase).exists():
+                    self.progress["existing"] += 1
+                    continue
+                try:
+                    await self.ensure(phrase)
+                    self.progress["synthesized"] += 1
+                except ValueError:
+                    # Not configured (no API key): nothing else will succeed either.
+                    logging.warning("Reference audio warm-up skipped: TTS is not configured")
+                    while not queue.empty():
+                        queue.get_nowait()
+                    self.progress["failed"] += 1
+                except Exception:  # noqa: BLE001
+                    logging.exception("Reference audio failed for phrase %s", phrase.id)
+                    self.progress["failed"] += 1
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+            self.progress["pruned"] = await asyncio.to_thread(self._prune, wanted)
+        finally:
+            self.running = False
+            self.progress["seconds"] = round(time.monotonic() - started, 2)
+        return self.progress
+
+    def _prune(self, wanted: set[str]) -> int:
+        if not self.directory.is_dir():
+            return 0
+        pruned = 0
+        for path in self.directory.glob(f"*.{self.audio_format}"):
+            if path.name not in wanted:
+                path.unlink(missing_ok=True)
+                pruned += 1
+        return pruned
+
+    def stats(self) -> Dict[str, Any]:
+        return {"running": self.running, "format": self.audio_format, **self.progress}
@@ -0,0 +1,330 @@
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+# Arabic letter(s) -> acceptable Hebrew transliterations (normalized, preferred first) -> hint for the LLM.
+# This is the single source of the map: the evaluation prompt is rendered from it and the
+# local scorer derives its substitution costs from the same entries.
+LETTER_MAP: Tuple[Tuple[str, Tuple[str, ...], str], ...] = (
+    ("ا/أ/إ/آ", ("א", "ע"), "'א' או 'ע' רפויה"),
+    ("ب", ("ב",), "'בּ' סגורה"),
+    ("ت", ("ת",), "'ת' קלה"),
+    ("ث", ("ת׳", "ס"), "'ת׳' (לעיתים נשמעת 'ס')"),
+    ("ج", ("ג׳", "ג"), "'ג׳' (כמו ג'מייל), אפשר 'ג' קלה בדיאלקט"),
+    ("ح", ("ח",), "'ח' עמוקה גרונית"),
+    ("خ", ("ח׳", "כ"), "'ח׳' / 'כּ' חיכית, עם חיכוך עמוק"),
+    ("د", ("ד",), "'ד'"),
+    ("ذ", ("ד׳", "ז׳"), "'ד׳/ז׳' (th רפה)"),
+    ("ر", ("ר",), "'ר' מגולגלת או גרונית"),
+    ("ز", ("ז",), "'ז'"),
+    ("س", ("ס",), "'ס'"),
+    ("ش", ("ש",), "'שׁ'"),
+    ("ص", ("צ",), "'צ' מודגשת (חיכוך מודגש)"),
+    ("ض", ("ד׳",), "'ד׳' עמוקה/מצלצלת"),
+    ("ط", ("ט",), "'ט' מודגשת"),
+    ("ظ", ("ט׳", "ז׳"), "'ט׳/ז׳' מודגשת"),
+    ("ع", ("ע",), "'ע' עמוקה, לוחצת"),
+    ("غ", ("ע׳", "ר׳"), "'ע׳/ר׳' חיכית/וילונית"),
+    ("ف", ("פ",), "'פ' שפתית"),
+    ("ق", ("ק",), "'ק' אחורית/גלוטלית"),
+    ("ك", ("כ", "ק"), "'כ' קדמית (לעיתים 'ק' רפה)"),
+    ("ل", ("ל",), "'ל'"),
+    ("م", ("מ",), "'מ'"),
+    ("ن", ("נ",), "'נ'"),
+    ("ه", ("ה",), "'ה'"),
+    ("و", ("ו",), "'ו' (חצי תנועה u/w)"),
+    ("ي", ("י",), "'י' (חצי תנועה i/y)"),
+)
+
+# Letters Hebrew speakers typically flatten; these drive the pronunciation score.
+_MARKED_ARABIC = {"ث", "ج", "ح", "خ", "ذ", "ص", "ض", "ط", "ظ", "ع", "غ", "ق"}
+
+# The letter a spelling stands for when the map lists it under several (or as a plain
+# fallback): ע is ع rather than a voiced alef, ס is س rather than a flattened ث, and so on.
+_CANONICAL = {
+    "ע": "ع",
+    "ס": "س",
+    "כ": "ك",
+    "ק": "ق",
+    "ג": "ج",
+    "ד׳": "ض",
+    "ז׳": "ذ",
+}
+
+# Pairs that are not interchangeable spellings but sound close (glottal qaf, plain vs. emphatic...).
+_NEAR_PAIRS = (
+    ("ח", "ה"),
+    ("ח", "כ"),
+    ("ע", "א"),
+    ("ק", "א"),
+    ("ט", "ת"),
+    ("צ", "ס"),
+    ("ש", "ס"),
+    ("ב", "פ"),
+    ("ז", "ס"),
+)
+
+# Letters that double as vowel markers, so spellings add or drop them freely.
+_VOWEL_LETTERS = {"א", "ה", "ו", "י"}
+
+VARIANT_COST = 0.25
+NEAR_COST = 0.5
+VOWEL_INDEL_COST = 0.5
+
+_GERESH = "׳"
+_GERESH_BASES = set("גזחצתדטער")
+_HEBREW_LETTER = re.compile(r"[\u05D0-\u05EA]")
+_APOSTROPHES = str.maketrans({"'": _GERESH, "`": _GERESH, "’": _GERESH, "‘": _GERESH, "´": _GERESH})
+_FINALS = str.maketrans("ךםןףץ", "כמנפצ")
+# Cantillation, niqqud, dagesh/mappiq and shin/sin dots.
+_MARKS = re.compile(r"[\u0591-\u05BD\u05BF-\u05C2\u05C4-\u05C7]")
+# Parenthesised letters mark assimilated sounds, e.g. "אֵ(ל)סַّלַאם".
+_PARENS = re.compile(r"\([^)]*\)")
+_NON_HEBREW = re.compile(r"[^\u05D0-\u05EA\u05F3\s]+")
+
+_ARABIC_DIACRITICS = re.compile(r"[\u0610-\u061A\u0640\u064B-\u065F\u0670\u06D6-\u06ED]")
+_ARABIC_EXTRA = {"ة": "ה", "ى": "י", "ء": "א", "ئ": "א", "ؤ": "א"}
+
+
+def letter_map_hint() -> str:
+    """Render the map the way the evaluation prompt presents it."""
+    return "; ".join(f"{arabic}→{hint}" for arabic, _, hint in LETTER_MAP) + ". "
+
+
+def _build_tables() -> Tuple[Dict[str, int], List[List[float]], List[float], Dict[str, str], frozenset]:
+    tokens = sorted({chr(c) for c in range(0x05D0, 0x05EB)} - set("ךםןףץ"))
+    tokens += sorted(f"{base}{_GERESH}" for base in _GERESH_BASES)
+    index = {tok: i for i, tok in enumerate(tokens)}
+
+    classes: Dict[str, set] = {tok: set() for tok in tokens}
+    preferred = set()
+    for arabic, variants, _ in LETTER_MAP:
+        preferred.add(variants[0])
+        for variant in variants:
+            classes[variant].add(arabic)
+    primary: Dict[str, str] = {}
+    for tok, letters in classes.items():
+        if tok in _CANONICAL:
+            primary[tok] = _CANONICAL[tok]
+        elif len(letters) == 1:
+            primary[tok] = next(iter(letters))
+        elif letters:
+            raise ValueError(f"LETTER_MAP lists {tok} under {sorted(letters)}; add it to _CANONICAL.")
+    # A spelling is Levantine-specific when it stands for a marked letter and is that
+    # letter's distinctive form (the preferred spelling, or one with a geresh); plain
+    # fallbacks such as ג for ج do not test the sound.
+    marked = {
+        tok
+        for tok, arabic in primary.items()
+        if arabic in _MARKED_ARABIC and (tok in preferred or tok.endswith(_GERESH))
+    }
+    near = {frozenset(pair) for pair in _NEAR_PAIRS}
+
+    sub = [[1.0] * len(tokens) for _ in tokens]
+    for a in tokens:
+        for b in tokens:
+            if a == b:
+                cost = 0.0
+            elif classes[a] & classes[b]:
+                cost = VARIANT_COST
+            elif a[0] == b[0] or frozenset((a, b)) in near:
+                cost = NEAR_COST
+            else:
+                cost = 1.0
+            sub[index[a]][index[b]] = cost
+    indel = [VOWEL_INDEL_COST if tok in _VOWEL_LETTERS else 1.0 for tok in tokens]
+    return index, sub, indel, primary, frozenset(marked)
+
+
+_INDEX, _SUB, _INDEL, _PRIMARY, MARKED_TOKENS = _build_tables()
+
+_AR_TO_HE: Dict[str, str] = dict(_ARABIC_EXTRA)
+for _arabic, _variants, _ in LETTER_MAP:
+    for _letter in _arabic.split("/"):
+        _AR_TO_HE[_letter] = _variants[0]
+
+
+def letter_class(token: str) -> str:
+    """Arabic letter a Hebrew transliteration token stands for (the token itself if unmapped)."""
+    return _PRIMARY.get(token, token)
+
+
+@lru_cache(maxsize=8192)
+def normalize(text: str) -> str:
+    """
+    Canonical Hebrew transliteration: no niqqud/dagesh, no final forms, one geresh
+    character, assimilated letters dropped and whitespace collapsed.
+    """
+    text = _PARENS.sub("", text or "")
+    text = _MARKS.sub("", text.translate(_APOSTROPHES).translate(_FINALS))
+    text = _NON_HEBREW.sub("", text)
+    return " ".join(text.split())
+
+
+@lru_cache(maxsize=8192)
+def tokenize(text: str) -> Tuple[str, ...]:
+    """Split normalized text into letter tokens, attaching a geresh to the letter it modifies."""
+    tokens: List[str] = []
+    for ch in normalize(text):
+        if ch == _GERESH:
+            if tokens and len(tokens[-1]) == 1 and tokens[-1] in _GERESH_BASES:
+                tokens[-1] += _GERESH
+        elif _HEBREW_LETTER.match(ch):
+            tokens.append(ch)
+    return tuple(tokens)
+
+
+_PUNCTUATION = re.compile(r"[^\w\s]+")
+
+
+def normalize_transcript(text: str) -> str:
+    """Loose canonical form of a raw transcript (any script) for use as a cache key."""
+    text = _MARKS.sub("", _ARABIC_DIACRITICS.sub("", text or ""))
+    text = _PUNCTUATION.sub(" ", text.translate(_FINALS))
+    return " ".join(text.casefold().split())
+
+
+def transliterate_arabic(text: str) -> str:
+    """Letter-by-letter Arabic -> Hebrew transliteration using the preferred map entry."""
+    text = _ARABIC_DIACRITICS.sub("", text)
+    return "".join(_AR_TO_HE.get(ch, ch) for ch in text)
+
+
+@dataclass(frozen=True)
+class TransliterationScore:
+    translation_score: int
+    pronunciation_score: int
+    score: int
+    # Aligned (target token, learner token) pairs; None marks an insertion/deletion.
+    alignment: Tuple[Tuple[str | None, str | None], ...]
+
+    @property
+    def mistakes(self) -> List[Tuple[str, str | None]]:
+        """Target letters missed or heard as something other than an accepted spelling of them."""
+        return [(exp, got) for exp, got in self.alignment if exp is not None and _is_error(exp, got)]
+
+
+def _is_error(expected: str, heard: str | None) -> bool:
+    return heard is None or _SUB[_INDEX[expected]][_INDEX[heard]] > VARIANT_COST
+
+
+def _align(target: Tuple[str, ...], learner: Tuple[str, ...]) -> Tuple[float, List[Tuple[str | None, str | None]]]:
+    """Weighted Levenshtein alignment with a full backtrace."""
+    t_ids = [_INDEX[tok] for tok in target]
+    l_ids = [_INDEX[tok] for tok in learner]
+    sub, indel = _SUB, _INDEL
+    n, m = len(t_ids), len(l_ids)
+
+    rows = [[0.0] * (m + 1) for _ in range(n + 1)]
+    first = rows[0]
+    for j in range(1, m + 1):
+        first[j] = first[j - 1] + indel[l_ids[j - 1]]
+    for i in range(1, n + 1):
+        ti = t_ids[i - 1]
+        sub_row = sub[ti]
+        del_cost = indel[ti]
+        prev = rows[i - 1]
+        cur = rows[i]
+        cur[0] = prev[0] + del_cost
+        left = cur[0]
+        for j in range(1, m + 1):
+            lj = l_ids[j - 1]
+            best = prev[j - 1] + sub_row[lj]
+            cand = prev[j] + del_cost
+            if cand < best:
+                best = cand
+            cand = left + indel[lj]
+            if cand < best:
+                best = cand
+            cur[j] = left = best
+
+    pairs: List[Tuple[str | None, str | None]] = []
+    i, j = n, m
+    while i > 0 or j > 0:
+        here = rows[i][j]
+        if i > 0 and j > 0 and here == rows[i - 1][j - 1] + sub[t_ids[i - 1]][l_ids[j - 1]]:
+            pairs.append((target[i - 1], learner[j - 1]))
+            i, j = i - 1, j - 1
+        elif i > 0 and here == rows[i - 1][j] + indel[t_ids[i - 1]]:
+            pairs.append((target[i - 1], None))
+            i -= 1
+        else:
+            pairs.append((None, learner[j - 1]))
+            j -= 1
+    pairs.reverse()
+    return rows[n][m], pairs
+
+
+@lru_cache(maxsize=4096)
+def score_transliteration(learner: str, target: str) -> TransliterationScore:
+    """
+    Deterministic replacement for the LLM-computed scores.
+    translation_score: 100 minus the normalized, phonetically weighted edit distance.
+    pronunciation_score: how well the Levantine-specific letters of the target were reproduced;
+    an exact letter earns full credit, an accepted alternative spelling half.
+    """
+    target_tokens = tokenize(target)
+    learner_tokens = tokenize(learner)
+    distance, pairs = _align(target_tokens, learner_tokens)
+
+    # Normalized by what deleting the whole target costs, so an empty or unrelated
+    # transcription scores 0 even though vowel letters are cheap to drop.
+    target_cost = sum(_INDEL[_INDEX[tok]] for tok in target_tokens)
+    if not target_tokens:
+        translation = 0 if learner_tokens else 100
+    elif not learner_tokens:
+        translation = 0
+    else:
+        translation = round(100 * max(0.0, 1 - distance / target_cost))
+
+    credit = 0.0
+    marked = 0
+    for expected, heard in pairs:
+        if expected is None or expected not in MARKED_TOKENS:
+            continue
+        marked += 1
+        if heard == expected:
+            credit += 1
+        elif heard is not None and _SUB[_INDEX[expected]][_INDEX[heard]] == VARIANT_COST:
+            credit += 0.5
+    pronunciation = translation if marked == 0 else round(100 * credit / marked)
+
+    return TransliterationScore(
+        translation_score=translation,
+        pronunciation_score=pronunciation,
+        score=round((translation + pronunciation) / 2),
+        alignment=tuple(pairs),
+    )
+
+
+def letter_errors(result: TransliterationScore) -> Dict[str, Tuple[int, int]]:
+    """
+    (occurrences, errors) per letter class of the target, keyed by the map's Arabic
+    letter (see letter_class). An accepted alternative spelling is not an error.
+    """
+    counts: Dict[str, List[int]] = {}
+    for expected, heard in result.alignment:
+        if expected is None or expected not in _PRIMARY:
+            continue
+        entry = counts.setdefault(letter_class(expected), [0, 0])
+        entry[0] += 1
+        if _is_error(expected, heard):
+            entry[1] += 1
+    return {letter: (seen, errors) for letter, (seen, errors) in counts.items()}
+
+
+def local_feedback(result: TransliterationScore, limit: int = 3) -> str:
+    """Short Hebrew feedback built from the alignment, for when the LLM is skipped."""
+    mistakes = [m for m in result.mistakes if m[0] in MARKED_TOKENS] or result.mistakes
+    if not mistakes:
+        return "התעתיק תואם את משפט היעד. כל הכבוד!"
+    notes = []
+    for expected, heard in mistakes[:limit]:
+        if heard is None:
+            notes.append(f"חסרה האות '{expected}'")
+        else:
+            notes.append(f"במקום '{expected}' נשמע '{heard}'")
+    return "שימו לב: " + "; ".join(notes) + "."
@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+import asyncio
+import gzip
+import hashlib
+import importlib
+import logging
+import mimetypes
+import os
+import pkgutil
+import re
+import sys
+import threading
+from dataclasses import dataclass
+from functools import cached_property
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Dict, Tuple
+
+from fastapi.middleware.wsgi import WSGIMiddleware
+
+from cache import SingleFlight
+
+if TYPE_CHECKING:
+    import dash
+
+try:
+    import brotli
+except ImportError:  # optional; gzip only without it
+    brotli = None
+
+STATIC_GZIP_LEVEL = int(os.environ.get("STATIC_GZIP_LEVEL", "9"))
+STATIC_BROTLI_QUALITY = int(os.environ.get("STATIC_BROTLI_QUALITY", "11"))
+# Smaller files are not worth a Content-Encoding header.
+STATIC_MIN_COMPRESS_BYTES = int(os.environ.get("STATIC_MIN_COMPRESS_BYTES", "512"))
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+COMPRESSIBLE = {".js", ".mjs", ".css", ".map", ".json", ".svg", ".html", ".txt"}
+# Component packages also contain Python sources; only their browser bundles are served.
+BUNDLE_EXTENSIONS = {".js", ".mjs", ".css", ".map"}
+
+# Where app.py's Dash serves its routes and assets (Dash's defaults). The API registers
+# routes under them before Dash is imported; DashApp.load checks they still match.
+DASH_ROUTES_PREFIX = "/"
+DASH_ASSETS_PATH = "assets"
+
+_STATIC_URL = re.compile(r'(?:src|href)="(/(?:_dash-component-suites|assets)/[^"?]+)')
+
+
+@dataclass(frozen=True)
+class StaticFile:
+    """One file held in memory with its compressed variants, built once per worker."""
+
+    media_type: str
+    etag: str
+    variants: Dict[str, bytes]  # content-coding ("identity", "gzip", "br") -> body
+    version: str | None = None  # asset mtime as Dash prints it in `?m=`; None for bundles
+
+    @classmethod
+    def build(cls, data: bytes, filename: str, version: str | None = None) -> "StaticFile":
+        extension = os.path.splitext(filename)[1]
+        media_type = mimetypes.types_map.get(extension, "application/octet-stream")
+        if media_type.startswith("text/") or extension in {".js", ".mjs"}:
+            media_type += "; charset=utf-8"
+        variants = {"identity": data}
+        if extension in COMPRESSIBLE and len(data) >= STATIC_MIN_COMPRESS_BYTES:
+            # mtime=0 keeps the gzip bytes (and so the ETag) identical across workers.
+            candidates = {"gzip": gzip.compress(data, compresslevel=STATIC_GZIP_LEVEL, mtime=0)}
+            if brotli is not None:
+                candidates["br"] = brotli.compress(data, quality=STATIC_BROTLI_QUALITY)
+            variants.update({coding: body for coding, body in candidates.items() if len(body) < len(data)})
+        return cls(media_type, hashlib.sha256(data).hexdigest()[:32], variants, version)
+
+    def negotiate(self, accept_encoding: str) -> str:
+        """Pick the smallest variant the client accepts (q=0 excludes a coding)."""
+        accepted = set()
+        for item in accept_encoding.lower().split(","):
+            coding, _, params = item.strip().partition(";")
+            if params.replace(" ", "") in {"q=0", "q=0.0", "q=0.00", "q=0.000"}:
+                continue
+            accepted.add(coding.strip())
+        for coding in ("br", "gzip"):
+            if coding in self.variants and (coding in accepted or "*" in accepted):
+                return coding
+        return "identity"
+
+    def variant_etag(self, coding: str) -> str:
+        # Strong validators must differ between encodings of the same resource.
+        return f'"{self.etag}"' if coding == "identity" else f'"{self.etag}-{coding}"'
+
+
+class DashApp:
+    """
+    The Dash app of `module` (Dash and the whole layout), imported on first use rather
+    than with the API: loading it takes most of a second of a cold start. Mounted as an
+    ASGI app that serves it through the WSGI bridge; a request arriving before the
+    lifespan's load has finished waits for that same load.
+    """
+
+    def __init__(self, module: str = "app") -> None:
+        self.module = module
+        self.app: dash.Dash | None = None
+        self._bridge: WSGIMiddleware | None = None
+        self._lock = threading.Lock()
+
+    def load(self) -> dash.Dash:
+        """Import the app once. Blocking; safe from any thread."""
+        with self._lock:
+            if self.app is None:
+                app = importlib.import_module(self.module).app
+                prefixes = (app.config.routes_pathname_prefix, app.config.assets_url_path.strip("/"))
+                if prefixes != (DASH_ROUTES_PREFIX, DASH_ASSETS_PATH):
+                    raise RuntimeError(
+                        f"Dash serves under {prefixes}; update DASH_ROUTES_PREFIX and DASH_ASSETS_PATH to match."
+                    )
+                self._bridge = WSGIMiddleware(app.server)
+                self.app = app
+        return self.app
+
+    async def ready(self) -> dash.Dash:
+        return self.app if self.app is not None else await asyncio.to_thread(self.load)
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if self._bridge is None:
+            await self.ready()
+        await self._bridge(scope, receive, send)
+
+
+class DashStatic:
+    """
+    Serves Dash's component bundles (/_dash-component-suites) and the assets folder
+    straight from the event loop, with gzip/brotli variants compressed once per file,
+    strong ETags and immutable caching for fingerprinted URLs. Only Dash's dynamic
+    routes (layout, dependencies, callbacks, index) still go through the WSGI bridge.
+    """
+
+    def __init__(self, dash_app: DashApp) -> None:
+        self.dash_app = dash_app
+        self._files: Dict[Tuple[str, str], StaticFile] = {}
+        self._flights = SingleFlight()
+        self.hits = 0
+        self.builds = 0
+        self.not_modified = 0
+
+    @property
+    def app(self) -> dash.Dash:
+        # Every caller runs after `await self.dash_app.ready()`.
+        return self.dash_app.load()
+
+    @cached_property
+    def assets_folder(self) -> Path:
+        return Path(self.app.config.assets_folder).resolve()
+
+    def _packages(self) -> set[str]:
+        # Namespaces Dash will link bundles from: dash itself plus every registered component library.
+        from dash.development.base_component import ComponentRegistry
+
+        return {"dash", *ComponentRegistry.registry, *self.app.registered_paths}
+
+    def _load_package_file(self, package: str, path: str) -> StaticFile | None:
+        if package not in self._packages() or package not in sys.modules:
+            return None
+        if os.path.splitext(path)[1] not in BUNDLE_EXTENSIONS:
+            return None
+        try:
+            data = pkgutil.get_data(package, path)
+        except (OSError, ValueError):
+            return None
+        return None if data is None else StaticFile.build(data, path)
+
+    def _asset_path(self, path: str) -> Path | None:
+        candidate = (self.assets_folder / path).resolve()
+        if not candidate.is_relative_to(self.assets_folder) or not candidate.is_file():
+            return None
+        return candidate
+
+    def _load_asset(self, path: str) -> StaticFile | None:
+        candidate = self._asset_path(path)
+        if candidate is None:
+            return None
+        return StaticFile.build(candidate.read_bytes(), candidate.name, version=str(candidate.stat().st_mtime))
+
+    async def _get(
+        self, key: Tuple[str, str], loader: Callable[..., StaticFile | None], *args: str
+    ) -> StaticFile | None:
+        entry = self._files.get(key)
+        if entry is not None:
+            self.hits += 1
+            return entry
+
+        async def build() -> StaticFile | None:
+            self.builds += 1
+            built = await asyncio.to_thread(loader, *args)
+            if built is not None:
+                self._files[key] = built
+            return built
+
+        return await self._flights.do(key, build)
+
+    async def component_suite(self, package: str, fingerprinted_path: str) -> Tuple[StaticFile | None, bool]:
+        """Resolve a bundle URL; the flag says whether the URL carries Dash's fingerprint."""
+        await self.dash_app.ready()
+        from dash.fingerprint import check_fingerprint
+
+        path, fingerprinted = check_fingerprint(fingerprinted_path)
+        if ".." in path.split("/"):
+            return None, False
+        entry = await self._get(("suite", f"{package}/{path}"), self._load_package_file, package, path)
+        return entry, fingerprinted
+
+    async def asset(self, path: str) -> StaticFile | None:
+        await self.dash_app.ready()
+        key = ("asset", path)
+        entry = self._files.get(key)
+        if entry is not None:
+            # Assets change while developing; drop the entry when the file moves on.
+            candidate = self._asset_path(path)
+            if candidate is None or str(candidate.stat().st_mtime) != entry.version:
+                self._files.pop(key, None)
+        return await self._get(key, self._load_asset, path)
+
+    async def warm(self) -> int:
+        """
+        Render the index once and precompress every bundle and asset it links, so the
+        first visitor is not the one paying for brotli (or for importing Dash). Returns the
+        number of files built.
+        """
+        await self.dash_app.ready()
+        html = await asyncio.to_thread(self._render_index)
+        urls = {match.group(1) for match in _STATIC_URL.finditer(html)}
+        for url in urls:
+            try:
+                if url.startswith("/_dash-component-suites/"):
+                    package, _, path = url[len("/_dash-component-suites/") :].partition("/")
+                    await self.component_suite(package, path)
+                else:
+                    await self.asset(url[len("/assets/") :])
+            except Exception:  # noqa: BLE001
+                logging.exception("Failed to precompress %s", url)
+        return len(urls)
+
+    def _render_index(self) -> str:
+        with self.app.server.test_client() as client:
+            return client.get(self.app.config.requests_pathname_prefix).get_data(as_text=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "files": len(self._files),
+            "bytes": {
+                coding: sum(len(entry.variants[coding]) for entry in self._files.values() if coding in entry.variants)
+                for coding in ("identity", "gzip", "br")
+            },
+            "hits": self.hits,
+            "builds": self.builds,
+            "not_modified": self.not_modified,
+        }
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import io
+import os
+import struct
+import subprocess
+import tempfile
+import wave
+from pathlib import Path
+from typing import Any, Dict
+
+import numpy as np
+import pytest
+
+import audio_prep
+
+
+@pytest.fixture
+def ffmpeg_calls(monkeypatch: pytest.MonkeyPatch) -> Dict[str, Any]:
+    """Records what _decode_ffmpeg hands to ffmpeg; answers with a second of silence."""
+    calls: Dict[str, Any] = {}
+
+    def run(args, **kwargs):
+        calls.update(kwargs)
+        if "stdin" in kwargs:
+            # Where ffmpeg starts reading: the descriptor's offset, not the Python buffer's.
+            calls["stdin_position"] = os.lseek(kwargs["stdin"].fileno(), 0, os.SEEK_CUR)
+        silence = np.zeros(audio_prep.TARGET_RATE, dtype="<f4").tobytes()
+        return subprocess.CompletedProcess(args, 0, stdout=silence, stderr=b"")
+
+    monkeypatch.setattr(audio_prep, "FFMPEG_BINARY", "ffmpeg")
+    monkeypatch.setattr(audio_prep.subprocess, "run", run)
+    return calls
+
+
+def test_in_memory_spool_is_piped_without_rolling_over(ffmpeg_calls: Dict[str, Any]) -> None:
+    spool = tempfile.SpooledTemporaryFile(max_size=1024)
+    spool.write(b"header" + b"payload")
+    spool.seek(6)
+    samples, rate, clipping = audio_prep._decode_ffmpeg(spool)
+    assert ffmpeg_calls["input"] == b"payload"
+    assert "stdin" not in ffmpeg_calls
+    assert spool.name is None  # still in memory
+    assert (samples.size, rate, clipping) == (audio_prep.TARGET_RATE, audio_prep.TARGET_RATE, 0.0)
+
+
+def test_spool_on_disk_is_handed_over_as_stdin(ffmpeg_calls: Dict[str, Any]) -> None:
+    spool = tempfile.SpooledTemporaryFile(max_size=4)
+    spool.write(b"header" + b"payload")
+    assert spool.name is not None  # rolled over to a temporary file
+    spool.seek(6)
+    audio_prep._decode_ffmpeg(spool)
+    assert ffmpeg_calls["stdin"] is spool
+    assert ffmpeg_calls["stdin_position"] == 6
+    assert "input" not in ffmpeg_calls
+
+
+def test_plain_buffer_is_piped(ffmpeg_calls: Dict[str, Any]) -> None:
+    audio = io.BytesIO(b"payload")
+    audio.fileno = None  # never consulted
+    audio_prep._decode_ffmpeg(audio)
+    assert ffmpeg_calls["input"] == b"payload"
+
+
+def test_file_on_disk_is_handed_over_as_stdin(ffmpeg_calls: Dict[str, Any], tmp_path: Path) -> None:
+    path = tmp_path / "recording.webm"
+    path.write_bytes(b"header" + b"payload")
+    with open(path, "rb") as audio:
+        audio.read(6)
+        audio_prep._decode_ffmpeg(audio)
+        assert ffmpeg_calls["stdin"] is audio
+        assert ffmpeg_calls["stdin_position"] == 6
+
+
+def forged_wav(rate: int, data_size: int, frames: int = 8000) -> bytes:
+    """A mono 16-bit WAV whose header claims `rate` and `data_size` but holds `frames` frames."""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(16000)
+        wav.writeframes(np.full(frames, 1000, dtype="<i2").tobytes())
+    data = bytearray(buffer.getvalue())
+    data[24:28] = struct.pack("<I", rate)
+    data[40:44] = struct.pack("<I", data_size)
+    return bytes(data)
+
+
+def test_forged_sample_rate_is_a_quality_error() -> None:
+    with pytest.raises(audio_prep.AudioQualityError) as rejected:
+        audio_prep.prepare_audio(forged_wav(2_000_000_000, 0xFFFFFFFE))
+    assert (rejected.value.code, rejected.value.metrics) == ("unsupported_rate", {"rate": 2_000_000_000})
+
+
+def test_frame_count_is_capped_by_the_bytes_present() -> None:
+    samples, rate, _ = audio_prep._decode_wav(io.BytesIO(forged_wav(16000, 0xFFFFFFFE)))
+    assert (samples.size, rate) == (8000, 16000)
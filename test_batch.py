@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import io
+import json
+import zipfile
+from typing import Any, AsyncIterator, Dict, List, Tuple
+
+import pytest
+from fastapi import HTTPException, UploadFile
+from fastapi.testclient import TestClient
+from starlette.datastructures import Headers
+
+import main
+from batch import close_items, from_archive, from_files, parse_manifest
+
+WAV = b"RIFF" + b"\0" * 40
+
+
+def upload(data: bytes, filename: str, content_type: str = "audio/wav") -> UploadFile:
+    return UploadFile(io.BytesIO(data), filename=filename, headers=Headers({"content-type": content_type}))
+
+
+def archive(entries: Dict[str, bytes]) -> UploadFile:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as bundle:
+        for name, data in entries.items():
+            bundle.writestr(name, data)
+    return upload(buffer.getvalue(), "batch.zip", "application/zip")
+
+
+def test_parse_manifest_keeps_known_fields_and_drops_empty_ones() -> None:
+    text = json.dumps({"a.wav": {"phrase_id": "p0001", "hint": "", "learner_id": None}})
+    assert parse_manifest(text) == {"a.wav": {"phrase_id": "p0001"}}
+    assert parse_manifest(None) == {}
+
+
+@pytest.mark.parametrize(
+    "text",
+    ["not json", "[1, 2]", '{"a.wav": "p0001"}', '{"a.wav": {"score": "100"}}', '{"a.wav": {"phrase_id": 1}}'],
+)
+def test_parse_manifest_rejects_anything_else(text: str) -> None:
+    with pytest.raises(HTTPException) as rejected:
+        parse_manifest(text)
+    assert rejected.value.status_code == 400
+
+
+def test_from_files_copies_and_checks_each_recording() -> None:
+    items = from_files([upload(WAV, "a.wav"), upload(WAV + b"x", "b.wav")])
+    assert [(item.name, item.audio.read()) for item in items] == [("a.wav", WAV), ("b.wav", WAV + b"x")]
+    close_items(items)
+    with pytest.raises(HTTPException) as wrong_type:
+        from_files([upload(WAV, "a.mp3", "audio/mpeg")])
+    assert wrong_type.value.status_code == 400
+    with pytest.raises(HTTPException) as empty:
+        from_files([upload(b"", "a.wav")])
+    assert empty.value.status_code == 400
+
+
+def test_from_archive_extracts_recordings_and_manifest() -> None:
+    bundle = archive(
+        {
+            "dana/1.wav": WAV,
+            "omer.wav": WAV,
+            "manifest.json": json.dumps({"omer.wav": {"learner_id": "omer"}}).encode(),
+            "__MACOSX/._omer.wav": b"junk",
+            ".DS_Store": b"junk",
+        }
+    )
+    items, manifest = from_archive(bundle)
+    assert [item.name for item in items] == ["dana/1.wav", "omer.wav"]
+    assert manifest == {"omer.wav": {"learner_id": "omer"}}
+    close_items(items)
+
+
+@pytest.mark.parametrize(
+    "bundle",
+    [archive({"notes.txt": b"hello"}), archive({"empty.wav": b""}), upload(b"not a zip", "batch.zip")],
+)
+def test_from_archive_rejects_bad_contents(bundle: UploadFile) -> None:
+    with pytest.raises(HTTPException) as rejected:
+        from_archive(bundle)
+    assert rejected.value.status_code == 400
+
+
+def test_batch_streams_one_ndjson_line_per_recording(monkeypatch: pytest.MonkeyPatch) -> None:
+    recorded: List[Tuple[str | None, str | None]] = []
+
+    async def analyze_batch(
+        recordings: List[Tuple[Any, Dict[str, Any]]], scoring: str | None, transcriber: str | None
+    ) -> AsyncIterator[Tuple[int, Dict[str, Any] | Exception]]:
+        assert [context["arabic_transliteration"] for _, context in recordings] == ["מרחבא", "אהלן"]
+        # Finished out of order; the second one failed.
+        yield 1, ValueError("no API key")
+        yield 0, {"score": 90, "transcription": "מרחבא"}
+
+    monkeypatch.setattr(main, "analyze_batch", analyze_batch)
+    monkeypatch.setattr(main, "_record_attempt", lambda learner, phrase_id, *_: recorded.append((learner, phrase_id)))
+
+    manifest = {"b.wav": {"arabic_transliteration": "אהלן"}, "c.wav": {"learner_id": "not a valid id!"}}
+    response = TestClient(main.server).post(
+        "/api/analyze/batch",
+        files=[("files", (name, WAV, "audio/wav")) for name in ("a.wav", "b.wav", "c.wav")],
+        data={"arabic_transliteration": "מרחבא", "learner_id": "dana", "manifest": json.dumps(manifest)},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [(line.get("index"), line.get("file"), line.get("status")) for line in lines[:3]] == [
+        (2, "c.wav", 400),
+        (1, "b.wav", 500),
+        (0, "a.wav", 200),
+    ]
+    assert lines[2]["result"]["score"] == 90
+    assert lines[3] == {"done": True, "ok": 1, "failed": 2}
+    assert recorded == [("dana", None)]
+
+
+def test_batch_refuses_a_manifest_naming_unknown_files() -> None:
+    response = TestClient(main.server).post(
+        "/api/analyze/batch",
+        files=[("files", ("a.wav", WAV, "audio/wav"))],
+        data={"manifest": json.dumps({"z.wav": {"phrase_id": "p0001"}})},
+    )
+    assert response.status_code == 400
+    assert "z.wav" in response.json()["detail"]
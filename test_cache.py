@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import asyncio
+from pathlib import Path
+from typing import Any, Dict, List
+
+import pytest
+
+import gemini_service
+from cache import LRUCache, SQLiteCache
+
+
+def test_sqlite_cache_round_trips_and_survives_reopening(tmp_path: Path) -> None:
+    path = str(tmp_path / "memo.sqlite3")
+    store = SQLiteCache(path, max_entries=10)
+    assert store.get("missing") is None
+    store.set("k", {"score": 80, "feedback": "יפה"})
+    store.set("k", {"score": 90, "feedback": "מצוין"})
+    store.close()
+
+    reopened = SQLiteCache(path, max_entries=10)
+    assert reopened.get("k") == {"score": 90, "feedback": "מצוין"}
+    reopened.close()
+
+
+def test_sqlite_cache_prunes_least_recently_used(tmp_path: Path) -> None:
+    store = SQLiteCache(str(tmp_path / "memo.sqlite3"), max_entries=4)
+    store.set("keep", 0)
+    for index in range(63):
+        store.set(f"k{index}", index)
+        # Reading an entry counts as use.
+        store.get("keep")
+    assert store.get("keep") == 0
+    assert store.get("k0") is None
+    assert store.get("k62") == 62
+    store.close()
+
+
+def test_sqlite_cache_does_not_open_the_file_until_used(tmp_path: Path) -> None:
+    path = tmp_path / "memo.sqlite3"
+    store = SQLiteCache(str(path), max_entries=4)
+    assert not path.exists()
+    store.close()
+    store.set("k", 1)
+    assert path.exists()
+    store.close()
+
+
+def test_eval_key_ignores_transcript_noise_but_not_the_target() -> None:
+    key = gemini_service._eval_key("מַרְחַבַּא!", "שלום", None, "מרחבא", "local")
+    assert key == gemini_service._eval_key("  מרחבא ", "שלום", None, "מרחבא", "local")
+    assert key != gemini_service._eval_key("מרחבא", "שלום", None, "אהלן", "local")
+    assert key != gemini_service._eval_key("מרחבא", "שלום", None, "מרחבא", "llm")
+
+
+def test_memoized_evaluations_compute_once_and_reload_from_sqlite(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    store = SQLiteCache(str(tmp_path / "memo.sqlite3"), max_entries=10)
+    monkeypatch.setattr(gemini_service, "_eval_memo", LRUCache(10))
+    monkeypatch.setattr(gemini_service, "_eval_store", store)
+    calls: List[int] = []
+
+    async def compute() -> Dict[str, Any]:
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"score": 75}
+
+    async def scenario() -> List[Dict[str, Any]]:
+        results = await asyncio.gather(*(gemini_service._memoized("key", compute) for _ in range(3)))
+        results[0]["request_id"] = "mutated"
+        # A fresh process: empty memory tier, same SQLite file.
+        monkeypatch.setattr(gemini_service, "_eval_memo", LRUCache(10))
+        return results + [await gemini_service._memoized("key", compute)]
+
+    results = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert results[1:] == [{"score": 75}] * 3
+    store.close()
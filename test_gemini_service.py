@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Any, AsyncIterator, Dict, List, Tuple
+
+import pytest
+
+import gemini_service
+
+RESULT = {"score": 80, "translation_score": 90, "pronunciation_score": 70, "transcription": "מרחבא"}
+
+
+def shadow_failures() -> float:
+    return sum(gemini_service.engine_shadow_failures._values.values())
+
+
+def score_gaps() -> float:
+    return sum(total for _, (total,) in gemini_service.engine_score_gap._values.values())
+
+
+def run_shadow(monkeypatch: pytest.MonkeyPatch, events: List[Tuple[str, Any]], fail: bool = False) -> None:
+    async def analyze_audio_events(*args: Any, **kwargs: Any) -> AsyncIterator[Tuple[str, Any]]:
+        for event in events:
+            yield event
+        if fail:
+            raise RuntimeError("upstream went away")
+
+    monkeypatch.setattr(gemini_service, "analyze_audio_events", analyze_audio_events)
+
+    async def scenario() -> None:
+        gemini_service._start_shadow("pipeline", b"", "שלום", None, "מרחבא", "local", None, dict(RESULT))
+        await asyncio.gather(*gemini_service._shadows)
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize(
+    "events, fail",
+    [
+        ([("transcript", {"transcription": "מרחבא"})], False),
+        ([("result", {"score": 60})], False),
+        ([("transcript", {"transcription": "מרחבא"})], True),
+    ],
+)
+def test_shadow_without_a_result_is_counted_not_raised(
+    monkeypatch: pytest.MonkeyPatch, events: List[Tuple[str, Any]], fail: bool
+) -> None:
+    before = shadow_failures()
+    run_shadow(monkeypatch, events, fail)
+    assert shadow_failures() == before + 1
+
+
+def test_shadow_result_is_compared(monkeypatch: pytest.MonkeyPatch) -> None:
+    failures, gaps = shadow_failures(), score_gaps()
+    shadow: Dict[str, Any] = {**RESULT, "score": 70, "pronunciation_score": 65}
+    run_shadow(monkeypatch, [("result", shadow)])
+    assert shadow_failures() == failures
+    assert score_gaps() == gaps + 15
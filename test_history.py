@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import asyncio
+import sqlite3
+from pathlib import Path
+from typing import Dict, Tuple
+
+from history import Attempt, HistoryDB, LearnerHistory
+
+
+def attempt(transcription: str, target: str, score: int, phrase_id: str | None = "p1", created: float = 1.0) -> Attempt:
+    return Attempt(
+        learner="dana",
+        phrase_id=phrase_id,
+        target=target,
+        transcription=transcription,
+        score=score,
+        translation_score=score,
+        pronunciation_score=score,
+        engine="test",
+        created=created,
+    )
+
+
+def letter_rows(path: Path) -> Dict[str, Tuple[int, int]]:
+    with sqlite3.connect(path) as conn:
+        rows = conn.execute("SELECT letter, seen, errors FROM letter_stats WHERE learner = 'dana'").fetchall()
+    return {letter: (seen, errors) for letter, seen, errors in rows}
+
+
+def test_letter_stats_use_canonical_letters(tmp_path: Path) -> None:
+    path = tmp_path / "history.sqlite3"
+    db = HistoryDB(str(path))
+    # ע heard as ח is an ayin mistake; ס and כ are plain letters with their own classes.
+    db.write([attempt("חלי", "עלי", 60), attempt("עלי", "עלי", 100, created=2.0)])
+    db.write([attempt("סכר", "סכר", 100, phrase_id="p2", created=3.0)])
+    rows = letter_rows(path)
+    assert rows["ع"] == (2, 1)
+    assert rows["ل"] == (2, 0)
+    assert rows["س"] == (1, 0)
+    assert rows["ك"] == (1, 0)
+    assert "ا/أ/إ/آ" not in rows
+    assert "ث" not in rows and "خ" not in rows
+
+    summary = db.progress("dana", 5)
+    assert (summary["attempts"], summary["best_score"], summary["mean_score"]) == (3, 100, 86.7)
+    assert summary["letters"][0] == {"letter": "ع", "seen": 2, "errors": 1, "error_rate": 0.5}
+    assert [row["phrase_id"] for row in summary["weak_phrases"]] == ["p1", "p2"]
+    assert summary["weak_phrases"][0]["last_score"] == 100
+    db.close()
+
+
+def test_write_behind_flushes_batches_and_on_close(tmp_path: Path) -> None:
+    path = tmp_path / "history.sqlite3"
+
+    async def scenario() -> Tuple[int, int, Dict[str, object]]:
+        history = LearnerHistory(str(path), batch_size=2, interval=60, max_queue=3)
+        await history.start()
+        for index in range(2):
+            assert history.record(attempt("עלי", "עלי", 90, created=float(index)))
+        # A full batch wakes the writer long before the interval.
+        for _ in range(100):
+            flushed = (await history.progress("dana", 5))["attempts"]
+            if flushed:
+                break
+            await asyncio.sleep(0.01)
+        assert history.record(attempt("עלי", "עלי", 70, created=5.0))
+        queued = len(history)
+        await history.close()
+        db = HistoryDB(str(path))
+        try:
+            return flushed, queued, db.progress("dana", 5)
+        finally:
+            db.close()
+
+    flushed, queued, summary = asyncio.run(scenario())
+    assert (flushed, queued) == (2, 1)
+    assert summary["attempts"] == 3
+    assert summary["letters"][0]["seen"] == 3
+
+
+def test_full_queue_drops_and_disabled_history_records_nothing() -> None:
+    history = LearnerHistory("history.sqlite3", batch_size=10, interval=60, max_queue=1)
+    assert history.record(attempt("", "עלי", 0))
+    assert not history.record(attempt("", "עלי", 0))
+    assert len(history) == 1
+    assert not LearnerHistory("", batch_size=10, interval=60, max_queue=10).record(attempt("", "עלי", 0))
@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import asyncio
+import time
+
+import pytest
+
+from limits import Limiter, Overloaded, TokenBucket
+
+
+def test_token_bucket_allows_a_burst_then_spaces_callers() -> None:
+    bucket = TokenBucket(rate=10, burst=2)
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+    bucket.refund()
+    bucket.refund()
+    assert bucket.reserve() == 0.0
+
+
+def test_overloaded_rounds_retry_after_up() -> None:
+    assert Overloaded("tts", "queue_full", 0.2, 503).retry_after == 1
+    assert Overloaded("tts", "rate_limited", 2.1, 429).retry_after == 3
+
+
+def test_full_queue_is_rejected_and_waiters_are_admitted_in_turn() -> None:
+    limiter = Limiter("test_queue", concurrency=1, max_queue=1, max_wait=5)
+    order = []
+
+    async def use(name: str, hold: float) -> None:
+        async with limiter.slot():
+            order.append(name)
+            await asyncio.sleep(hold)
+
+    async def scenario() -> Overloaded:
+        first = asyncio.create_task(use("first", 0.05))
+        await asyncio.sleep(0.01)
+        second = asyncio.create_task(use("second", 0))
+        await asyncio.sleep(0.01)
+        with pytest.raises(Overloaded) as rejected:
+            await use("third", 0)
+        await asyncio.gather(first, second)
+        return rejected.value
+
+    rejected = asyncio.run(scenario())
+    assert (rejected.reason, rejected.status) == ("queue_full", 503)
+    assert order == ["first", "second"]
+    stats = limiter.stats()
+    assert (stats["admitted"], stats["in_flight"], stats["queued"]) == (2, 0, 0)
+    assert stats["rejected"]["queue_full"] == 1
+    assert stats["wait_seconds_max"] >= 0.03
+
+
+def test_rate_limit_rejects_with_429_when_the_wait_exceeds_the_budget() -> None:
+    limiter = Limiter("test_rate", concurrency=4, rate=1, burst=1, max_wait=0.5)
+
+    async def scenario() -> Overloaded:
+        async with limiter.slot():
+            pass
+        with pytest.raises(Overloaded) as rejected:
+            async with limiter.slot():
+                pass
+        return rejected.value
+
+    rejected = asyncio.run(scenario())
+    assert (rejected.reason, rejected.status, rejected.retry_after) == ("rate_limited", 429, 1)
+    # The refused caller's token went back into the bucket.
+    assert limiter._bucket.tokens == pytest.approx(0.0, abs=0.1)
+
+
+def test_callers_that_would_miss_their_deadline_are_refused_up_front() -> None:
+    limiter = Limiter("test_deadline", concurrency=1, max_wait=5)
+
+    async def scenario() -> Overloaded:
+        async with limiter.slot():
+            with pytest.raises(Overloaded) as rejected:
+                async with limiter.slot(deadline=time.monotonic() + 0.05):
+                    pass
+        return rejected.value
+
+    started = time.monotonic()
+    rejected = asyncio.run(scenario())
+    assert (rejected.reason, rejected.status) == ("deadline", 503)
+    assert time.monotonic() - started < 0.05
+
+
+def test_timed_out_admission_gives_its_token_back() -> None:
+    limiter = Limiter("test_refund", concurrency=1, rate=1, burst=5, max_wait=5)
+
+    async def scenario() -> Overloaded:
+        async with limiter.slot():
+            # Low enough service time that the wait looks feasible, so the caller queues.
+            limiter._service_time = 0.0
+            before = limiter._bucket.tokens
+            with pytest.raises(Overloaded) as rejected:
+                async with limiter.slot(deadline=time.monotonic() + 0.05):
+                    pass
+            assert limiter._bucket.tokens == pytest.approx(before, abs=0.2)
+        return rejected.value
+
+    rejected = asyncio.run(scenario())
+    assert rejected.reason == "deadline"
+    assert limiter.stats()["rejected"]["deadline"] == 1
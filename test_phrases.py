@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import List
+
+import pytest
+
+from phrases import PhraseCatalog
+
+RECORDS = [
+    {"id": "a1", "level": 1, "topic": "greetings", "native": "שלום", "arabic_transliteration": "מַרְחַבַּא"},
+    {"id": "a2", "level": 1, "topic": "greetings", "native": "תודה", "arabic_transliteration": "שֻׁכְּרַן"},
+    {"id": "a3", "level": 2, "topic": "food", "native": "עגבניות", "arabic_transliteration": "בַּנְדוֹרַה"},
+    {"id": "a4", "level": 2, "topic": "greetings", "native": "עליכם", "arabic_transliteration": "וּעַלֵיכֹּם"},
+    {"id": "a5", "level": 1, "topic": "food", "native": "לחם", "arabic_transliteration": "ח'ֻבְּז"},
+    {"id": "a6", "level": 1, "topic": "names", "native": "סמי", "arabic_transliteration": "סַאמִי"},
+]
+
+
+@pytest.fixture
+def catalog(tmp_path: Path) -> PhraseCatalog:
+    path = tmp_path / "phrases.jsonl"
+    path.write_text("\n".join(json.dumps(record, ensure_ascii=False) for record in RECORDS) + "\n\n", encoding="utf-8")
+    return PhraseCatalog.load(str(path))
+
+
+def ids(phrases) -> List[str]:
+    return [phrase.id for phrase in phrases]
+
+
+def test_tags_use_canonical_letters(catalog: PhraseCatalog) -> None:
+    assert catalog.get("a1").tags == ("ح",)
+    assert catalog.get("a4").tags == ("ع",)
+    assert catalog.get("a5").tags == ("خ",)
+    # Plain ס and כ are س and ك, which Hebrew speakers already pronounce.
+    assert catalog.get("a2").tags == ()
+    assert catalog.get("a6").tags == ()
+
+
+def test_pages_follow_the_cursor_to_the_end(catalog: PhraseCatalog) -> None:
+    seen: List[str] = []
+    cursor = None
+    while True:
+        items, cursor = catalog.page(cursor, limit=4)
+        seen += ids(items)
+        if cursor is None:
+            break
+    assert seen == [record["id"] for record in RECORDS]
+    assert catalog.page(limit=4) == (catalog.phrases[:4], "a4")
+
+
+def test_filters_combine_and_paginate(catalog: PhraseCatalog) -> None:
+    items, cursor = catalog.page(level=1, limit=2)
+    assert (ids(items), cursor) == (["a1", "a2"], "a2")
+    items, cursor = catalog.page(cursor, level=1, limit=2)
+    assert (ids(items), cursor) == (["a5", "a6"], None)
+    assert ids(catalog.page(level=1, topic="food")[0]) == ["a5"]
+    assert ids(catalog.page(tag="ع")[0]) == ["a4"]
+    assert ids(catalog.page("a1", tag="ح")[0]) == []
+    assert catalog.page(tag="ث") == ([], None)
+
+
+def test_unknown_cursor_and_duplicate_ids_are_rejected(catalog: PhraseCatalog, tmp_path: Path) -> None:
+    with pytest.raises(KeyError):
+        catalog.page("missing")
+    path = tmp_path / "duplicates.jsonl"
+    path.write_text("\n".join(json.dumps(record, ensure_ascii=False) for record in RECORDS[:2] * 2), encoding="utf-8")
+    with pytest.raises(ValueError):
+        PhraseCatalog.load(str(path))
+
+
+def test_stats_and_etag(catalog: PhraseCatalog) -> None:
+    stats = catalog.stats()
+    assert stats["phrases"] == len(RECORDS)
+    assert stats["levels"] == [1, 2]
+    assert stats["tags"] == ["ح", "خ", "ع"]
+    assert catalog.etag(None, 20) == catalog.etag(None, 20)
+    assert catalog.etag(None, 20) != catalog.etag("a1", 20)
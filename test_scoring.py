@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import pytest
+
+from scoring import MARKED_TOKENS, letter_class, letter_errors, local_feedback, score_transliteration
+
+
+@pytest.mark.parametrize(
+    "token, arabic",
+    [
+        ("א", "ا/أ/إ/آ"),
+        ("ע", "ع"),
+        ("ס", "س"),
+        ("כ", "ك"),
+        ("ק", "ق"),
+        ("ג", "ج"),
+        ("ג׳", "ج"),
+        ("ת׳", "ث"),
+        ("ח׳", "خ"),
+        ("ד׳", "ض"),
+        ("ז׳", "ذ"),
+        ("ט׳", "ظ"),
+        ("ע׳", "غ"),
+        ("ר׳", "غ"),
+        ("ב", "ب"),
+    ],
+)
+def test_letter_class(token: str, arabic: str) -> None:
+    assert letter_class(token) == arabic
+
+
+@pytest.mark.parametrize("token", ["ת׳", "ג׳", "ח", "ח׳", "ד׳", "ז׳", "צ", "ט", "ט׳", "ע", "ע׳", "ר׳", "ק"])
+def test_marked_spellings(token: str) -> None:
+    assert token in MARKED_TOKENS
+
+
+@pytest.mark.parametrize("token", ["ס", "כ", "ג", "א", "ת", "ד", "ז", "ה"])
+def test_plain_spellings_are_not_marked(token: str) -> None:
+    assert token not in MARKED_TOKENS
+
+
+def test_identical_transcription_scores_full_marks() -> None:
+    result = score_transliteration("מרחבא", "מרחבא")
+    assert (result.translation_score, result.pronunciation_score, result.score) == (100, 100, 100)
+
+
+@pytest.mark.parametrize("learner", ["", "marhaba", "123 ..."])
+def test_empty_or_non_hebrew_transcription_scores_zero(learner: str) -> None:
+    result = score_transliteration(learner, "מרחבא")
+    assert result.translation_score == 0
+    assert result.score == 0
+
+
+def test_dropped_vowel_letter_costs_less_than_a_wrong_consonant() -> None:
+    dropped = score_transliteration("מרחב", "מרחבא").translation_score
+    wrong = score_transliteration("מרחבת", "מרחבא").translation_score
+    assert 0 < wrong < dropped < 100
+
+
+def test_letter_errors_key_ayin_as_ayin() -> None:
+    errors = letter_errors(score_transliteration("חלי", "עלי"))
+    assert errors["ع"] == (1, 1)
+    assert "ا/أ/إ/آ" not in errors
+
+
+def test_feedback_skips_accepted_spellings() -> None:
+    # א is an accepted spelling of the letter ע stands for; ב for מ is not.
+    result = score_transliteration("אלי", "עלי")
+    assert result.mistakes == []
+    assert local_feedback(result) == local_feedback(score_transliteration("עלי", "עלי"))
+    result = score_transliteration("אלב", "עלמ")
+    assert result.mistakes == [("מ", "ב")]
+    assert "'ע'" not in local_feedback(result) and "'מ'" in local_feedback(result)
@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+import asyncio
+from pathlib import Path
+from typing import AsyncIterator, List
+
+from cache import LRUCache, SingleFlight
+from tts_cache import Lead, TTSCache
+
+KEY = "k" * 64
+
+
+def test_lru_evicts_least_recently_used_by_size() -> None:
+    cache: LRUCache[bytes] = LRUCache(6, sizeof=len)
+    cache.set("a", b"aa")
+    cache.set("b", b"bb")
+    assert cache.get("a") == b"aa"
+    cache.set("c", b"cccc")
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (b"aa", None, b"cccc")
+    cache.set("big", b"x" * 7)
+    assert cache.get("big") is None
+    assert cache.stats()["size"] == 6
+
+
+def test_lru_ttl_expires_entries() -> None:
+    cache: LRUCache[int] = LRUCache(10, ttl=0)
+    cache.set("a", 1)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_single_flight_shares_one_call_and_survives_a_cancelled_caller() -> None:
+    calls: List[int] = []
+
+    async def work() -> str:
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "done"
+
+    async def scenario() -> List[str]:
+        flights = SingleFlight()
+        first = asyncio.create_task(flights.do("key", work))
+        others = [asyncio.create_task(flights.do("key", work)) for _ in range(3)]
+        await asyncio.sleep(0)
+        first.cancel()
+        results = await asyncio.gather(*others)
+        assert flights.coalesced == 3
+        assert len(flights) == 0
+        return results
+
+    assert asyncio.run(scenario()) == ["done"] * 3
+    assert len(calls) == 1
+
+
+class Upstream:
+    """Counts synthesis calls; each streams `chunks` with a pause between them."""
+
+    def __init__(self, *chunks: bytes) -> None:
+        self.chunks = chunks
+        self.calls = 0
+
+    async def stream(self) -> AsyncIterator[bytes]:
+        self.calls += 1
+        for chunk in self.chunks:
+            await asyncio.sleep(0.01)
+            yield chunk
+
+    async def synthesize(self) -> bytes:
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        return b"".join(self.chunks)
+
+
+async def streamed(cache: TTSCache, upstream: Upstream, stop_after: int | None = None) -> bytes:
+    """What a streaming /api/tts request does; stop_after simulates a client disconnect."""
+    found = await cache.lookup(KEY)
+    if not isinstance(found, Lead):
+        return found
+    body = bytearray()
+    stream = cache.tee(found, upstream.stream())
+    async for chunk in stream:
+        body.extend(chunk)
+        if stop_after is not None and len(body) >= stop_after:
+            await stream.aclose()
+            break
+    return bytes(body)
+
+
+def test_concurrent_streaming_misses_call_upstream_once(tmp_path: Path) -> None:
+    cache = TTSCache(1024, str(tmp_path), 4096)
+    upstream = Upstream(b"ab", b"cd")
+
+    async def scenario() -> List[bytes]:
+        return await asyncio.gather(*(streamed(cache, upstream) for _ in range(4)))
+
+    assert asyncio.run(scenario()) == [b"abcd"] * 4
+    assert upstream.calls == 1
+    assert cache.stats()["upstream_calls"] == 1
+    assert cache.stats()["coalesced"] == 3
+    assert (tmp_path / KEY).read_bytes() == b"abcd"
+
+
+def test_disconnected_leader_lets_waiters_synthesize(tmp_path: Path) -> None:
+    cache = TTSCache(1024, None, 0)
+    upstream = Upstream(b"ab", b"cd")
+
+    async def scenario() -> List[bytes]:
+        leader = asyncio.create_task(streamed(cache, upstream, stop_after=2))
+        await asyncio.sleep(0)
+        waiters = [streamed(cache, upstream), cache.get_or_create(KEY, upstream.synthesize)]
+        return await asyncio.gather(leader, *waiters)
+
+    assert asyncio.run(scenario()) == [b"ab", b"abcd", b"abcd"]
+    # The cut-off stream, then one call shared by both waiters.
+    assert upstream.calls == 2
+
+
+def test_abandoned_lead_releases_waiters() -> None:
+    cache = TTSCache(1024, None, 0)
+    upstream = Upstream(b"xy")
+
+    async def scenario() -> bytes:
+        lead = await cache.lookup(KEY)
+        waiter = asyncio.create_task(cache.get_or_create(KEY, upstream.synthesize))
+        await asyncio.sleep(0)
+        lead.abandon()
+        return await waiter
+
+    assert asyncio.run(scenario()) == b"xy"
+    assert upstream.calls == 1
+
+
+def test_waiters_stop_waiting_on_a_stuck_flight() -> None:
+    cache = TTSCache(1024, None, 0, flight_wait=0.05)
+    upstream = Upstream(b"xy")
+
+    async def scenario() -> List[object]:
+        stuck = await cache.lookup(KEY)
+        assert isinstance(stuck, Lead)
+        # Neither tee()d nor abandoned, as when a response is dropped before its body starts.
+        streaming = await cache.lookup(KEY)
+        synthesized = await cache.get_or_create(KEY, upstream.synthesize)
+        return [streaming, synthesized]
+
+    streaming, synthesized = asyncio.run(scenario())
+    assert isinstance(streaming, Lead) and streaming.future is None
+    assert synthesized == b"xy"
+
+
+def test_tts_stream_dropped_before_its_first_chunk_releases_everything(monkeypatch) -> None:
+    import main
+
+    upstream = Upstream(b"ab", b"cd")
+    open_streams: List[int] = []
+
+    class Opened:
+        async def __aenter__(self) -> None:
+            open_streams.append(1)
+
+        async def __aexit__(self, *exc: object) -> None:
+            open_streams.pop()
+
+    async def stream_speech(content: str, audio_format: str, stack) -> AsyncIterator[bytes]:
+        await stack.enter_async_context(Opened())
+        return upstream.stream()
+
+    cache = TTSCache(1024, None, 0)
+    monkeypatch.setattr(main, "tts_cache", cache)
+    monkeypatch.setattr(main, "_stream_speech", stream_speech)
+
+    async def request(disconnect: bool) -> bytes:
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "POST",
+            "scheme": "http",
+            "path": "/api/tts",
+            "raw_path": b"/api/tts",
+            "root_path": "",
+            "query_string": b"",
+            "headers": [(b"content-type", b"application/json"), (b"host", b"test")],
+            "client": ("127.0.0.1", 1234),
+            "server": ("test", 80),
+        }
+        messages = [{"type": "http.request", "body": b'{"text": "shalom", "stream": true}', "more_body": False}]
+        body = bytearray()
+
+        async def receive() -> dict:
+            if messages:
+                return messages.pop(0)
+            if not disconnect:
+                await asyncio.Event().wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message: dict) -> None:
+            if disconnect and message["type"] == "http.response.start":
+                # The client is gone before Starlette pulls the first chunk.
+                await asyncio.sleep(0.05)
+            body.extend(message.get("body", b""))
+
+        await main.server(scope, receive, send)
+        return bytes(body)
+
+    async def scenario() -> bytes:
+        assert await request(disconnect=True) == b""
+        assert not open_streams
+        await asyncio.sleep(0)  # the flight's done callback
+        assert len(cache._flights) == 0
+        return await asyncio.wait_for(request(disconnect=False), 2)
+
+    assert asyncio.run(scenario()) == b"abcd"
+    assert not open_streams
+    # Only the second request read the upstream stream.
+    assert upstream.calls == 1
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+
+from limits import Overloaded
+from upload_sessions import SessionError, SharedUploadSessions, UploadSessions
+
+
+@pytest.fixture(params=["memory", "shared"])
+def make_sessions(request: pytest.FixtureRequest, tmp_path: Path):
+    def make(max_sessions: int = 8, ttl: float = 60):
+        if request.param == "memory":
+            return UploadSessions(max_sessions, ttl)
+        return SharedUploadSessions(str(tmp_path / "uploads"), max_sessions, ttl)
+
+    return make
+
+
+def test_chunks_are_assembled_in_order(make_sessions) -> None:
+    sessions = make_sessions()
+    session = sessions.open()
+    sessions.append(session.id, 0, b"RIFF")
+    sessions.append(session.id, 1, b"data")
+    status = sessions.get(session.id).status()
+    assert (status["next_seq"], status["bytes"]) == (2, 8)
+    assert sessions.buffered_bytes() == 8
+
+    audio = sessions.finalize(session.id, chunks=2)
+    with audio:
+        assert audio.read() == b"RIFFdata"
+    assert len(sessions) == 0
+    with pytest.raises(SessionError) as gone:
+        sessions.append(session.id, 2, b"more")
+    assert gone.value.status == 404
+
+
+def test_resent_chunk_is_acknowledged_once(make_sessions) -> None:
+    sessions = make_sessions()
+    session = sessions.open()
+    sessions.append(session.id, 0, b"abc")
+    assert sessions.append(session.id, 0, b"abc").next_seq == 1
+    with pytest.raises(SessionError) as different:
+        sessions.append(session.id, 0, b"abcd")
+    assert (different.value.status, different.value.next_seq) == (409, 1)
+    with sessions.finalize(session.id) as audio:
+        assert audio.read() == b"abc"
+
+
+def test_gaps_and_early_finalize_name_the_next_chunk(make_sessions) -> None:
+    sessions = make_sessions()
+    session = sessions.open()
+    with pytest.raises(SessionError) as gap:
+        sessions.append(session.id, 1, b"late")
+    assert (gap.value.status, gap.value.next_seq) == (409, 0)
+    with pytest.raises(SessionError) as empty:
+        sessions.finalize(session.id)
+    assert empty.value.status == 400
+    sessions.append(session.id, 0, b"x")
+    with pytest.raises(SessionError) as early:
+        sessions.finalize(session.id, chunks=3)
+    assert (early.value.status, early.value.next_seq) == (409, 1)
+
+
+def test_open_sessions_are_bounded_and_expire(make_sessions) -> None:
+    sessions = make_sessions(max_sessions=1)
+    sessions.open()
+    with pytest.raises(Overloaded):
+        sessions.open()
+
+    expiring = make_sessions(ttl=0)
+    session = expiring.open()
+    with pytest.raises(SessionError) as expired:
+        expiring.get(session.id)
+    assert expired.value.status == 404
+
+
+def test_shared_sessions_take_chunks_from_any_worker(tmp_path: Path) -> None:
+    first = SharedUploadSessions(str(tmp_path))
+    second = SharedUploadSessions(str(tmp_path))
+    session = first.open()
+    first.append(session.id, 0, b"one-")
+    second.append(session.id, 1, b"two")
+    with second.finalize(session.id, chunks=2) as audio:
+        assert audio.read() == b"one-two"
+    with pytest.raises(SessionError):
+        first.append(session.id, 2, b"!")
+    # A finalized session's files are not recreated by a late chunk.
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_shared_sessions_refuse_ids_they_did_not_make(tmp_path: Path) -> None:
+    sessions = SharedUploadSessions(str(tmp_path))
+    with pytest.raises(SessionError) as unknown:
+        sessions.get("../../etc/passwd")
+    assert unknown.value.status == 404
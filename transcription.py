@@ -0,0 +1,194 @@
+from __future__ import annotations
+
+import asyncio
+import importlib.util
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import TYPE_CHECKING, Any, Callable
+
+import numpy as np
+
+from audio_prep import PreparedAudio
+from limits import Limiter
+from metrics import registry, stage
+from upstream import TRANSCRIBE_DEADLINE_SHARE, Deadline, DeadlineExceeded, transcribe_policy
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+# Default backend: "openai" (Whisper API) or "local" (faster-whisper on this machine's CPU).
+TRANSCRIBE_BACKEND = os.environ.get("TRANSCRIBE_BACKEND", "openai")
+# Transcribe locally when the API is throttled, if the local engine is installed.
+TRANSCRIBE_FALLBACK = os.environ.get("TRANSCRIBE_FALLBACK", "1") != "0"
+
+LOCAL_WHISPER_MODEL = os.environ.get("LOCAL_WHISPER_MODEL", "small")
+LOCAL_WHISPER_COMPUTE = os.environ.get("LOCAL_WHISPER_COMPUTE", "int8")
+LOCAL_WHISPER_LANGUAGE = os.environ.get("LOCAL_WHISPER_LANGUAGE", "ar")
+LOCAL_WHISPER_BEAM = int(os.environ.get("LOCAL_WHISPER_BEAM", "1"))
+# Worker processes, each holding one copy of the model, and CPU threads per worker.
+LOCAL_TRANSCRIBE_WORKERS = int(os.environ.get("LOCAL_TRANSCRIBE_WORKERS", "1"))
+LOCAL_WHISPER_THREADS = int(
+    os.environ.get("LOCAL_WHISPER_THREADS", str(max(1, (os.cpu_count() or 1) // LOCAL_TRANSCRIBE_WORKERS)))
+)
+
+transcribed_seconds = registry.counter(
+    "coach_transcribed_audio_seconds_total", "Seconds of audio transcribed, by backend (Whisper API bills per second)."
+)
+transcribe_fallbacks = registry.counter(
+    "coach_transcribe_fallbacks_total", "Recordings transcribed locally because the API was throttled, by cause."
+)
+
+
+class TranscriptionBackend:
+    """
+    Turns a prepared recording into text. `model` identifies the engine and model in
+    the transcript cache key; `encoded` says whether it needs the compressed upload
+    (data/filename) or can work from the decoded samples alone.
+    """
+
+    name = ""
+    model = ""
+    encoded = True
+
+    def available(self) -> bool:
+        return True
+
+    async def transcribe(self, audio: PreparedAudio, deadline: Deadline | None = None) -> str:
+        raise NotImplementedError
+
+
+class OpenAIBackend(TranscriptionBackend):
+    name = "openai"
+
+    def __init__(self, get_client: Callable[[], AsyncOpenAI], model: str) -> None:
+        self._get_client = get_client
+        self.model = model
+
+    async def transcribe(self, audio: PreparedAudio, deadline: Deadline | None = None) -> str:
+        client = self._get_client()
+
+        async def attempt() -> str:
+            with stage("transcribe"):
+                return await client.audio.transcriptions.create(
+                    model=self.model,
+                    # A (name, bytes) tuple goes into the multipart body without another copy.
+                    file=(audio.filename, audio.data),
+                    response_format="text",
+                )
+
+        text = await transcribe_policy.call(attempt, deadline, share=TRANSCRIBE_DEADLINE_SHARE)
+        transcribed_seconds.inc(_duration(audio), backend=self.name)
+        return text
+
+
+def _duration(audio: PreparedAudio) -> float:
+    return float(audio.stats.get("duration_out") or audio.stats.get("duration_in") or 0.0)
+
+
+# Worker-process side: one model per process, loaded by the pool initializer.
+_model: Any = None
+
+
+def _load_model(name: str, compute_type: str, threads: int) -> None:
+    global _model
+    from faster_whisper import WhisperModel
+
+    _model = WhisperModel(name, device="cpu", compute_type=compute_type, cpu_threads=threads)
+
+
+def _ping() -> bool:
+    return _model is not None
+
+
+def _run_model(audio: np.ndarray | bytes, language: str, beam_size: int) -> str:
+    # Decoded samples are 16 kHz mono float32, which faster-whisper takes as-is;
+    # anything else is decoded by the model's own audio loader.
+    source = io.BytesIO(audio) if isinstance(audio, bytes) else audio
+    segments, _ = _model.transcribe(
+        source, language=language, beam_size=beam_size, condition_on_previous_text=False
+    )
+    return " ".join(segment.text.strip() for segment in segments).strip()
+
+
+class LocalBackend(TranscriptionBackend):
+    """
+    faster-whisper (CTranslate2, int8 on CPU) in a pool of worker processes that load
+    the model once at start-up, so a transcription never blocks the event loop or
+    reloads weights. Admission goes through its own limiter, one slot per worker.
+    """
+
+    name = "local"
+    encoded = False
+
+    def __init__(self, model: str, compute_type: str, workers: int, threads: int, language: str, beam: int) -> None:
+        self.model = f"local:{model}:{compute_type}"
+        self._model_name = model
+        self._compute_type = compute_type
+        self._workers = workers
+        self._threads = threads
+        self._language = language
+        self._beam = beam
+        self._executor: ProcessPoolExecutor | None = None
+        self._installed = importlib.util.find_spec("faster_whisper") is not None
+        self.limiter = Limiter.from_env("local_transcribe", concurrency=workers)
+
+    @classmethod
+    def from_env(cls) -> "LocalBackend":
+        return cls(
+            LOCAL_WHISPER_MODEL,
+            LOCAL_WHISPER_COMPUTE,
+            LOCAL_TRANSCRIBE_WORKERS,
+            LOCAL_WHISPER_THREADS,
+            LOCAL_WHISPER_LANGUAGE,
+            LOCAL_WHISPER_BEAM,
+        )
+
+    def available(self) -> bool:
+        return self._installed
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # Spawned rather than forked: the server process has threads and open sockets.
+            self._executor = ProcessPoolExecutor(
+                max_workers=self._workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_load_model,
+                initargs=(self._model_name, self._compute_type, self._threads),
+            )
+        return self._executor
+
+    async def start(self) -> None:
+        """Start the workers and wait until each has loaded the model."""
+        if not self._installed:
+            return
+        pool = self._pool()
+        await asyncio.gather(*(asyncio.wrap_future(pool.submit(_ping)) for _ in range(self._workers)))
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def transcribe(self, audio: PreparedAudio, deadline: Deadline | None = None) -> str:
+        if not self._installed:
+            raise ValueError("Local transcription needs the faster-whisper package.")
+        source = audio.samples if audio.samples is not None else audio.data
+        timeout = deadline.remaining() * TRANSCRIBE_DEADLINE_SHARE if deadline is not None else None
+        async with self.limiter.slot(deadline.expires if deadline is not None else None):
+            with stage("transcribe_local"):
+                job = self._pool().submit(_run_model, source, self._language, self._beam)
+                try:
+                    text = await asyncio.wait_for(asyncio.wrap_future(job), timeout)
+                except asyncio.TimeoutError:
+                    # The worker finishes the job anyway; only the wait is abandoned.
+                    raise DeadlineExceeded(self.name) from None
+                except BrokenProcessPool:
+                    # A worker died (e.g. out of memory); start a fresh pool next time.
+                    self.close()
+                    raise
+        transcribed_seconds.inc(_duration(audio), backend=self.name)
+        return text
+
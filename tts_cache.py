@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import os
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict
+
+from cache import LRUCache, SingleFlight
+
+TTS_CACHE_MEMORY_BYTES = int(os.environ.get("TTS_CACHE_MEMORY_BYTES", str(32 * 1024 * 1024)))
+TTS_CACHE_DIR = os.environ.get("TTS_CACHE_DIR", ".cache/tts")
+TTS_CACHE_DISK_BYTES = int(os.environ.get("TTS_CACHE_DISK_BYTES", str(256 * 1024 * 1024)))
+# Longest a request waits on an identical one in flight before synthesizing on its own.
+TTS_FLIGHT_WAIT = float(os.environ.get("TTS_FLIGHT_WAIT", "30"))
+
+
+def tts_key(*parts: str) -> str:
+    """Content address for synthesized audio: every input that changes the output bytes."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class DiskStore:
+    """Flat directory of blobs named by key, evicting least recently used files past `max_bytes`."""
+
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.size = sum(p.stat().st_size for p in self.directory.iterdir() if p.is_file())
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key
+
+    def get(self, key: str) -> bytes | None:
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        # Bump mtime so eviction approximates LRU.
+        os.utime(path)
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        previous = path.stat().st_size if path.exists() else 0
+        tmp = path.with_suffix(".tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        self.size += len(data) - previous
+        if self.size > self.max_bytes:
+            self._evict()
+
+    def _evict(self) -> None:
+        files = sorted(
+            (p for p in self.directory.iterdir() if p.is_file() and p.suffix != ".tmp"),
+            key=lambda p: p.stat().st_mtime,
+        )
+        # Evict down to 90% so we do not rescan the directory on every write.
+        target = int(self.max_bytes * 0.9)
+        for path in files:
+            if self.size <= target:
+                break
+            try:
+                size = path.stat().st_size
+                path.unlink()
+            except FileNotFoundError:
+                continue
+            self.size -= size
+
+
+class Lead:
+    """
+    A request's duty to produce the audio for `key` after a miss. Identical requests
+    wait on `future`; resolve() it exactly once with the audio, or with None when
+    there is none, so they synthesize for themselves. `future` is None for a request
+    that stopped waiting on a stuck flight and produces the audio on its own.
+    """
+
+    def __init__(self, key: str, future: asyncio.Future | None) -> None:
+        self.key = key
+        self.future = future
+
+    def resolve(self, data: bytes | None) -> None:
+        if self.future is not None and not self.future.done():
+            self.future.set_result(data)
+
+    def abandon(self) -> None:
+        self.resolve(None)
+
+
+class TTSCache:
+    """
+    Two-tier cache for synthesized speech: a byte-bounded memory LRU in front of a disk store.
+    Concurrent misses for the same key share a single upstream call.
+    """
+
+    def __init__(
+        self, memory_bytes: int, directory: str | None, disk_bytes: int, flight_wait: float = TTS_FLIGHT_WAIT
+    ) -> None:
+        self.memory: LRUCache[bytes] = LRUCache(memory_bytes, sizeof=len)
+        self.disk: DiskStore | None = None
+        if directory:
+            try:
+                self.disk = DiskStore(directory, disk_bytes)
+            except OSError:
+                logging.exception("TTS disk cache unavailable; using memory only")
+        self._flights = SingleFlight()
+        self.flight_wait = flight_wait
+        self.disk_hits = 0
+        self.upstream_calls = 0
+
+    @classmethod
+    def from_env(cls) -> "TTSCache":
+        return cls(TTS_CACHE_MEMORY_BYTES, TTS_CACHE_DIR, TTS_CACHE_DISK_BYTES)
+
+    async def get_or_create(self, key: str, producer: Callable[[], Awaitable[bytes]]) -> bytes:
+        while True:
+            data = self.memory.get(key)
+            if data is not None:
+                return data
+            pending = self._flights.pending(key)
+            if pending is None:
+                return await self._flights.do(key, lambda: self._load_or_produce(key, producer))
+            data = await self._join(pending)
+            if data is not None:
+                return data
+            if not pending.done():
+                return await self._load_or_produce(key, producer)
+            # None: the stream this joined was cut off; produce the audio after all.
+
+    async def lookup(self, key: str) -> bytes | Lead:
+        """
+        Return cached audio, or the result of an identical request already in flight.
+        Otherwise the caller gets the Lead for `key`: it must stream the audio through
+        tee(), or abandon() the lead if it cannot, since identical requests wait on it.
+        """
+        while True:
+            data = self.memory.get(key)
+            if data is None and self.disk is not None:
+                data = await asyncio.to_thread(self.disk.get, key)
+                if data is not None:
+                    self.disk_hits += 1
+                    self.memory.set(key, data)
+            if data is not None:
+                return data
+            pending = self._flights.pending(key)
+            if pending is None:
+                return Lead(key, self._flights.lead(key))
+            data = await self._join(pending)
+            if data is not None:
+                return data
+            if not pending.done():
+                return Lead(key, None)
+
+    async def _join(self, pending: asyncio.Future) -> bytes | None:
+        """The audio of an identical request in flight; None if it has none or is not done within flight_wait."""
+        self._flights.coalesced += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(pending), self.flight_wait)
+        except asyncio.TimeoutError:
+            logging.warning("Identical TTS request still running after %.0fs; synthesizing separately", self.flight_wait)
+            return None
+
+    async def tee(self, lead: Lead, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """
+        Pass upstream chunks through to the client as they arrive and store the
+        assembled audio once the stream completes. Identical requests arriving
+        meanwhile wait for this stream instead of calling upstream again.
+        """
+        self.upstream_calls += 1
+        buffer = bytearray()
+        try:
+            async for chunk in chunks:
+                buffer.extend(chunk)
+                yield chunk
+            data = bytes(buffer)
+            lead.resolve(data)
+        finally:
+            # Client went away or upstream failed mid-stream; nothing to cache. The
+            # waiters get None rather than a cancellation and fall back to their own call.
+            lead.abandon()
+        await self._store(lead.key, data)
+
+    async def _store(self, key: str, data: bytes) -> None:
+        self.memory.set(key, data)
+        if self.disk is not None:
+            try:
+                await asyncio.to_thread(self.disk.put, key, data)
+            except OSError:
+                logging.exception("Failed to write TTS cache entry")
+
+    async def _load_or_produce(self, key: str, producer: Callable[[], Awaitable[bytes]]) -> bytes:
+        if self.disk is not None:
+            data = await asyncio.to_thread(self.disk.get, key)
+            if data is not None:
+                self.disk_hits += 1
+                self.memory.set(key, data)
+                return data
+
+        self.upstream_calls += 1
+        data = await producer()
+        await self._store(key, data)
+        return data
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "memory": self.memory.stats(),
+            "disk": (
+                {"size": self.disk.size, "max_size": self.disk.max_bytes, "hits": self.disk_hits}
+                if self.disk is not None
+                else None
+            ),
+            "upstream_calls": self.upstream_calls,
+            "coalesced": self._flights.coalesced,
+        }
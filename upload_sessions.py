@@ -0,0 +1,309 @@
+from __future__ import annotations
+
+import fcntl
+import os
+import re
+import secrets
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from tempfile import SpooledTemporaryFile
+from typing import Any, BinaryIO, Dict, Iterator, List, Tuple
+
+from limits import Overloaded
+from metrics import registry
+from uploads import TOO_LARGE, UPLOAD_MAX_BYTES, UPLOAD_SPOOL_BYTES
+
+# Open sessions per process; each buffers at most UPLOAD_SPOOL_BYTES in memory before spooling to disk.
+UPLOAD_SESSIONS_MAX = int(os.environ.get("UPLOAD_SESSIONS_MAX", "256"))
+# Largest single chunk; a recorder timeslice of a second or two is a few kilobytes.
+UPLOAD_CHUNK_MAX_BYTES = int(os.environ.get("UPLOAD_CHUNK_MAX_BYTES", str(1024 * 1024)))
+# A session with no chunk for this long is dropped, together with what it buffered.
+UPLOAD_SESSION_TTL = float(os.environ.get("UPLOAD_SESSION_TTL", "120"))
+# Directory shared by every worker process of this host, so any of them can take any chunk
+# of a session (gunicorn.conf.py sets it when running several); unset keeps sessions in memory.
+UPLOAD_SESSION_DIR = os.environ.get("UPLOAD_SESSION_DIR", "")
+
+_SESSION_ID = re.compile(r"[A-Za-z0-9_-]{16,64}")
+
+session_events = registry.counter("coach_upload_sessions_total", "Chunked upload sessions, by outcome.")
+
+
+class SessionError(Exception):
+    """A chunk or finalize the session cannot accept; `status` is the HTTP status to answer with."""
+
+    def __init__(self, message: str, status: int, next_seq: int | None = None) -> None:
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.next_seq = next_seq
+
+
+class UploadSession:
+    """
+    One recording arriving in numbered chunks, appended in order to a spooled file.
+    Chunk sizes are kept so a chunk resent after a lost response is recognised and
+    acknowledged instead of being written twice.
+    """
+
+    def __init__(self, session_id: str) -> None:
+        self.id = session_id
+        self.file: BinaryIO = SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES)
+        self.sizes: List[int] = []
+        self.size = 0
+        self.touched = time.monotonic()
+
+    @property
+    def next_seq(self) -> int:
+        return len(self.sizes)
+
+    def append(self, seq: int, data: bytes) -> bool:
+        """Write chunk `seq`; False when it is a repeat of a chunk already written."""
+        if seq < self.next_seq:
+            if self.sizes[seq] != len(data):
+                raise SessionError(f"Chunk {seq} was already received with a different size.", 409, self.next_seq)
+            return False
+        if seq > self.next_seq:
+            raise SessionError(f"Expected chunk {self.next_seq}.", 409, self.next_seq)
+        if self.size + len(data) > UPLOAD_MAX_BYTES:
+            raise SessionError(TOO_LARGE, 413)
+        self.file.write(data)
+        self.sizes.append(len(data))
+        self.size += len(data)
+        self.touched = time.monotonic()
+        return True
+
+    def status(self) -> Dict[str, Any]:
+        remaining = max(0.0, self.touched + UPLOAD_SESSION_TTL - time.monotonic())
+        return {"upload_id": self.id, "next_seq": self.next_seq, "bytes": self.size, "expires_in": round(remaining, 1)}
+
+
+class UploadSessions:
+    """
+    Open chunked uploads of this process, bounded in number and idle time, in the
+    order they were last written to (so expiry only ever looks at the front).
+    """
+
+    def __init__(self, max_sessions: int = UPLOAD_SESSIONS_MAX, ttl: float = UPLOAD_SESSION_TTL) -> None:
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions: OrderedDict[str, UploadSession] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def open(self) -> UploadSession:
+        self._expire()
+        if len(self._sessions) >= self.max_sessions:
+            session_events.inc(outcome="refused")
+            raise Overloaded("upload_sessions", "too many open uploads", self.ttl / 4, 503)
+        session = UploadSession(secrets.token_urlsafe(16))
+        self._sessions[session.id] = session
+        session_events.inc(outcome="opened")
+        return session
+
+    def get(self, session_id: str) -> UploadSession:
+        self._expire()
+        session = self._sessions.get(session_id)
+        if session is None:
+            raise SessionError("Unknown or expired upload_id.", 404)
+        return session
+
+    def append(self, session_id: str, seq: int, data: bytes) -> UploadSession:
+        session = self.get(session_id)
+        if session.append(seq, data):
+            self._sessions.move_to_end(session_id)
+        return session
+
+    def finalize(self, session_id: str, chunks: int | None = None) -> BinaryIO:
+        """
+        Take the assembled recording out of the session, rewound; the caller closes it.
+        With `chunks`, refuses (409, naming the next chunk) until that many have arrived.
+        """
+        session = self.get(session_id)
+        if chunks is not None and session.next_seq != chunks:
+            raise SessionError(f"Received {session.next_seq} of {chunks} chunks.", 409, session.next_seq)
+        if not session.size:
+            raise SessionError("Empty audio file received.", 400)
+        del self._sessions[session_id]
+        session_events.inc(outcome="finalized")
+        session.file.seek(0)
+        return session.file
+
+    def discard(self, session_id: str) -> None:
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            session.file.close()
+            session_events.inc(outcome="discarded")
+
+    def buffered_bytes(self) -> int:
+        return sum(session.size for session in self._sessions.values())
+
+    def _expire(self) -> None:
+        cutoff = time.monotonic() - self.ttl
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if session.touched > cutoff:
+                break
+            del self._sessions[session.id]
+            session.file.close()
+            session_events.inc(outcome="expired")
+
+
+@dataclass
+class SharedSession:
+    """A session of SharedUploadSessions as one request left it."""
+
+    id: str
+    sizes: List[int]
+    touched: float  # time.time() of the last write
+
+    @property
+    def next_seq(self) -> int:
+        return len(self.sizes)
+
+    def status(self) -> Dict[str, Any]:
+        remaining = max(0.0, self.touched + UPLOAD_SESSION_TTL - time.time())
+        return {
+            "upload_id": self.id,
+            "next_seq": self.next_seq,
+            "bytes": sum(self.sizes),
+            "expires_in": round(remaining, 1),
+        }
+
+
+class SharedUploadSessions:
+    """
+    Chunked uploads kept as files in a directory all workers of the host share, so
+    consecutive chunks of one recording may reach different workers. `<id>.part`
+    holds the chunks written so far and `<id>.sizes` their sizes, one per line; both
+    change only under an exclusive lock on the .part file. Bounded in number and idle
+    time like UploadSessions, by file modification time.
+    """
+
+    def __init__(
+        self, directory: str, max_sessions: int = UPLOAD_SESSIONS_MAX, ttl: float = UPLOAD_SESSION_TTL
+    ) -> None:
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self.directory.glob("*.part"))
+
+    def _paths(self, session_id: str) -> Tuple[Path, Path]:
+        # The id names files; anything but a token this class made is unknown.
+        if not _SESSION_ID.fullmatch(session_id):
+            raise SessionError("Unknown or expired upload_id.", 404)
+        return self.directory / f"{session_id}.part", self.directory / f"{session_id}.sizes"
+
+    @contextmanager
+    def _locked(self, session_id: str) -> Iterator[Tuple[BinaryIO, SharedSession]]:
+        data, sizes = self._paths(session_id)
+        try:
+            # Without O_CREAT: a finalized or expired session must stay gone.
+            file = os.fdopen(os.open(data, os.O_WRONLY | os.O_APPEND), "ab")
+        except FileNotFoundError:
+            raise SessionError("Unknown or expired upload_id.", 404) from None
+        with file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                # Finalized or expired by another worker between the open and the lock.
+                if os.fstat(file.fileno()).st_nlink == 0:
+                    raise FileNotFoundError(data)
+                recorded = [int(line) for line in sizes.read_text().split()]
+            except FileNotFoundError:
+                raise SessionError("Unknown or expired upload_id.", 404) from None
+            yield file, SharedSession(session_id, recorded, os.fstat(file.fileno()).st_mtime)
+
+    def open(self) -> SharedSession:
+        self._expire()
+        if len(self) >= self.max_sessions:
+            session_events.inc(outcome="refused")
+            raise Overloaded("upload_sessions", "too many open uploads", self.ttl / 4, 503)
+        session_id = secrets.token_urlsafe(16)
+        data, sizes = self._paths(session_id)
+        sizes.touch()
+        data.touch(exist_ok=False)
+        session_events.inc(outcome="opened")
+        return SharedSession(session_id, [], time.time())
+
+    def get(self, session_id: str) -> SharedSession:
+        with self._locked(session_id) as (_, session):
+            if session.touched <= time.time() - self.ttl:
+                self.discard(session_id, outcome="expired")
+                raise SessionError("Unknown or expired upload_id.", 404)
+            return session
+
+    def append(self, session_id: str, seq: int, data: bytes) -> SharedSession:
+        with self._locked(session_id) as (file, session):
+            if seq < session.next_seq:
+                if session.sizes[seq] != len(data):
+                    raise SessionError(
+                        f"Chunk {seq} was already received with a different size.", 409, session.next_seq
+                    )
+                return session
+            if seq > session.next_seq:
+                raise SessionError(f"Expected chunk {session.next_seq}.", 409, session.next_seq)
+            if sum(session.sizes) + len(data) > UPLOAD_MAX_BYTES:
+                raise SessionError(TOO_LARGE, 413)
+            file.write(data)
+            file.flush()
+            with open(self._paths(session_id)[1], "a") as sizes:
+                sizes.write(f"{len(data)}\n")
+            session.sizes.append(len(data))
+            session.touched = time.time()
+            return session
+
+    def finalize(self, session_id: str, chunks: int | None = None) -> BinaryIO:
+        """As UploadSessions.finalize; the returned file is already unlinked."""
+        with self._locked(session_id) as (_, session):
+            if chunks is not None and session.next_seq != chunks:
+                raise SessionError(f"Received {session.next_seq} of {chunks} chunks.", 409, session.next_seq)
+            if not session.sizes:
+                raise SessionError("Empty audio file received.", 400)
+            data, sizes = self._paths(session_id)
+            audio = open(data, "rb")
+            data.unlink()
+            sizes.unlink(missing_ok=True)
+            session_events.inc(outcome="finalized")
+            return audio
+
+    def discard(self, session_id: str, outcome: str = "discarded") -> None:
+        try:
+            paths = self._paths(session_id)
+        except SessionError:
+            return
+        if paths[0].exists():
+            for path in paths:
+                path.unlink(missing_ok=True)
+            session_events.inc(outcome=outcome)
+
+    def buffered_bytes(self) -> int:
+        return sum(path.stat().st_size for path in self.directory.glob("*.part") if path.exists())
+
+    def _expire(self) -> None:
+        cutoff = time.time() - self.ttl
+        for path in self.directory.glob("*.part"):
+            try:
+                if path.stat().st_mtime <= cutoff:
+                    self.discard(path.stem, outcome="expired")
+            except FileNotFoundError:
+                pass
+
+
+upload_sessions: UploadSessions | SharedUploadSessions = (
+    SharedUploadSessions(UPLOAD_SESSION_DIR) if UPLOAD_SESSION_DIR else UploadSessions()
+)
+
+registry.gauge_callback(
+    "coach_upload_sessions_open", "Chunked uploads opened and not yet finalized.", lambda: [({}, len(upload_sessions))]
+)
+registry.gauge_callback(
+    "coach_upload_sessions_bytes",
+    "Bytes buffered by open chunked uploads.",
+    lambda: [({}, upload_sessions.buffered_bytes())],
+)
@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import os
+import time
+from typing import Any, Dict, Iterable
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from starlette.formparsers import MultiPartParser
+
+from metrics import record
+
+# Largest request body accepted on upload routes (the recording plus a few form fields).
+UPLOAD_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", str(16 * 1024 * 1024)))
+# Uploaded files larger than this are spooled to a temporary file instead of memory.
+UPLOAD_SPOOL_BYTES = int(os.environ.get("UPLOAD_SPOOL_BYTES", str(1024 * 1024)))
+
+# Starlette reads this when it creates each upload's SpooledTemporaryFile.
+MultiPartParser.max_file_size = UPLOAD_SPOOL_BYTES
+
+TOO_LARGE = "הקובץ גדול מדי."
+
+
+class UploadLimitMiddleware:
+    """
+    Enforces UPLOAD_MAX_BYTES on the given paths while the body streams in: a declared
+    Content-Length over the cap is refused before reading anything, and a chunked body
+    is cut off with 413 as soon as it crosses it. Also records how long the body took
+    to arrive as the `upload_read` stage.
+    """
+
+    def __init__(self, app: Any, paths: Iterable[str], max_bytes: int = UPLOAD_MAX_BYTES) -> None:
+        self.app = app
+        self.paths = frozenset(paths)
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        declared = headers.get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > self.max_bytes:
+            await JSONResponse({"detail": TOO_LARGE}, status_code=413)(scope, receive, send)
+            return
+
+        received = 0
+        started: float | None = None
+
+        async def limited_receive() -> Dict[str, Any]:
+            nonlocal received, started
+            message = await receive()
+            if message["type"] == "http.request":
+                if started is None:
+                    started = time.perf_counter()
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # FastAPI re-raises HTTPExceptions from body parsing as-is.
+                    raise HTTPException(status_code=413, detail=TOO_LARGE)
+                if not message.get("more_body", False):
+                    record("upload_read", time.perf_counter() - started)
+            return message
+
+        await self.app(scope, limited_receive, send)
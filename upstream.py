@@ -0,0 +1,246 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import os
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Tuple, Type, TypeVar
+
+from limits import Limiter, audio_limiter, evaluate_limiter, transcribe_limiter, tts_limiter
+from metrics import registry
+
+T = TypeVar("T")
+
+# End-to-end budget per request, shared by every upstream call it makes.
+ANALYZE_DEADLINE = float(os.environ.get("ANALYZE_DEADLINE", "30"))
+TTS_DEADLINE = float(os.environ.get("TTS_DEADLINE", "20"))
+# Most of the analysis deadline Whisper may use, so the evaluation always keeps some.
+TRANSCRIBE_DEADLINE_SHARE = float(os.environ.get("TRANSCRIBE_DEADLINE_SHARE", "0.6"))
+
+UPSTREAM_RETRIES = int(os.environ.get("UPSTREAM_RETRIES", "2"))
+RETRY_BASE_DELAY = float(os.environ.get("RETRY_BASE_DELAY", "0.2"))
+RETRY_MAX_DELAY = float(os.environ.get("RETRY_MAX_DELAY", "2"))
+# Retries allowed per first attempt, plus a reserve for an idle service.
+RETRY_BUDGET_RATIO = float(os.environ.get("RETRY_BUDGET_RATIO", "0.2"))
+RETRY_BUDGET_MIN = float(os.environ.get("RETRY_BUDGET_MIN", "10"))
+
+# Send a second, identical request when the first is slower than the recent p95.
+UPSTREAM_HEDGE = os.environ.get("UPSTREAM_HEDGE", "1") != "0"
+HEDGE_MIN_DELAY = float(os.environ.get("HEDGE_MIN_DELAY", "0.2"))
+HEDGE_MIN_SAMPLES = 20
+
+
+@functools.cache
+def retryable() -> Tuple[Type[BaseException], ...]:
+    """
+    Failures worth another attempt; anything else (bad request, auth) would fail again.
+    A function so openai (and httpx under it) is imported with the first client, not at startup.
+    """
+    import openai
+
+    return (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError, asyncio.TimeoutError)
+
+
+@functools.cache
+def rate_limited() -> Type[BaseException]:
+    """The API's 429, on which callers with another way to the result take it."""
+    import openai
+
+    return openai.RateLimitError
+
+
+attempts = registry.counter("coach_upstream_attempts_total", "Upstream call attempts, by outcome.")
+retries = registry.counter("coach_upstream_retries_total", "Upstream attempts made as retries, by reason.")
+hedges = registry.counter("coach_upstream_hedges_total", "Hedged upstream calls, by the attempt that answered first.")
+deadlines = registry.counter("coach_deadline_exceeded_total", "Upstream calls given up on after timing out.")
+
+
+class DeadlineExceeded(Exception):
+    """The request ran out of time in `op`; nothing more was attempted."""
+
+    def __init__(self, op: str) -> None:
+        super().__init__(f"{op}: deadline exceeded")
+        self.op = op
+
+
+class Deadline:
+    """A request's cutoff as a time.monotonic() value, shared by all of its stages."""
+
+    def __init__(self, seconds: float) -> None:
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires - time.monotonic())
+
+
+class RetryBudget:
+    """
+    Caps retries at a fraction of first attempts, so a failing upstream sees a bounded
+    amount of extra traffic: every call deposits `ratio` and every retry withdraws one.
+    """
+
+    def __init__(self, ratio: float, minimum: float) -> None:
+        self.ratio = ratio
+        self.capacity = max(minimum, 1.0)
+        self.balance = self.capacity
+
+    def deposit(self) -> None:
+        self.balance = min(self.capacity, self.balance + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.balance < 1:
+            return False
+        self.balance -= 1
+        return True
+
+
+class UpstreamPolicy:
+    """
+    Timeouts, retries and hedging for one upstream operation. Each attempt holds a slot
+    of the operation's limiter, so hedges and retries count against its concurrency.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        limiter: Limiter,
+        attempt_timeout: float,
+        retries: int = UPSTREAM_RETRIES,
+        hedge: bool = UPSTREAM_HEDGE,
+    ) -> None:
+        self.name = name
+        self.limiter = limiter
+        self.attempt_timeout = attempt_timeout
+        self.retries = retries
+        self.hedge = hedge
+        self.budget = RetryBudget(RETRY_BUDGET_RATIO, RETRY_BUDGET_MIN)
+        # Durations of recent successful attempts, for the hedge threshold.
+        self._latencies: Deque[float] = deque(maxlen=200)
+
+    @classmethod
+    def from_env(
+        cls, name: str, limiter: Limiter, attempt_timeout: float, hedge: bool = UPSTREAM_HEDGE
+    ) -> "UpstreamPolicy":
+        timeout = float(os.environ.get(f"UPSTREAM_TIMEOUT_{name.upper()}", str(attempt_timeout)))
+        return cls(name, limiter, timeout, hedge=hedge)
+
+    def hedge_delay(self) -> float | None:
+        """The running p95 attempt time, or None until there are enough samples."""
+        if not self.hedge or len(self._latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self._latencies)
+        return max(HEDGE_MIN_DELAY, ordered[int(len(ordered) * 0.95) - 1])
+
+    async def call(
+        self,
+        attempt: Callable[[], Awaitable[T]],
+        deadline: Deadline | None = None,
+        share: float = 1.0,
+        hedge: bool = True,
+        slot: bool = True,
+        retry_if: Callable[[], bool] | None = None,
+    ) -> T:
+        """
+        Run `attempt` until it succeeds, within `share` of the deadline's remaining time.
+        `hedge=False` for calls with side effects (e.g. a stream already being relayed),
+        `slot=False` when the caller holds the limiter slot itself, and `retry_if` vetoes
+        a retry once the failed attempt did something that cannot be repeated.
+        Raises DeadlineExceeded when time runs out, otherwise the last attempt's error.
+        """
+        self.budget.deposit()
+        stage_end = time.monotonic() + (self.attempt_timeout if deadline is None else deadline.remaining() * share)
+        number = 0
+        while True:
+            timeout = min(self.attempt_timeout, stage_end - time.monotonic())
+            if timeout <= 0:
+                deadlines.inc(op=self.name)
+                raise DeadlineExceeded(self.name)
+            try:
+                result = await asyncio.wait_for(self._race(attempt, stage_end, hedge, slot), timeout)
+            except retryable() as exc:
+                timed_out = isinstance(exc, asyncio.TimeoutError)
+                attempts.inc(op=self.name, outcome="timeout" if timed_out else "error")
+                delay = self._backoff(number, exc)
+                if time.monotonic() + delay >= stage_end:
+                    deadlines.inc(op=self.name)
+                    raise DeadlineExceeded(self.name) from exc
+                if number >= self.retries or (retry_if is not None and not retry_if()) or not self.budget.withdraw():
+                    if timed_out:
+                        deadlines.inc(op=self.name)
+                        raise DeadlineExceeded(self.name) from exc
+                    raise
+                retries.inc(op=self.name, reason=type(exc).__name__)
+                await asyncio.sleep(delay)
+                number += 1
+                continue
+            attempts.inc(op=self.name, outcome="ok")
+            return result
+
+    def _backoff(self, number: int, exc: BaseException) -> float:
+        """Full-jitter exponential backoff, stretched to the upstream's Retry-After if it sent one."""
+        delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2**number))
+        response = getattr(exc, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        try:
+            return max(delay, float(retry_after)) if retry_after else delay
+        except ValueError:
+            return delay
+
+    async def _attempt(self, attempt: Callable[[], Awaitable[T]], stage_end: float, slot: bool) -> T:
+        if not slot:
+            return await attempt()
+        async with self.limiter.slot(stage_end):
+            started = time.monotonic()
+            result = await attempt()
+            self._latencies.append(time.monotonic() - started)
+            return result
+
+    async def _race(self, attempt: Callable[[], Awaitable[T]], stage_end: float, hedge: bool, slot: bool) -> T:
+        delay = self.hedge_delay() if hedge and slot else None
+        primary = asyncio.ensure_future(self._attempt(attempt, stage_end, slot))
+        if delay is None:
+            return await primary
+        tasks = {primary: "primary"}
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            # Never hedge into a saturated limiter; the extra request would only queue.
+            if done or self.limiter.in_flight >= self.limiter.concurrency:
+                return await primary
+            tasks[asyncio.ensure_future(self._attempt(attempt, stage_end, slot))] = "hedge"
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        hedges.inc(op=self.name, winner=tasks[task])
+                        return task.result()
+            # Both failed; report the original request's error.
+            return primary.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+transcribe_policy = UpstreamPolicy.from_env("transcribe", transcribe_limiter, 15)
+evaluate_policy = UpstreamPolicy.from_env("evaluate", evaluate_limiter, 20)
+tts_policy = UpstreamPolicy.from_env("tts", tts_limiter, 15)
+# The audio model listens and evaluates in one call, so it gets the two stages' time combined.
+audio_policy = UpstreamPolicy.from_env("audio", audio_limiter, 25)
+# Several evaluations in one call (batch analysis): slower by nature, so kept out of the
+# single evaluation's latency window, and never hedged since a duplicate costs the whole pack.
+evaluate_pack_policy = UpstreamPolicy.from_env("evaluate_pack", evaluate_limiter, 40, hedge=False)
+
+_policies = (transcribe_policy, evaluate_policy, tts_policy, audio_policy, evaluate_pack_policy)
+
+registry.gauge_callback(
+    "coach_upstream_hedge_delay_seconds",
+    "Attempt time after which a hedge is sent (the running p95).",
+    lambda: [({"op": p.name}, delay) for p in _policies if (delay := p.hedge_delay()) is not None],
+)
+registry.gauge_callback(
+    "coach_upstream_retry_budget",
+    "Retries currently available per operation.",
+    lambda: [({"op": p.name}, round(p.budget.balance, 2)) for p in _policies],
+)